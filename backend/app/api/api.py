@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.endpoints import auth, chat, user, sync, config
+from app.api.endpoints import auth, chat, user, sync, config, metrics
 
 # API路由
 api_router = APIRouter()
@@ -19,3 +19,6 @@ api_router.include_router(sync.router, prefix="/sync", tags=["会话同步"])
 
 # 配置路由
 api_router.include_router(config.router, prefix="/config", tags=["配置"])
+
+# 指标路由
+api_router.include_router(metrics.router, prefix="/metrics", tags=["指标"])
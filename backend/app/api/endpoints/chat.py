@@ -1,32 +1,51 @@
-from typing import Union
+from typing import Union, Optional
 import logging
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Header, Query, Request, status
 from fastapi.responses import StreamingResponse, JSONResponse
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_async_db, get_current_active_user
+from app.api.deps import get_current_active_user
+from app.core.config import settings
 from app.models.user import User
 from app.schemas.chat import ChatRequest
-from app.services.chat_service import post_chat_service
+from app.services.chat_service import (
+    encode_stream_events,
+    get_or_create_chat_stream,
+    post_chat_service,
+    subscribe_chat_stream,
+)
+from app.services.deepseek.message_processor import MessageProcessor
+from app.services.stream import stream_registry, stream_relay
 from app.utils.response_formatter import create_standard_response
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# SSE响应的通用响应头
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Connection": "keep-alive",
+    "Content-Encoding": "identity",
+}
+
 
 @router.post("/stream", response_model=None)
 async def create_chat(
     request: ChatRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_async_db),
+    sse_version: Optional[int] = Query(default=None, description="SSE帧格式版本"),
+    x_sse_version: Optional[int] = Header(default=None, description="SSE帧格式版本"),
 ) -> Union[StreamingResponse, JSONResponse]:
     """
     创建新的聊天对话，以SSE流的形式返回响应
 
     Args:
         request: 聊天请求，包含当前消息、上下文消息、模型信息等
+        http_request: 原始HTTP请求，用于检测客户端断开
         current_user: 当前登录用户
-        db: 数据库会话
+        sse_version: 查询参数中请求的SSE帧格式版本，优先于请求头
+        x_sse_version: 请求头X-SSE-Version中请求的SSE帧格式版本，默认v1
 
     Returns:
         StreamingResponse: 以SSE格式流式返回聊天响应
@@ -34,16 +53,25 @@ async def create_chat(
         JSONResponse: 发生错误时的标准化响应
     """
     try:
+        # 协商SSE帧格式版本，未指定时使用v1
+        version = MessageProcessor.negotiate_version(
+            sse_version if sse_version is not None else x_sse_version
+        )
+
+        # 注册聊天流（相同请求正在生成时复用已有的流），流ID通过响应头返回，可用于中止生成
+        stream = get_or_create_chat_stream(request, current_user.id)
+
         # 调用聊天服务处理请求
         return StreamingResponse(
-            post_chat_service(request, db, current_user.id),
+            post_chat_service(
+                request,
+                current_user.id,
+                sse_version=version,
+                stream=stream,
+                is_disconnected=http_request.is_disconnected,
+            ),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "X-Accel-Buffering": "no",
-                "Connection": "keep-alive",
-                "Content-Encoding": "identity",
-            },
+            headers={"X-Stream-ID": stream.stream_id, **SSE_HEADERS},
         )
     except Exception as e:
         logger.error(f"聊天处理异常: {str(e)}", exc_info=True)
@@ -51,3 +79,119 @@ async def create_chat(
             message=f"聊天处理失败: {str(e)}",
             actual_status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
+
+
+@router.get("/stream/{stream_id}", response_model=None)
+async def resume_chat(
+    stream_id: str,
+    http_request: Request,
+    current_user: User = Depends(get_current_active_user),
+    last_event_id: Optional[int] = Query(default=None, description="已收到的最后一个事件ID"),
+    last_event_id_header: Optional[int] = Header(default=None, alias="Last-Event-ID"),
+    sse_version: Optional[int] = Query(default=None, description="SSE帧格式版本"),
+    x_sse_version: Optional[int] = Header(default=None, description="SSE帧格式版本"),
+) -> Union[StreamingResponse, JSONResponse]:
+    """
+    重连或共享正在进行（或刚结束）的聊天生成
+
+    从Last-Event-ID之后的事件开始重放，然后继续实时接收，不会重新调用模型。
+    同一用户的多个设备可以同时订阅同一个聊天流，请求落到其他工作进程时转发给拥有该流的工作进程
+
+    Args:
+        stream_id: 聊天流ID，由创建聊天时的X-Stream-ID响应头返回
+        http_request: 原始HTTP请求，用于检测客户端断开
+        current_user: 当前登录用户
+        last_event_id: 查询参数中已收到的最后一个事件ID，优先于请求头
+        last_event_id_header: 请求头Last-Event-ID中已收到的最后一个事件ID
+        sse_version: 查询参数中请求的SSE帧格式版本，优先于请求头
+        x_sse_version: 请求头X-SSE-Version中请求的SSE帧格式版本，默认v1
+
+    Returns:
+        StreamingResponse: 以SSE格式流式返回聊天响应
+        或
+        JSONResponse: 聊天流不存在，或由其他工作进程持有但未启用转发时的标准化响应
+    """
+    version = MessageProcessor.negotiate_version(
+        sse_version if sse_version is not None else x_sse_version
+    )
+    resume_from = last_event_id if last_event_id is not None else last_event_id_header
+
+    if stream_registry.is_local(stream_id):
+        stream = stream_registry.get(stream_id)
+        if not stream or stream.user_id != current_user.id:
+            return create_standard_response(
+                message="聊天流不存在或已过期",
+                actual_status_code=status.HTTP_404_NOT_FOUND,
+            )
+        frames = subscribe_chat_stream(
+            stream,
+            sse_version=version,
+            last_event_id=resume_from or 0,
+            is_disconnected=http_request.is_disconnected,
+        )
+    else:
+        if not settings.SSE_STREAM_RELAY_ENABLED:
+            return create_standard_response(
+                message="聊天流由其他工作进程持有，未启用跨进程转发，无法在此重连",
+                actual_status_code=status.HTTP_409_CONFLICT,
+            )
+        subscription = await stream_relay.subscribe(
+            stream_id,
+            current_user.id,
+            last_event_id=resume_from or 0,
+            is_disconnected=http_request.is_disconnected,
+        )
+        if subscription is None:
+            return create_standard_response(
+                message="聊天流不存在或已过期",
+                actual_status_code=status.HTTP_404_NOT_FOUND,
+            )
+        frames = encode_stream_events(subscription, version)
+
+    logger.info(
+        f"用户 {current_user.id} 订阅聊天流 {stream_id}，从事件 {resume_from or 0} 之后开始"
+    )
+
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={"X-Stream-ID": stream_id, **SSE_HEADERS},
+    )
+
+
+@router.delete("/stream/{stream_id}", response_model=None)
+async def abort_chat(
+    stream_id: str,
+    current_user: User = Depends(get_current_active_user),
+) -> JSONResponse:
+    """
+    中止正在进行的聊天生成，可以从其他连接或设备发起，请求落到其他工作进程时转发给拥有该流的工作进程
+
+    Args:
+        stream_id: 聊天流ID，由创建聊天时的X-Stream-ID响应头返回
+        current_user: 当前登录用户
+
+    Returns:
+        JSONResponse: 标准化响应
+    """
+    if stream_registry.is_local(stream_id):
+        cancelled = stream_registry.cancel(stream_id, current_user.id)
+    elif settings.SSE_STREAM_RELAY_ENABLED:
+        cancelled = await stream_relay.cancel(stream_id, current_user.id)
+    else:
+        return create_standard_response(
+            message="聊天流由其他工作进程持有，未启用跨进程转发，无法在此中止",
+            actual_status_code=status.HTTP_409_CONFLICT,
+        )
+
+    if not cancelled:
+        return create_standard_response(
+            message="聊天流不存在或已结束",
+            actual_status_code=status.HTTP_404_NOT_FOUND,
+        )
+
+    logger.info(f"用户 {current_user.id} 中止了聊天流 {stream_id}")
+    return create_standard_response(
+        result={"stream_id": stream_id},
+        message="聊天生成已中止",
+    )
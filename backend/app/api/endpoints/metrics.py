@@ -0,0 +1,122 @@
+import logging
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from app.api.deps import get_current_active_user
+from app.models.user import User
+from app.services.cache import near_duplicate_cache, response_cache
+from app.services.deepseek.prompt_prefix import prompt_cache_stats
+from app.services.mcp.replica_set import replica_health
+from app.services.mcp.spare_workers import spare_worker_pool
+from app.services.mcp.supervisor import mcp_supervisor
+from app.services.mcp.tool_catalog import tool_catalog
+from app.services.mcp.tool_list_cache import tool_list_cache
+from app.services.mcp.user_client_pool import user_client_pool
+from app.services.upstream import (
+    admission_controller,
+    circuit_breakers,
+    upstream_router,
+    upstream_scheduler,
+)
+from app.utils.response_formatter import create_standard_response
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+@router.get("/upstream", response_model=None)
+async def get_upstream_metrics(
+    current_user: User = Depends(get_current_active_user),
+) -> JSONResponse:
+    """
+    获取当前工作进程的上游调用指标
+
+    包括准入控制的并发数、等待队列深度和等待时间，调度器各优先级类别的等待时间和首token延迟，上游熔断器状态，以及各上游端点的健康状态和首字节延迟
+
+    Args:
+        current_user: 当前登录用户
+
+    Returns:
+        JSONResponse: 标准化响应，result中包含各项指标
+    """
+    return create_standard_response(
+        result={
+            "admission": admission_controller.metrics(),
+            "scheduler": upstream_scheduler.metrics(),
+            "circuit_breakers": circuit_breakers.metrics(),
+            "endpoints": upstream_router.metrics(),
+        },
+        message="获取上游指标成功",
+    )
+
+
+@router.get("/cache", response_model=None)
+async def get_cache_metrics(
+    current_user: User = Depends(get_current_active_user),
+) -> JSONResponse:
+    """
+    获取当前工作进程的响应缓存指标
+
+    Args:
+        current_user: 当前登录用户
+
+    Returns:
+        JSONResponse: 标准化响应，result中包含各缓存的条目数、占用字节数、命中率，近似重复缓存的误判审计样本（只含问题摘要和长度，不含其他用户的问题原文），以及每个工具的估算token数
+    """
+    return create_standard_response(
+        result={
+            "response": response_cache.metrics(),
+            "near_duplicate": near_duplicate_cache.metrics(),
+            "tool_catalog": tool_catalog.metrics(),
+        },
+        message="获取缓存指标成功",
+    )
+
+
+@router.get("/prompt-cache", response_model=None)
+async def get_prompt_cache_metrics(
+    current_user: User = Depends(get_current_active_user),
+) -> JSONResponse:
+    """
+    获取当前工作进程的DeepSeek上下文缓存命中率，分别按模型汇总所有用户和当前用户
+
+    Args:
+        current_user: 当前登录用户
+
+    Returns:
+        JSONResponse: 标准化响应，result中包含各模型的请求数、命中与未命中token数和命中率
+    """
+    return create_standard_response(
+        result={
+            "all": prompt_cache_stats.metrics(),
+            "me": prompt_cache_stats.metrics(user_id=current_user.id),
+        },
+        message="获取上下文缓存指标成功",
+    )
+
+
+@router.get("/mcp", response_model=None)
+async def get_mcp_metrics(
+    current_user: User = Depends(get_current_active_user),
+) -> JSONResponse:
+    """
+    获取当前工作进程的MCP服务器指标
+
+    Args:
+        current_user: 当前登录用户
+
+    Returns:
+        JSONResponse: 标准化响应，result中包含受监管MCP服务器的状态、重启次数和熔断器状态，
+        各MCP副本的摘除状态、进行中的调用数、EWMA延迟和失败次数，工具列表缓存的命中和后台刷新情况，用户MCP客户端池的复用和淘汰情况，
+        以及预热工作进程池的大小和命中情况
+    """
+    return create_standard_response(
+        result={
+            "servers": mcp_supervisor.metrics(),
+            "replicas": replica_health.metrics(),
+            "tool_lists": tool_list_cache.metrics(),
+            "user_clients": user_client_pool.metrics(),
+            "spare_workers": spare_worker_pool.metrics(),
+        },
+        message="获取MCP指标成功",
+    )
@@ -4,6 +4,12 @@ from contextlib import asynccontextmanager
 
 from app.api.api import api_router
 from app.core.config import settings
+from app.services.mcp.models import MCPClientMode
+from app.services.mcp.spare_workers import spare_worker_pool
+from app.services.mcp.supervisor import mcp_supervisor
+from app.services.mcp.user_client_pool import user_client_pool
+from app.services.stream import stream_relay
+from app.services.upstream import upstream_router
 from app.utils.datetime_utils import get_now_naive, timestamp_ms
 
 # 导入我们的自定义日志模块
@@ -18,7 +24,25 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时执行
     logger.info(f"应用启动,当前时间: {get_now_naive()}, 当前时间戳: {timestamp_ms()}")
+    # 启动上游端点健康检查
+    upstream_router.start_health_checks()
+    # 多个工作进程时，重连和中止请求可能落到其他工作进程，由本进程的转发套接字接收
+    if settings.SSE_STREAM_RELAY_ENABLED:
+        await stream_relay.start()
+    # process模式下预先启动空闲的MCP工作进程，首个请求无需等待进程启动
+    if (
+        settings.MCP_SPARE_WORKERS_ENABLED
+        and settings.MCP_CLIENT_MODE != MCPClientMode.INPROCESS
+        and not settings.MCP_GATEWAY_ENABLED
+    ):
+        spare_worker_pool.start()
     yield
+    await upstream_router.stop_health_checks()
+    await stream_relay.stop()
+    # 关闭受监管的MCP服务器连接和池中的用户MCP客户端
+    await mcp_supervisor.stop()
+    await user_client_pool.stop()
+    await spare_worker_pool.stop()
     # 关闭时执行
     logger.info(f"应用关闭,当前时间: {get_now_naive()}, 当前时间戳: {timestamp_ms()}")
 
@@ -39,6 +63,7 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Stream-ID"],
     )
 else:
     # 默认允许所有跨域请求（开发环境）
@@ -48,6 +73,7 @@ else:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Stream-ID"],
     )
 
 # 添加API路由
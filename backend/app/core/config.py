@@ -5,7 +5,7 @@ import logging
 from pathlib import Path
 import glob
 
-from pydantic import PostgresDsn, field_validator
+from pydantic import Field, PostgresDsn, field_validator
 from pydantic_settings import BaseSettings
 
 logger = logging.getLogger(__name__)
@@ -100,10 +100,135 @@ class Settings(BaseSettings):
     DEFAULT_MODEL: str = "deepseek-chat"  # 默认模型
     DEEPSEEK_SYSTEM_PROMPT: str = ""
     DEFAULT_CONTEXT_LENGTH: int = 5  # 默认上下文长度
+    CONTEXT_TRUNCATE_BLOCK_SIZE: int = 4  # 上下文按块对齐截断的块大小，1表示逐条滑动
+
+    # SSE流设置
+    SSE_COALESCE_ENABLED: bool = False  # 是否合并时间/大小窗口内的连续内容增量
+    SSE_COALESCE_WINDOW_MS: int = 20  # 合并时间窗口（毫秒）
+    SSE_COALESCE_MAX_BYTES: int = 512  # 缓冲内容达到该字节数时立即发送
+    SSE_DISCONNECT_POLL_INTERVAL: float = 1.0  # 客户端断开检测轮询间隔（秒）
+    SSE_REPLAY_BUFFER_SIZE: int = 2048  # 每个流的重放缓冲区大小（事件数）
+    SSE_REPLAY_TTL_SECONDS: float = 120.0  # 生成结束后流保留以便重连的时间（秒）
+    SSE_RESUME_GRACE_SECONDS: float = 15.0  # 所有客户端断开后等待重连的时间（秒），超时取消生成
+    SSE_STREAM_RELAY_ENABLED: bool = True  # 是否把落到其他工作进程的重连和中止请求转发给拥有聊天流的工作进程
+    SSE_STREAM_RELAY_DIR: str = "/tmp/carrot-streams"  # 各工作进程转发套接字所在目录
+    SSE_STREAM_RELAY_TIMEOUT: float = 5.0  # 连接拥有聊天流的工作进程的超时时间（秒）
+
+    # 上游并发准入控制（每个工作进程）
+    CHAT_MAX_CONCURRENT_STREAMS: int = 64  # 全局最大并发上游流数量
+    CHAT_MAX_STREAMS_PER_USER: int = 3  # 单个用户最大并发上游流数量
+    CHAT_ADMISSION_QUEUE_SIZE: int = 128  # 准入等待队列最大长度
+    CHAT_ADMISSION_QUEUE_TIMEOUT: float = 10.0  # 准入等待队列最长等待时间（秒）
+    CHAT_SINGLE_FLIGHT_ENABLED: bool = True  # 是否合并同一用户的相同聊天请求，共享一次生成
+    CHAT_SINGLE_FLIGHT_WINDOW_SECONDS: float = 5.0  # 生成结束后仍合并相同请求的时间（秒）
+
+    # 上游调用调度（每个工作进程）
+    UPSTREAM_MAX_CONCURRENT_CALLS: int = 48  # 最大并发上游调用数量
+    UPSTREAM_PRIORITY_WEIGHTS: Dict[str, int] = {
+        "agent": 8,
+        "interactive": 4,
+        "batch": 1,
+    }  # 各优先级类别的调度权重
+    UPSTREAM_STARVATION_SECONDS: float = 5.0  # 饥饿保护阈值（秒）
+
+    # 上游端点路由 - 模型名到OpenAI兼容端点列表的映射，未配置时使用DEEPSEEK_API_BASE
+    UPSTREAM_ENDPOINTS: Dict[str, List[Dict[str, Any]]] = Field(
+        default_factory=dict, validate_default=True
+    )
+    UPSTREAM_EWMA_ALPHA: float = 0.3  # 首字节耗时EWMA平滑系数
+    UPSTREAM_HEALTH_CHECK_INTERVAL: float = 30.0  # 端点主动健康检查间隔（秒），0表示关闭
+    UPSTREAM_HEDGE_ENABLED: bool = False  # 首字节超过阈值时是否向备选端点发起对冲请求
+    UPSTREAM_HEDGE_MIN_SAMPLES: int = 20  # 计算p95阈值所需的最少样本数
+    UPSTREAM_HEDGE_MIN_DELAY: float = 0.5  # 对冲阈值下限（秒）
+    UPSTREAM_HEDGE_MAX_DELAY: float = 5.0  # 对冲阈值上限（秒），样本不足时使用
+
+    # 上游熔断与重试
+    UPSTREAM_BREAKER_ERROR_RATE: float = 0.5  # 触发熔断的错误率阈值
+    UPSTREAM_BREAKER_SLOW_SECONDS: float = 15.0  # 首字节耗时超过该值视为慢调用（秒）
+    UPSTREAM_BREAKER_SLOW_RATE: float = 0.8  # 触发熔断的慢调用比例阈值
+    UPSTREAM_BREAKER_MIN_REQUESTS: int = 10  # 窗口内最少请求数
+    UPSTREAM_BREAKER_WINDOW_SECONDS: float = 30.0  # 滑动统计窗口（秒）
+    UPSTREAM_BREAKER_OPEN_SECONDS: float = 30.0  # 熔断持续时间（秒）
+    UPSTREAM_BREAKER_HALF_OPEN_PROBES: int = 2  # 半开状态探测请求数
+    UPSTREAM_MAX_RETRIES: int = 2  # 首字节前的最大重试次数
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.3  # 重试退避基础时间（秒）
+    UPSTREAM_RETRY_MAX_DELAY: float = 3.0  # 重试退避最长时间（秒）
+
+    # 响应缓存（每个工作进程）
+    RESPONSE_CACHE_ENABLED: bool = False  # 是否启用确定性请求的精确匹配响应缓存
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1024  # 最大缓存条目数
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 最大缓存字节数
+    RESPONSE_CACHE_TTL_SECONDS: float = 3600.0  # 缓存条目有效期（秒）
+    RESPONSE_CACHE_REPLAY_DELAY_MS: int = 0  # 重放时相邻事件的间隔（毫秒）
+    RESPONSE_CACHE_SYSTEM_PROMPTS: List[str] = []  # 显式标记为可缓存的系统提示
+
+    # 近似重复问题缓存（仅单轮、无工具请求）
+    NEAR_DUP_CACHE_ENABLED: bool = False  # 是否启用近似重复问题缓存
+    NEAR_DUP_CACHE_THRESHOLD: float = 0.9  # 命中所需的最小Jaccard相似度
+    NEAR_DUP_CACHE_SHINGLE_SIZE: int = 3  # 字符分片长度
+    NEAR_DUP_CACHE_NUM_PERM: int = 64  # MinHash签名长度
+    NEAR_DUP_CACHE_BANDS: int = 16  # LSH分带数，需能整除签名长度
+    NEAR_DUP_CACHE_MAX_ENTRIES: int = 4096  # 最大缓存条目数
+    NEAR_DUP_CACHE_TTL_SECONDS: float = 3600.0  # 缓存条目有效期（秒）
+    NEAR_DUP_CACHE_AUDIT_SAMPLE_RATE: float = 0.01  # 命中进入误判审计样本的概率
 
     # MCP服务器配置 - 从外部文件加载
     # 加载MCP服务器配置
     MCP_SERVERS: Dict[str, Dict[str, Any]] = {}
+    MCP_CLIENT_MODE: str = "process"  # MCP客户端默认运行模式: process（独立进程）或 inprocess（进程内），可在mcp_servers.json中按服务器用mode覆盖
+    MCP_SPARE_WORKERS_ENABLED: bool = True  # 是否预先启动空闲的MCP工作进程（process模式），连接新服务器时直接分配
+    MCP_SPARE_WORKERS_MIN: int = 1  # 最少保持的空闲工作进程数
+    MCP_SPARE_WORKERS_MAX: int = 4  # 最多保持的空闲工作进程数，实际数量按最近的分配次数自适应
+    MCP_SPARE_WORKERS_WINDOW: float = 300.0  # 统计分配次数的时间窗口（秒）
+    MCP_SHM_RESULT_THRESHOLD: int = 262144  # 工具结果不小于该字节数时由工作进程通过共享内存返回（process模式），0表示不使用
+
+    # MCP工具目录
+    MCP_TOOL_SCHEMA_MINIFY: bool = True  # 是否精简工具参数Schema（去除标题、示例，折叠冗余anyOf）
+    MCP_TOOL_CATALOG_CACHE_SIZE: int = 64  # 按服务器集合缓存的工具列表数
+    MCP_TOOL_SELECTION_TOP_K: int = 0  # 按相关性只发送前K个工具，0表示发送全部工具
+    MCP_TOOL_ALWAYS_INCLUDE: List[str] = []  # 启用工具选择时总是发送的工具名称
+    MCP_TOOL_SELECTION_QUERY_MESSAGES: int = 3  # 参与工具相关性打分的最近用户消息数
+    MCP_TOOLS_CACHE_TTL: float = 300.0  # 工具列表缓存时间（秒），过期后先返回旧列表并在后台刷新
+    MCP_TOOLS_CACHE_MAX_STALE: float = 3600.0  # 过期的工具列表最多继续使用的时间（秒），超过后在请求中重新获取
+    MCP_TOOLS_CACHE_SIZE: int = 256  # 工作进程内最多缓存工具列表的服务器数
+
+    # MCP副本集（mcp_servers.json中用urls配置多个副本）
+    MCP_REPLICA_EJECT_FAILURES: int = 3  # 副本连续失败多少次后摘除
+    MCP_REPLICA_EJECT_SECONDS: float = 30.0  # 副本摘除时长（秒），多次摘除时递增
+    MCP_REPLICA_HEDGE_ENABLED: bool = True  # 是否对幂等工具发起对冲调用
+    MCP_REPLICA_HEDGE_MIN_DELAY: float = 0.05  # 对冲阈值下限（秒）
+    MCP_REPLICA_HEDGE_MAX_DELAY: float = 2.0  # 对冲阈值上限（秒），样本不足时使用
+    MCP_REPLICA_HEDGE_MIN_SAMPLES: int = 20  # 计算对冲阈值所需的最少调用耗时样本数
+
+    # MCP服务器监管（服务端配置的服务器在工作进程内保持连接）
+    MCP_SUPERVISOR_ENABLED: bool = True  # 是否由监管器保持服务端配置的MCP服务器连接并自动重启
+    MCP_SUPERVISOR_INTERVAL: float = 15.0  # ping间隔（秒）
+    MCP_SUPERVISOR_PING_TIMEOUT: float = 5.0  # ping超时时间（秒）
+    MCP_SUPERVISOR_CONNECT_TIMEOUT: float = 20.0  # 连接超时时间（秒）
+    MCP_SUPERVISOR_RESTART_MIN_DELAY: float = 1.0  # 重启退避的初始等待时间（秒）
+    MCP_SUPERVISOR_RESTART_MAX_DELAY: float = 60.0  # 重启退避的最大等待时间（秒）
+    MCP_SUPERVISOR_PROCESS_WORKERS: int = 2  # process模式下每个受监管服务器保持的工作进程数，请求之间共享
+    MCP_BREAKER_ERROR_RATE: float = 0.5  # 触发熔断的工具调用错误率
+    MCP_BREAKER_MIN_REQUESTS: int = 5  # 窗口内至少有这么多调用才计算错误率
+    MCP_BREAKER_WINDOW_SECONDS: float = 60.0  # 熔断统计窗口（秒）
+    MCP_BREAKER_OPEN_SECONDS: float = 30.0  # 熔断持续时间（秒）
+
+    # 用户MCP客户端池（用户自定义的服务器按配置哈希在工作进程内复用客户端）
+    MCP_USER_POOL_ENABLED: bool = True  # 是否复用用户自定义MCP服务器的客户端
+    MCP_USER_POOL_MAX_CLIENTS: int = 64  # 工作进程内最多保持的用户MCP客户端数（工作进程和会话）
+    MCP_USER_POOL_MAX_PER_USER: int = 4  # 每个用户最多持有的不同服务器配置数
+    MCP_USER_POOL_IDLE_TIMEOUT: float = 600.0  # 客户端空闲超过该时间（秒）后关闭
+
+    # MCP网关（每台主机一个旁路进程，所有工作进程共享MCP会话）
+    MCP_GATEWAY_ENABLED: bool = False  # 是否通过MCP网关访问MCP服务器
+    MCP_GATEWAY_SOCKET: str = "/tmp/carrot-mcp-gateway.sock"  # 网关Unix域套接字路径
+    MCP_GATEWAY_AUTOSTART: bool = True  # 是否由gunicorn主进程自动启动网关
+    MCP_GATEWAY_POOL_SIZE: int = 2  # 每个MCP服务器的会话数
+    MCP_GATEWAY_MAX_CONCURRENCY: int = 16  # 每个MCP服务器的最大并发请求数
+    MCP_GATEWAY_TOOLS_TTL: int = 300  # 工具列表缓存时间（秒）
+    MCP_GATEWAY_RESULT_CACHE_TTL: int = 0  # 工具结果缓存时间（秒），0表示不缓存（工具可能有副作用）
+    MCP_GATEWAY_RESULT_CACHE_SIZE: int = 1024  # 最多缓存的工具结果数
+    MCP_GATEWAY_REQUEST_TIMEOUT: int = 60  # 网关请求超时时间（秒）
 
     # 日志设置
     LOG_LEVEL: str = "INFO"  # 日志级别: DEBUG, INFO, WARNING, ERROR, CRITICAL
@@ -130,6 +255,29 @@ class Settings(BaseSettings):
     # MCP服务调试设置
     DEBUG_MCP_SERVICE: bool = True  # 是否启用MCP服务的详细调试日志
 
+    @field_validator("UPSTREAM_ENDPOINTS", mode="before")
+    def parse_upstream_endpoints(
+        cls, v: Union[str, Dict[str, List[Dict[str, Any]]]]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """将上游端点配置解析为字典"""
+        # 优先使用环境变量配置
+        if isinstance(v, str):
+            try:
+                endpoints = json.loads(v)
+                if isinstance(endpoints, dict):
+                    return endpoints
+            except json.JSONDecodeError:
+                pass
+
+        if isinstance(v, dict) and v:
+            return v
+
+        # 从配置文件加载，文件不存在时返回空字典
+        filepath = os.path.join(CONFIG_DIR, "upstream_endpoints.json")
+        if not os.path.exists(filepath):
+            return {}
+        return load_json_config("upstream_endpoints.json", {})
+
     @field_validator("MCP_SERVERS", mode="before")
     def parse_mcp_servers(
         cls, v: Union[str, Dict[str, Dict[str, Any]]]
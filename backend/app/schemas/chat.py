@@ -1,4 +1,4 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any
 from pydantic import BaseModel, Field
 from app.core.config import settings
 
@@ -44,6 +44,10 @@ class ChatRequest(BaseModel):
     mcp_server_name: Optional[str] = Field(
         default=None, description="指定使用的MCP服务器名称"
     )
+    priority: Literal["interactive", "batch"] = Field(
+        default="interactive",
+        description="上游调度优先级类别，批量或后台生成可使用batch以让出交互式请求",
+    )
     context_length: int = Field(
         default=settings.DEFAULT_CONTEXT_LENGTH,
         description="上下文长度，控制发送API时只使用最后N条消息作为上下文",
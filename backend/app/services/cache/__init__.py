@@ -0,0 +1,14 @@
+"""
+缓存模块，提供聊天响应缓存等功能
+"""
+
+from .response_cache import CachedResponse, ResponseCache, response_cache
+from .near_duplicate import NearDuplicateCache, near_duplicate_cache
+
+__all__ = [
+    "CachedResponse",
+    "ResponseCache",
+    "response_cache",
+    "NearDuplicateCache",
+    "near_duplicate_cache",
+]
@@ -0,0 +1,384 @@
+"""
+近似重复问题缓存模块，对单轮、无工具请求的用户问题做规范化和分片，
+用MinHash签名和LSH分桶查找相似问题，Jaccard相似度超过阈值时重放已缓存的回答
+"""
+
+import hashlib
+import logging
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.utils.json_utils import dumps_bytes
+from .response_cache import CachedResponse
+
+logger = logging.getLogger(__name__)
+
+# MinHash使用的梅森素数和哈希上界
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# 规范化时去除的空白字符，字符分片不依赖空格分词
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 属于标点类别（P）但在问题中有含义的字符（运算符、C#、邮箱等），规范化时保留
+_SIGNIFICANT_PUNCTUATION = frozenset("*/%-#&@\\")
+
+
+class _NearDuplicateEntry(CachedResponse):
+    """近似重复缓存条目，在响应之外保存问题的分片集合和签名"""
+
+    __slots__ = ("entry_id", "scope", "question", "shingles", "signature")
+
+    def __init__(
+        self,
+        entry_id: int,
+        scope: str,
+        question: str,
+        shingles: Set[str],
+        signature: Tuple[int, ...],
+        events: List[Dict[str, Any]],
+        size: int,
+    ):
+        super().__init__(events, size)
+        self.entry_id = entry_id
+        self.scope = scope
+        self.question = question
+        self.shingles = shingles
+        self.signature = signature
+
+
+class NearDuplicateCache:
+    """
+    近似重复问题缓存
+
+    只处理单轮（除系统提示外只有一条用户消息）且不带工具的请求；模型、系统提示和温度
+    构成缓存作用域，只在同一作用域内匹配。LSH候选会用分片集合的真实Jaccard相似度复核
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        threshold: float = 0.9,
+        shingle_size: int = 3,
+        num_perm: int = 64,
+        bands: int = 16,
+        max_entries: int = 4096,
+        max_question_chars: int = 2000,
+        ttl_seconds: float = 3600.0,
+        audit_sample_rate: float = 0.01,
+        audit_size: int = 100,
+    ):
+        """
+        初始化近似重复缓存
+
+        Args:
+            enabled: 是否启用
+            threshold: 命中所需的最小Jaccard相似度
+            shingle_size: 字符分片长度
+            num_perm: MinHash签名长度
+            bands: LSH分带数，需能整除num_perm
+            max_entries: 最大条目数
+            max_question_chars: 参与匹配的问题最大长度，超过则不缓存
+            ttl_seconds: 条目有效期（秒）
+            audit_sample_rate: 命中结果进入误判审计样本的概率
+            audit_size: 保留的审计样本数
+        """
+        if num_perm % bands != 0:
+            raise ValueError("num_perm必须能被bands整除")
+
+        self.enabled = enabled
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.max_question_chars = max_question_chars
+        self.ttl_seconds = ttl_seconds
+        self.audit_sample_rate = audit_sample_rate
+
+        # 固定种子生成哈希参数，保证签名在进程生命周期内稳定
+        rng = random.Random(0x5EED)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+        self._entries: "OrderedDict[int, _NearDuplicateEntry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[int]] = {}
+        self._next_id = 0
+        self._bytes = 0
+        self._audit: Deque[Dict[str, Any]] = deque(maxlen=audit_size)
+
+        self._hits = 0
+        self._misses = 0
+        self._candidates_checked = 0
+        self._candidates_rejected = 0
+
+    def extract_question(
+        self,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]] = None,
+    ) -> Optional[str]:
+        """
+        提取单轮请求的用户问题
+
+        Args:
+            messages: 消息列表
+            tools: 工具列表
+
+        Returns:
+            用户问题文本，请求不满足单轮、无工具条件时返回None
+        """
+        if not self.enabled or tools:
+            return None
+        turns = [msg for msg in messages if msg.get("role") != "system"]
+        if len(turns) != 1 or turns[0].get("role") != "user":
+            return None
+        content = turns[0].get("content")
+        if not isinstance(content, str) or len(content) > self.max_question_chars:
+            return None
+        return content
+
+    @staticmethod
+    def make_scope(model: str, messages: List[Dict[str, Any]], temperature: float) -> str:
+        """
+        计算缓存作用域，只有模型、系统提示和温度都相同的请求才会相互匹配
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            temperature: 实际使用的温度
+
+        Returns:
+            作用域哈希
+        """
+        system_prompts = [msg.get("content") for msg in messages if msg.get("role") == "system"]
+        payload = [model, system_prompts, round(float(temperature), 4)]
+        return hashlib.sha256(dumps_bytes(payload)).hexdigest()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        规范化问题文本：统一全角半角和大小写，去除标点符号和空白；
+        数学、比较等符号以及有含义的标点（如"2+3"和"2*3"中的运算符）保留，避免不同问题被视为相同
+
+        Args:
+            text: 原始文本
+
+        Returns:
+            规范化后的文本
+        """
+        text = unicodedata.normalize("NFKC", text).casefold()
+        text = "".join(
+            " "
+            if unicodedata.category(ch)[0] == "P" and ch not in _SIGNIFICANT_PUNCTUATION
+            else ch
+            for ch in text
+        )
+        return _WHITESPACE_RE.sub("", text)
+
+    def shingle(self, normalized: str) -> Set[str]:
+        """
+        将规范化文本切分为字符分片，字符分片对中文等无空格语言同样有效
+
+        Args:
+            normalized: 规范化后的文本
+
+        Returns:
+            分片集合
+        """
+        size = self.shingle_size
+        if len(normalized) <= size:
+            return {normalized} if normalized else set()
+        return {normalized[i : i + size] for i in range(len(normalized) - size + 1)}
+
+    def signature(self, shingles: Set[str]) -> Tuple[int, ...]:
+        """
+        计算分片集合的MinHash签名
+
+        Args:
+            shingles: 分片集合
+
+        Returns:
+            长度为num_perm的签名
+        """
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+            for s in shingles
+        ]
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]):
+        """生成签名在各分带中的桶键"""
+        rows = self.rows
+        for band in range(self.bands):
+            yield (scope, band, signature[band * rows : (band + 1) * rows])
+
+    def get(self, scope: str, question: str) -> Optional[CachedResponse]:
+        """
+        查找与问题近似重复的缓存回答
+
+        Args:
+            scope: 缓存作用域
+            question: 用户问题
+
+        Returns:
+            最相似且超过阈值的缓存条目，没有时返回None
+        """
+        normalized = self.normalize(question)
+        shingles = self.shingle(normalized)
+        if not shingles:
+            self._misses += 1
+            return None
+        signature = self.signature(shingles)
+
+        candidates: Set[int] = set()
+        for key in self._band_keys(scope, signature):
+            candidates.update(self._buckets.get(key, ()))
+
+        now = time.monotonic()
+        best: Optional[_NearDuplicateEntry] = None
+        best_score = 0.0
+        for entry_id in candidates:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                continue
+            if now - entry.created_at > self.ttl_seconds:
+                self._remove(entry_id)
+                continue
+            self._candidates_checked += 1
+            score = _jaccard(shingles, entry.shingles)
+            if score < self.threshold:
+                # LSH候选未通过真实相似度复核
+                self._candidates_rejected += 1
+                continue
+            if score > best_score:
+                best, best_score = entry, score
+
+        if best is None:
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(best.entry_id)
+        best.hits += 1
+        self._hits += 1
+        if random.random() < self.audit_sample_rate:
+            # 抽样保存命中对，供人工检查语义不同但字面相似的误判；
+            # 指标接口对所有登录用户开放，样本只保留摘要和长度，原文只写入服务端日志
+            self._audit.append(
+                {
+                    "question_digest": _digest(normalized),
+                    "question_length": len(normalized),
+                    "matched_digest": _digest(best.question),
+                    "matched_length": len(best.question),
+                    "jaccard": round(best_score, 3),
+                }
+            )
+            logger.debug(
+                f"近似重复缓存审计样本: {normalized!r} -> {best.question!r} ({best_score:.3f})"
+            )
+        return best
+
+    def put(self, scope: str, question: str, events: List[Dict[str, Any]]) -> None:
+        """
+        写入缓存条目，超出容量时按LRU淘汰
+
+        Args:
+            scope: 缓存作用域
+            question: 用户问题
+            events: 录制的流事件序列（不含结束标记）
+        """
+        normalized = self.normalize(question)
+        shingles = self.shingle(normalized)
+        if not shingles:
+            return
+        signature = self.signature(shingles)
+
+        # 估算条目内存：事件、分片和签名
+        size = (
+            len(dumps_bytes(events))
+            + sum(len(s.encode("utf-8")) for s in shingles)
+            + len(normalized.encode("utf-8"))
+            + 8 * self.num_perm
+        )
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _NearDuplicateEntry(
+            entry_id, scope, normalized, shingles, signature, events, size
+        )
+        self._bytes += size
+        for key in self._band_keys(scope, signature):
+            self._buckets.setdefault(key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        """删除缓存条目及其LSH桶索引"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for key in self._band_keys(entry.scope, entry.signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取缓存指标
+
+        Returns:
+            包含命中率、候选复核情况、内存占用和误判审计样本的指标字典
+        """
+        lookups = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+            "bytes": self._bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "candidates_checked": self._candidates_checked,
+            "candidates_rejected": self._candidates_rejected,
+            "audit_samples": list(self._audit),
+        }
+
+
+def _digest(text: str) -> str:
+    """计算审计样本中问题文本的短摘要"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    """计算两个集合的Jaccard相似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+# 当前工作进程的全局近似重复缓存
+near_duplicate_cache = NearDuplicateCache(
+    enabled=settings.NEAR_DUP_CACHE_ENABLED,
+    threshold=settings.NEAR_DUP_CACHE_THRESHOLD,
+    shingle_size=settings.NEAR_DUP_CACHE_SHINGLE_SIZE,
+    num_perm=settings.NEAR_DUP_CACHE_NUM_PERM,
+    bands=settings.NEAR_DUP_CACHE_BANDS,
+    max_entries=settings.NEAR_DUP_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.NEAR_DUP_CACHE_TTL_SECONDS,
+    audit_sample_rate=settings.NEAR_DUP_CACHE_AUDIT_SAMPLE_RATE,
+)
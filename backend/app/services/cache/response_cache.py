@@ -0,0 +1,221 @@
+"""
+响应缓存模块，对确定性的聊天请求按规范化哈希精确匹配，缓存并重放录制的流事件序列
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.utils.json_utils import dumps_bytes, dumps_canonical
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    """一条缓存的响应：录制的流事件序列"""
+
+    __slots__ = ("events", "size", "created_at", "hits")
+
+    def __init__(self, events: List[Dict[str, Any]], size: int):
+        self.events = events
+        self.size = size
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class ResponseCache:
+    """
+    精确匹配响应缓存
+
+    以(model, messages, tools, temperature)的规范化哈希为键，只缓存确定性请求（温度为0）
+    或使用了显式标记的系统提示的请求；按条目数和总字节数限制的LRU，条目超过TTL后失效
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600.0,
+        replay_delay_ms: int = 0,
+        cacheable_system_prompts: Optional[List[str]] = None,
+    ):
+        """
+        初始化响应缓存
+
+        Args:
+            enabled: 是否启用
+            max_entries: 最大条目数
+            max_bytes: 所有条目的最大总字节数
+            ttl_seconds: 条目有效期（秒）
+            replay_delay_ms: 重放时相邻事件之间的间隔（毫秒），0表示一次性发送
+            cacheable_system_prompts: 显式标记为可缓存的系统提示列表
+        """
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.replay_delay = replay_delay_ms / 1000.0
+        self.cacheable_system_prompts = set(cacheable_system_prompts or [])
+
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(
+        model: str,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+        temperature: float,
+    ) -> str:
+        """
+        计算请求的规范化哈希
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            tools: 工具列表
+            temperature: 实际使用的温度
+
+        Returns:
+            十六进制哈希字符串
+        """
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": msg.get("role"), "content": msg.get("content")} for msg in messages
+            ],
+            "tools": tools or [],
+            "temperature": round(float(temperature), 4),
+        }
+        # 排序键保证相同语义的请求得到相同的序列化结果
+        return hashlib.sha256(dumps_canonical(payload)).hexdigest()
+
+    def is_cacheable(
+        self,
+        messages: List[Dict[str, Any]],
+        temperature: float,
+        tools: Optional[List[Dict[str, Any]]] = None,
+    ) -> bool:
+        """
+        判断请求是否可以使用缓存
+
+        Args:
+            messages: 消息列表
+            temperature: 实际使用的温度
+            tools: 工具列表，工具结果依赖实时数据，带工具的请求不缓存
+
+        Returns:
+            是否可缓存
+        """
+        if not self.enabled or tools:
+            return False
+        if temperature == 0:
+            return True
+        return any(
+            msg.get("role") == "system" and msg.get("content") in self.cacheable_system_prompts
+            for msg in messages
+        )
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        获取缓存条目，过期条目会被删除
+
+        Args:
+            key: 请求哈希
+
+        Returns:
+            缓存条目或None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        if time.monotonic() - entry.created_at > self.ttl_seconds:
+            self._remove(key)
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self._hits += 1
+        return entry
+
+    def put(self, key: str, events: List[Dict[str, Any]]) -> None:
+        """
+        写入缓存条目，超出容量时按LRU淘汰
+
+        Args:
+            key: 请求哈希
+            events: 录制的流事件序列（不含结束标记）
+        """
+        size = len(dumps_bytes(events))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CachedResponse(events, size)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._evictions += 1
+
+    def _remove(self, key: str) -> None:
+        """删除缓存条目"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    async def replay(self, entry: CachedResponse) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        按配置的速度重放缓存的流事件
+
+        Args:
+            entry: 缓存条目
+
+        Yields:
+            流事件字典
+        """
+        for event in entry.events:
+            yield event
+            if self.replay_delay > 0:
+                await asyncio.sleep(self.replay_delay)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取缓存指标
+
+        Returns:
+            包含条目数、占用字节数和命中率的指标字典
+        """
+        lookups = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "evictions": self._evictions,
+        }
+
+
+# 当前工作进程的全局响应缓存
+response_cache = ResponseCache(
+    enabled=settings.RESPONSE_CACHE_ENABLED,
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+    replay_delay_ms=settings.RESPONSE_CACHE_REPLAY_DELAY_MS,
+    cacheable_system_prompts=settings.RESPONSE_CACHE_SYSTEM_PROMPTS,
+)
@@ -1,47 +1,226 @@
-from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession
+import hashlib
+from contextlib import aclosing
+from typing import AsyncGenerator, Awaitable, Callable, Dict, Any, Optional, Tuple
 from app.core.config import settings
+from app.db.session import get_async_db_context
 from app.schemas.chat import ChatRequest
-from app.services.deepseek.message_processor import MessageProcessor
+from app.services.deepseek.message_processor import MessageProcessor, SSEVersion
 from app.services.deepseek.chat_handler import handle_deepseek_chat
+from app.services.stream import ChatStream, StreamCoalescer, stream_registry
+from app.services.upstream import AdmissionRejected, admission_controller
+from app.utils.json_utils import dumps_canonical
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 async def post_chat_service(
-    request: ChatRequest, db: AsyncSession, user_id: int
-) -> AsyncGenerator[str, None]:
+    request: ChatRequest,
+    user_id: int,
+    sse_version: int = SSEVersion.V1,
+    stream: Optional[ChatStream] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncGenerator[bytes, None]:
     """
     处理聊天请求并返回SSE格式的响应
 
+    生成过程运行在独立任务中，事件带编号写入重放缓冲区，客户端可以凭Last-Event-ID重连续传。
+    所有客户端断开且宽限期内未重连，或通过中止接口取消时会停止上游流。
+    同一用户的相同请求（如重复点击、客户端重试）合并到已在进行的生成，只调用一次上游并只计费一次
+
     Args:
         request: 聊天请求对象
-        db: 异步数据库会话
         user_id: 用户ID
+        sse_version: 与客户端协商的SSE帧格式版本
+        stream: 已注册的聊天流，未提供时按请求指纹获取或创建
+        is_disconnected: 检查客户端是否已断开的协程函数
 
     Yields:
         SSE格式的聊天响应内容
     """
+    if stream is None:
+        stream = get_or_create_chat_stream(request, user_id)
+
+    # 相同请求已经启动了生成时只订阅其事件流，不再调用上游
+    if stream.claim():
+        await start_chat_stream(request, user_id, stream)
+    else:
+        logger.info(f"用户 {user_id} 的重复聊天请求合并到聊天流 {stream.stream_id}")
+
+    frames = subscribe_chat_stream(
+        stream, sse_version, is_disconnected=is_disconnected
+    )
+    async with aclosing(frames):
+        async for frame in frames:
+            yield frame
+
+
+async def start_chat_stream(
+    request: ChatRequest, user_id: int, stream: ChatStream
+) -> None:
+    """
+    通过准入控制后在聊天流中启动生成，被拒绝时以结构化错误结束聊天流
+
+    Args:
+        request: 聊天请求对象
+        user_id: 用户ID
+        stream: 聊天流
+    """
+    # 上游并发准入控制：全局/单用户并发超限时排队，排队失败返回带重试时间的结构化错误
+    try:
+        await admission_controller.acquire(user_id)
+    except AdmissionRejected as e:
+        logger.warning(f"用户 {user_id} 的聊天请求被准入控制拒绝: {e.reason}")
+        stream_registry.remove(stream.stream_id)
+        # 通过聊天流发送错误，已合并的重复请求也会收到
+        stream.close_with_error(
+            MessageProcessor.build_error_event(
+                e.message, code=e.reason, retry_after=e.retry_after
+            )
+        )
+        return
+    except BaseException as e:
+        # 排队期间请求被取消（如客户端断开）或出错时，聊天流已被声明但不会启动，
+        # 必须移除并结束，否则之后相同的请求会合并到这个流并一直等待
+        logger.warning(
+            f"用户 {user_id} 的聊天请求在准入排队时中止: {str(e) or type(e).__name__}"
+        )
+        stream_registry.remove(stream.stream_id)
+        stream.close_with_error(
+            MessageProcessor.build_error_event("请求在排队时被中止，请重试", code="aborted")
+        )
+        raise
+
+    events = generate_chat_events(request, user_id)
+
+    # 可选：合并窗口内的连续内容增量，减少帧数、系统调用和重放缓冲区占用
+    if settings.SSE_COALESCE_ENABLED:
+        coalescer = StreamCoalescer(
+            window_ms=settings.SSE_COALESCE_WINDOW_MS,
+            max_bytes=settings.SSE_COALESCE_MAX_BYTES,
+        )
+        events = coalescer.coalesce(events)
+
+    stream.start(events, on_finish=lambda: admission_controller.release(user_id))
+
+
+def request_fingerprint(request: ChatRequest) -> str:
+    """
+    计算聊天请求的规范化指纹，内容相同的请求得到相同指纹
+
+    Args:
+        request: 聊天请求对象
+
+    Returns:
+        十六进制哈希字符串
+    """
+    return hashlib.sha256(dumps_canonical(request.model_dump())).hexdigest()
+
+
+def get_or_create_chat_stream(request: ChatRequest, user_id: int) -> ChatStream:
+    """
+    获取同一用户相同请求正在进行的聊天流，不存在时创建新流
+
+    Args:
+        request: 聊天请求对象
+        user_id: 用户ID
+
+    Returns:
+        聊天流
+    """
+    stream, created = stream_registry.get_or_create(user_id, request_fingerprint(request))
+    if not created:
+        logger.info(f"用户 {user_id} 的请求与聊天流 {stream.stream_id} 相同，将共享生成")
+    return stream
+
+
+async def subscribe_chat_stream(
+    stream: ChatStream,
+    sse_version: int = SSEVersion.V1,
+    last_event_id: int = 0,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    订阅已存在的聊天流并返回SSE格式的响应，用于首次连接、断线重连和多设备共享
+
+    Args:
+        stream: 聊天流
+        sse_version: 与客户端协商的SSE帧格式版本
+        last_event_id: 客户端已收到的最后一个事件ID
+        is_disconnected: 检查客户端是否已断开的协程函数
+
+    Yields:
+        带事件ID的SSE格式响应内容
+    """
+    subscription = stream.subscribe(
+        last_event_id,
+        is_disconnected=is_disconnected,
+        poll_interval=settings.SSE_DISCONNECT_POLL_INTERVAL,
+    )
+    frames = encode_stream_events(subscription, sse_version)
+    async with aclosing(frames):
+        async for frame in frames:
+            yield frame
+
+
+async def encode_stream_events(
+    subscription: AsyncGenerator[Tuple[int, Dict[str, Any]], None],
+    sse_version: int = SSEVersion.V1,
+) -> AsyncGenerator[bytes, None]:
+    """
+    将订阅到的带编号事件编码为SSE帧，本进程的聊天流和其他工作进程转发来的聊天流共用
+
+    Args:
+        subscription: 产出 (事件ID, 流事件字典) 的订阅
+        sse_version: 与客户端协商的SSE帧格式版本
+
+    Yields:
+        带事件ID的SSE格式响应内容
+    """
+    async with aclosing(subscription):
+        async for event_id, event in subscription:
+            # v2客户端不需要空增量帧，跳过的事件ID不影响按Last-Event-ID续传
+            if sse_version == SSEVersion.V2 and MessageProcessor.is_empty_delta(event):
+                continue
+            yield MessageProcessor.encode_event(event, sse_version, event_id=event_id)
+
+
+async def generate_chat_events(
+    request: ChatRequest, user_id: int
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    根据模型分派聊天请求并返回流事件
+
+    生成在独立任务中运行，可能在HTTP请求结束后继续（断开宽限期、断线续传、合并的重复请求），
+    因此使用生成自己持有的数据库会话，而不是随请求关闭的会话
+
+    Args:
+        request: 聊天请求对象
+        user_id: 用户ID
+
+    Yields:
+        流事件字典
+    """
     # 确定使用的模型
     model = determine_model(request)
 
     # 如果是DeepSeek模型，使用专门的处理函数
     if model.startswith("deepseek"):
         logger.info(f"使用DeepSeek处理函数处理模型: {model}")
-        async for response in handle_deepseek_chat(request, db, user_id):
-            yield response
+        async with get_async_db_context() as db:
+            async for event in handle_deepseek_chat(request, db, user_id):
+                yield event
         return
 
     # 如果是其他模型，可以在这里添加对应的处理逻辑
     # 例如：if model.startswith("other-model"):
-    #          async for response in handle_other_model_chat(request, db, user_id):
-    #              yield response
+    #          async for event in handle_other_model_chat(request, db, user_id):
+    #              yield event
     #          return
 
     # 如果没有匹配的处理函数，返回错误信息
     logger.error(f"未找到模型 {model} 的处理函数")
-    yield MessageProcessor.format_error_message(f"不支持的模型: {model}")
+    yield MessageProcessor.build_error_event(f"不支持的模型: {model}")
 
 
 def determine_model(request: ChatRequest) -> str:
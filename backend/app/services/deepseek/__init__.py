@@ -7,7 +7,7 @@ DeepSeek服务模块，提供与DeepSeek模型交互的功能
 
 from .deepseek_chat import DeepSeekChatService
 from .token_manager import TokenManager
-from .message_processor import MessageProcessor
+from .message_processor import MessageProcessor, SSEVersion, StreamEventType
 from .message_handler import MessageHandler
 from .chat_handler import handle_deepseek_chat
 
@@ -15,6 +15,8 @@ __all__ = [
     "DeepSeekChatService",
     "TokenManager",
     "MessageProcessor",
+    "SSEVersion",
+    "StreamEventType",
     "MessageHandler",
     "handle_deepseek_chat",
 ]
@@ -2,28 +2,32 @@
 DeepSeek聊天处理模块，处理聊天请求并返回SSE格式的响应
 """
 
+import asyncio
 import logging
 import traceback
-from typing import AsyncGenerator, List, Dict, Any
+from typing import AsyncGenerator, List, Dict, Any, Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
 from app.crud.user import user as user_crud
 from app.schemas.chat import ChatRequest
+from app.services.cache import near_duplicate_cache, response_cache
+from app.services.upstream import UpstreamUnavailableError
 from .deepseek_chat import DeepSeekChatService
 from .token_manager import TokenManager
 from .message_processor import MessageProcessor
 from .message_handler import MessageHandler
+from .prompt_prefix import prompt_cache_stats, truncate_context_aligned
 
 logger = logging.getLogger(__name__)
 
 
 async def handle_deepseek_chat(
     request: ChatRequest, db: AsyncSession, user_id: int
-) -> AsyncGenerator[str, None]:
+) -> AsyncGenerator[Dict[str, Any], None]:
     """
-    处理DeepSeek聊天请求并返回SSE格式的响应
+    处理DeepSeek聊天请求并返回流事件
 
     Args:
         request: 聊天请求对象
@@ -31,7 +35,7 @@ async def handle_deepseek_chat(
         user_id: 用户ID
 
     Yields:
-        SSE格式的聊天响应内容
+        流事件字典，由调用方编码为SSE帧
     """
     # 初始化DeepSeek聊天服务
     chat_service = DeepSeekChatService()
@@ -39,7 +43,7 @@ async def handle_deepseek_chat(
 
     # 检查用户token是否足够
     if not await user_crud.check_token_available(db, user_id, 10):  # 预估需要的token
-        yield MessageProcessor.format_error_message("Token不足，请充值后继续使用")
+        yield MessageProcessor.build_error_event("Token不足，请充值后继续使用")
         return
 
     # 确定使用的模型
@@ -49,7 +53,7 @@ async def handle_deepseek_chat(
     try:
         messages = await prepare_messages(request, message_handler)
     except ValueError as e:
-        yield MessageProcessor.format_error_message(str(e))
+        yield MessageProcessor.build_error_event(str(e))
         return
 
     # 获取温度设置
@@ -58,22 +62,59 @@ async def handle_deepseek_chat(
     # 检查是否使用MCP工具
     use_mcp, mcp_compatible = check_mcp_compatibility(request, model)
     if not mcp_compatible:
-        yield MessageProcessor.format_error_message(
+        yield MessageProcessor.build_error_event(
             "深度思考模型不支持工具调用功能，请选择普通模式或关闭工具调用"
         )
         return
-        
+
+    # 不带工具的请求先查询响应缓存（精确匹配，其次近似重复），命中时重放录制的事件序列
+    effective_temperature = (
+        temperature if temperature is not None else settings.DEEPSEEK_DEFAULT_TEMPERATURE
+    )
+    cache_key = None
+    near_dup_scope = None
+    near_dup_question = None
+    if not use_mcp:
+        cached = None
+        if response_cache.is_cacheable(messages, effective_temperature):
+            cache_key = response_cache.make_key(model, messages, None, effective_temperature)
+            cached = response_cache.get(cache_key)
+        if cached is None:
+            near_dup_question = near_duplicate_cache.extract_question(messages)
+            if near_dup_question is not None:
+                near_dup_scope = near_duplicate_cache.make_scope(
+                    model, messages, effective_temperature
+                )
+                cached = near_duplicate_cache.get(near_dup_scope, near_dup_question)
+        if cached is not None:
+            logger.info(f"用户 {user_id} 的请求命中响应缓存")
+            async for event in response_cache.replay(cached):
+                yield event
+            # 缓存命中不消耗上游token，仍记录一条零成本的使用记录便于统计
+            await TokenManager.update_token_usage(
+                db, user_id, TokenManager.ZERO_USAGE, request_type="chat_cached"
+            )
+            yield MessageProcessor.DONE_EVENT
+            return
+
     # 如果请求使用MCP工具，初始化对应的MCP客户端
     if use_mcp:
         try:
-            await initialize_mcp_clients(chat_service, request)
+            await initialize_mcp_clients(chat_service, request, user_id)
         except Exception as e:
             logger.error(f"初始化MCP客户端失败: {str(e)}")
-            yield MessageProcessor.format_error_message(f"初始化工具失败: {str(e)}")
+            yield MessageProcessor.build_error_event(f"初始化工具失败: {str(e)}")
             return
 
     # 最后一个有效响应块，用于提取token使用信息
     last_chunk_dict = None
+    # 已发送的内容片段，生成被中止时用于估算部分token使用量
+    completion_parts = []
+    cancelled = False
+    # 可缓存请求录制完整的事件序列，出错时不写入缓存
+    recorded_events: Optional[List[Dict[str, Any]]] = (
+        [] if cache_key or near_dup_question is not None else None
+    )
 
     try:
         # 调用DeepSeek聊天服务生成回复
@@ -83,9 +124,11 @@ async def handle_deepseek_chat(
             temperature,
             use_mcp=use_mcp,
             user_mcp_config=request.user_mcp_config,
+            user_id=user_id,
+            priority=request.priority,
         ):
             # 处理响应块
-            chunk_dict, response_message = await process_response_chunk(chunk, model)
+            chunk_dict, event = await process_response_chunk(chunk, model)
             
             # 保存最后一个包含usage的响应块，用于获取token使用情况
             if "usage" in chunk_dict and chunk_dict["usage"] is not None:
@@ -93,27 +136,59 @@ async def handle_deepseek_chat(
                 last_chunk_dict = chunk_dict
                 
             # 发送响应
-            if response_message:
-                yield response_message
+            if event:
+                completion_parts.append(event.get("content") or "")
+                completion_parts.append(event.get("reasoning_content") or "")
+                if recorded_events is not None:
+                    recorded_events.append(event)
+                yield event
+
+        if recorded_events:
+            if cache_key:
+                response_cache.put(cache_key, recorded_events)
+            if near_dup_question is not None:
+                near_duplicate_cache.put(near_dup_scope, near_dup_question, recorded_events)
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # 客户端断开或生成被中止，停止消费上游流
+        cancelled = True
+        logger.info(f"用户 {user_id} 的聊天生成已中止，停止上游流")
+        raise
+
+    except UpstreamUnavailableError as e:
+        # 上游熔断或重试耗尽：快速失败并返回友好的结构化错误
+        logger.warning(f"上游不可用，快速失败: {str(e)}")
+        yield MessageProcessor.build_error_event(
+            e.message, code="upstream_unavailable", retry_after=e.retry_after
+        )
 
     except Exception as e:
         logger.error(f"处理聊天请求时出错: {str(e)}")
         logger.error(f"错误详情: {traceback.format_exc()}")
-        yield MessageProcessor.format_error_message(f"处理请求时出错: {str(e)}")
+        yield MessageProcessor.build_error_event(f"处理请求时出错: {str(e)}")
 
     finally:
         # 在结束前处理token使用情况
         if last_chunk_dict and "usage" in last_chunk_dict:
             usage_data = last_chunk_dict["usage"]
+            prompt_cache_stats.record(user_id, model, usage_data)
             await TokenManager.update_token_usage(db, user_id, usage_data)
+        elif cancelled:
+            # 中止时上游尚未返回usage，按已生成内容估算部分使用量
+            usage_data = TokenManager.estimate_usage(
+                messages, "".join(completion_parts)
+            )
+            await TokenManager.update_token_usage(
+                db, user_id, usage_data, request_type="chat_aborted"
+            )
         else:
             logger.warning("未获取到有效的token使用数据，跳过token使用统计")
 
         # 清理资源
         await cleanup_resources(db, chat_service, use_mcp)
 
-        # 发送结束标记
-        yield "data: [DONE]\n\n"
+    # 发送结束标记
+    yield MessageProcessor.DONE_EVENT
 
 
 def determine_model(request: ChatRequest) -> str:
@@ -150,16 +225,21 @@ async def prepare_messages(request: ChatRequest, message_handler: MessageHandler
     """
     messages = []
 
-    # 添加系统提示
+    # 添加系统提示，所有系统消息放在最前面，保证请求前缀稳定以命中上下文缓存
     messages.append({"role": "system", "content": settings.DEEPSEEK_SYSTEM_PROMPT})
+    for msg in request.context_messages:
+        if msg.role == "system":
+            messages.append({"role": msg.role, "content": msg.content})
 
     # 检查是否使用深度思考模型
     is_reasoner = request.use_deep_thinking
 
-    # 添加上下文消息，保留最近的context_length条
-    context_messages = request.context_messages
-    if len(context_messages) > request.context_length:
-        context_messages = context_messages[-request.context_length :]
+    # 添加上下文消息，至少保留context_length条；按块对齐截断，使连续多轮请求的前缀保持不变
+    context_messages = truncate_context_aligned(
+        [msg for msg in request.context_messages if msg.role != "system"],
+        request.context_length,
+        settings.CONTEXT_TRUNCATE_BLOCK_SIZE,
+    )
 
     # 如果是deepseek-reasoner模型，需要特殊处理消息序列
     if is_reasoner and context_messages:
@@ -217,13 +297,16 @@ def check_mcp_compatibility(request: ChatRequest, model: str) -> tuple[bool, boo
     return use_mcp, True
 
 
-async def initialize_mcp_clients(chat_service: DeepSeekChatService, request: ChatRequest) -> None:
+async def initialize_mcp_clients(
+    chat_service: DeepSeekChatService, request: ChatRequest, user_id: Optional[int] = None
+) -> None:
     """
     初始化MCP客户端
     
     Args:
         chat_service: DeepSeek聊天服务
         request: 聊天请求对象
+        user_id: 用户ID，用户自定义MCP客户端按用户计入客户端池上限
     """
     logger.info("正在初始化MCP客户端...")
 
@@ -232,7 +315,7 @@ async def initialize_mcp_clients(chat_service: DeepSeekChatService, request: Cha
         # 使用用户自定义MCP配置
         logger.info("使用用户自定义MCP配置")
         logger.info(f"用户配置的服务器: {list(request.user_mcp_config.keys())}")
-        await chat_service.initialize_user_mcp_client(request.user_mcp_config)
+        await chat_service.initialize_user_mcp_client(request.user_mcp_config, user_id)
         logger.info("用户自定义MCP客户端初始化成功")
     else:
         # 使用基本MCP工具
@@ -258,7 +341,9 @@ async def initialize_mcp_clients(chat_service: DeepSeekChatService, request: Cha
         logger.info("基础MCP客户端初始化成功")
 
 
-async def process_response_chunk(chunk, model: str) -> tuple[Dict[str, Any], str]:
+async def process_response_chunk(
+    chunk, model: str
+) -> tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
     """
     处理响应块
     
@@ -267,7 +352,7 @@ async def process_response_chunk(chunk, model: str) -> tuple[Dict[str, Any], str
         model: 模型名称
         
     Returns:
-        (处理后的块字典, SSE消息) 的元组
+        (处理后的块字典, 流事件) 的元组，没有需要发送的内容时流事件为None
     """
     # 转换响应块为字典
     if hasattr(chunk, "model_dump"):
@@ -298,9 +383,7 @@ async def process_response_chunk(chunk, model: str) -> tuple[Dict[str, Any], str
     ):
         # 工具调用开始事件
         tool_call = chunk_dict["complete_tool_calls"][0]
-        return chunk_dict, MessageProcessor.format_sse_message(
-            content=None, reasoning_content=None, tool_calls=[tool_call]
-        )
+        return chunk_dict, MessageProcessor.build_event(tool_calls=[tool_call])
 
     if (
         "tool_call_result" in chunk_dict
@@ -312,11 +395,9 @@ async def process_response_chunk(chunk, model: str) -> tuple[Dict[str, Any], str
         # 将工具结果放在tool_call中，而不是content中
         if "tool_result" in chunk_dict and chunk_dict["tool_result"]:
             tool_call["result"] = chunk_dict["tool_result"]
-        return chunk_dict, MessageProcessor.format_sse_message(
-            content=None, reasoning_content=None, tool_calls=[tool_call]
-        )
+        return chunk_dict, MessageProcessor.build_event(tool_calls=[tool_call])
 
-    # 处理普通内容
+    # 处理普通内容，空增量在编码时按SSE版本决定是否发送
     if content is not None or reasoning_content is not None:
         if model == "deepseek-reasoner" and (
             content is not None or reasoning_content is not None
@@ -326,13 +407,9 @@ async def process_response_chunk(chunk, model: str) -> tuple[Dict[str, Any], str
                 f"为deepseek-reasoner生成SSE消息，内容长度: content={len(content) if content else 0}, "
                 f"reasoning_content={len(reasoning_content) if reasoning_content else 0}"
             )
-            return chunk_dict, MessageProcessor.format_sse_message(
-                content, reasoning_content
-            )
+            return chunk_dict, MessageProcessor.build_event(content, reasoning_content)
         elif content is not None:
-            return chunk_dict, MessageProcessor.format_sse_message(
-                content=content, reasoning_content=None
-            )
+            return chunk_dict, MessageProcessor.build_event(content=content)
     
     return chunk_dict, None
 
@@ -2,18 +2,28 @@
 DeepSeek聊天服务模块，提供与DeepSeek API的交互功能
 """
 
-import json
 import logging
 import asyncio
+import time
 from typing import AsyncGenerator, Dict, Any, Optional, List
 
-from openai import AsyncOpenAI
-
 from app.core.config import settings
 from app.services.mcp import MCPServiceManager
 from app.services.mcp.manager import MCPManager
 from app.services.mcp.tool_handler import ToolHandler
+from app.services.mcp.tool_selector import tool_selector
 from app.services.mcp.models import MCPTransportType
+from app.services.upstream import (
+    SchedulerSlot,
+    UpstreamPriority,
+    UpstreamUnavailableError,
+    backoff_delay,
+    circuit_breakers,
+    is_retryable_error,
+    upstream_router,
+    upstream_scheduler,
+    UpstreamEndpoint,
+)
 from app.schemas.chat import UserMCPConfig
 
 logger = logging.getLogger(__name__)
@@ -29,15 +39,43 @@ else:
     logger.setLevel(logging.INFO)
 
 
+class _PrefetchedStream:
+    """已读取首个响应块的上游流，迭代时先返回首个响应块"""
+
+    def __init__(self, response, iterator, first_chunk):
+        self._response = response
+        self._iterator = iterator
+        self._first_chunk = first_chunk
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        if self._first_chunk is not None:
+            yield self._first_chunk
+        async for chunk in self._iterator:
+            yield chunk
+
+    async def close(self):
+        """关闭上游HTTP流"""
+        await self._response.close()
+
+
+class _AttemptError(Exception):
+    """一次上游端点请求失败，记录失败的端点和是否可重试"""
+
+    def __init__(self, endpoint: UpstreamEndpoint, error: Exception, retryable: bool):
+        super().__init__(str(error))
+        self.endpoint = endpoint
+        self.error = error
+        self.retryable = retryable
+
+
 class DeepSeekChatService:
     """DeepSeek聊天服务，用于处理聊天请求并返回流式响应"""
 
     def __init__(self):
-        """初始化DeepSeek API客户端"""
-        self.client = AsyncOpenAI(
-            api_key=settings.DEEPSEEK_API_KEY,
-            base_url=settings.DEEPSEEK_API_BASE,
-        )
+        """初始化DeepSeek聊天服务，API客户端由上游路由器按端点共享"""
         # 初始化MCP服务管理器
         self.mcp_manager = MCPManager()
         self.tool_handler = ToolHandler(self.mcp_manager.mcp_service)
@@ -51,17 +89,20 @@ class DeepSeekChatService:
         """
         return await self.mcp_manager.initialize_all_clients()
 
-    async def initialize_user_mcp_client(self, config: UserMCPConfig):
+    async def initialize_user_mcp_client(
+        self, config: UserMCPConfig, user_id: Optional[int] = None
+    ):
         """
         初始化用户自定义MCP客户端
 
         Args:
             config: 用户自定义MCP配置（字典，键为服务器名称，值为服务器配置）
+            user_id: 用户ID，用于用户MCP客户端池的每用户上限
 
         Returns:
             初始化后的MCP客户端
         """
-        return await self.mcp_manager.initialize_user_client(config)
+        return await self.mcp_manager.initialize_user_client(config, user_id)
 
     async def get_active_mcp_client(
         self, server_name: str = None, user_mcp_config: Optional[UserMCPConfig] = None
@@ -91,6 +132,8 @@ class DeepSeekChatService:
         temperature: float = None,
         use_mcp: bool = False,
         user_mcp_config: Optional[UserMCPConfig] = None,
+        user_id: Optional[int] = None,
+        priority: str = UpstreamPriority.INTERACTIVE,
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         通过DeepSeek API生成聊天完成
@@ -101,35 +144,252 @@ class DeepSeekChatService:
             temperature: 模型温度，默认使用系统配置值
             use_mcp: 是否使用MCP工具
             user_mcp_config: 用户自定义MCP配置
+            user_id: 用户ID，用于上游调度的用户间公平和用户MCP客户端池的每用户上限
+            priority: 上游调度优先级类别
 
         Yields:
             聊天完成响应块
         """
-        try:
-            # 从消息中获取服务器名称
-            server_name = self._extract_server_name(messages)
+        # 从消息中获取服务器名称
+        server_name = self._extract_server_name(messages)
+
+        # 初始化MCP客户端并获取工具，工具较多时只发送与最近用户消息最相关的子集
+        tools = None
+        fallback_tools = None
+        if use_mcp:
+            tools = await self._prepare_tools(user_mcp_config, server_name, user_id)
+            if tools:
+                selected = tool_selector.select(tools, messages)
+                if selected is not tools:
+                    tools, fallback_tools = selected, tools
+
+        async for chunk_dict in self._stream_completion(
+            messages, model, temperature, use_mcp, tools, fallback_tools, user_id, priority
+        ):
+            yield chunk_dict
 
-            # 初始化MCP客户端并获取工具
-            tools = None
-            if use_mcp:
-                tools = await self._prepare_tools(user_mcp_config, server_name)
+    async def _stream_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        use_mcp: bool,
+        tools: Optional[List[Dict[str, Any]]],
+        fallback_tools: Optional[List[Dict[str, Any]]],
+        user_id: Optional[int],
+        priority: str,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        使用给定的工具列表调用上游并处理流式响应
 
+        Args:
+            messages: 聊天消息列表
+            model: 模型名称
+            temperature: 模型温度
+            use_mcp: 是否使用MCP工具
+            tools: 发送给模型的工具列表
+            fallback_tools: 工具为子集时的完整工具列表，模型请求子集外的工具时用它重试
+            user_id: 用户ID
+            priority: 上游调度优先级类别
+
+        Yields:
+            聊天完成响应块
+        """
+        slot = None
+        try:
             # 构建API请求参数
             params = await self._build_api_params(messages, model, temperature, tools)
 
+            # 模型的所有上游端点都熔断时直接快速失败，不占用调度名额
+            if not upstream_router.select(model):
+                raise UpstreamUnavailableError(
+                    "模型服务暂时不可用，请稍后再试", self._retry_after(model)
+                )
+
+            # 等待上游调度器分配名额
+            requested_at = time.monotonic()
+            slot = await upstream_scheduler.acquire(priority, user_id)
+
             # 调用API
             logger.info(f"开始调用 {model} 模型生成聊天完成")
-            response = await self.client.chat.completions.create(**params)
+            response = await self._open_stream(params)
 
             # 处理流式响应
+            first_chunk = True
             async for chunk_dict in self._process_streaming_response(
-                response, use_mcp, messages, model, temperature
+                response,
+                use_mcp,
+                messages,
+                model,
+                temperature,
+                slot,
+                user_id,
+                tools=tools,
+                fallback_tools=fallback_tools,
             ):
+                if first_chunk:
+                    first_chunk = False
+                    upstream_scheduler.record_ttft(
+                        priority, time.monotonic() - requested_at
+                    )
                 yield chunk_dict
 
         except Exception as e:
             logger.error(f"调用DeepSeek API错误: {str(e)}")
             raise
+        finally:
+            if slot is not None:
+                slot.release()
+
+    async def _open_stream(self, params: Dict[str, Any]) -> _PrefetchedStream:
+        """
+        打开上游流并读取首个响应块
+
+        按延迟和健康状态选择端点，启用对冲时首字节超过p95阈值会向备选端点再发一个请求，
+        先返回首字节的一方胜出，另一方被取消。调用受各端点熔断器管控；首字节到达前的可重试错误
+        （连接失败、超时、限流、5xx）按带抖动的指数退避换端点重试，首字节之后不再重试，避免重复输出
+
+        Args:
+            params: API请求参数
+
+        Returns:
+            已读取首个响应块的上游流
+
+        Raises:
+            UpstreamUnavailableError: 所有端点熔断中或重试耗尽
+        """
+        model = params["model"]
+        failed: List[UpstreamEndpoint] = []
+        attempt = 0
+
+        while True:
+            candidates = upstream_router.select(model, exclude=failed) or upstream_router.select(
+                model
+            )
+            if not candidates:
+                raise UpstreamUnavailableError(
+                    "模型服务暂时不可用，请稍后再试", self._retry_after(model)
+                )
+
+            try:
+                return await self._open_with_hedge(candidates, params)
+            except _AttemptError as e:
+                # 请求本身无效等不可重试的错误直接抛出
+                if not e.retryable:
+                    raise e.error
+
+                failed.append(e.endpoint)
+                if attempt >= settings.UPSTREAM_MAX_RETRIES:
+                    logger.error(f"上游调用重试 {attempt} 次后仍然失败: {str(e.error)}")
+                    raise UpstreamUnavailableError(
+                        "模型服务暂时不可用，请稍后再试", max(self._retry_after(model), 1)
+                    ) from e.error
+
+                delay = backoff_delay(
+                    attempt,
+                    settings.UPSTREAM_RETRY_BASE_DELAY,
+                    settings.UPSTREAM_RETRY_MAX_DELAY,
+                )
+                attempt += 1
+                logger.warning(
+                    f"上游端点 {e.endpoint.name} 调用失败（{type(e.error).__name__}），"
+                    f"{delay:.2f}秒后进行第 {attempt} 次重试"
+                )
+                await asyncio.sleep(delay)
+
+    async def _open_with_hedge(
+        self, candidates: List[UpstreamEndpoint], params: Dict[str, Any]
+    ) -> _PrefetchedStream:
+        """向首选端点发起请求，首字节超过对冲阈值时向备选端点发起对冲请求"""
+        model = params["model"]
+        delay = upstream_router.hedge_delay(model) if len(candidates) > 1 else None
+
+        tasks = {asyncio.create_task(self._attempt(candidates[0], params))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                logger.info(
+                    f"上游端点 {candidates[0].name} 首字节超过 {delay:.2f}秒，"
+                    f"向 {candidates[1].name} 发起对冲请求"
+                )
+                tasks.add(asyncio.create_task(self._attempt(candidates[1], params)))
+
+            first_error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    # 关闭同时完成的多余流
+                    for extra in winners[1:]:
+                        await extra.result().close()
+                    return winners[0].result()
+                first_error = first_error or next(iter(done)).exception()
+            raise first_error
+        finally:
+            # 取消落败或被放弃的请求，_attempt会关闭对应的上游流
+            for task in tasks:
+                task.cancel()
+
+    async def _attempt(
+        self, endpoint: UpstreamEndpoint, params: Dict[str, Any]
+    ) -> _PrefetchedStream:
+        """向指定端点发起一次请求并读取首个响应块"""
+        model = params["model"]
+        breaker = circuit_breakers.get(endpoint.name)
+        if not breaker.allow():
+            raise _AttemptError(
+                endpoint,
+                UpstreamUnavailableError("模型服务暂时不可用", breaker.retry_after()),
+                retryable=True,
+            )
+
+        endpoint.in_flight += 1
+        started = time.monotonic()
+        response = None
+        first_chunk = None
+        try:
+            response = await endpoint.client.chat.completions.create(
+                **{**params, "model": endpoint.model_name(model)}
+            )
+            iterator = response.__aiter__()
+            try:
+                first_chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                pass
+        except asyncio.CancelledError:
+            breaker.record_ignored()
+            if response is not None:
+                await response.close()
+            raise
+        except Exception as e:
+            if response is not None:
+                try:
+                    await response.close()
+                except Exception:
+                    pass
+
+            # 请求本身无效等不可重试的错误不计入熔断统计
+            if not is_retryable_error(e):
+                breaker.record_ignored()
+                raise _AttemptError(endpoint, e, retryable=False)
+
+            breaker.record_failure()
+            raise _AttemptError(endpoint, e, retryable=True)
+        finally:
+            endpoint.in_flight -= 1
+
+        ttfb = time.monotonic() - started
+        breaker.record_success(ttfb)
+        upstream_router.record_ttfb(endpoint, model, ttfb)
+        return _PrefetchedStream(response, iterator, first_chunk)
+
+    def _retry_after(self, model: str) -> int:
+        """模型所有端点中最早恢复的熔断剩余时间（秒）"""
+        waits = [
+            circuit_breakers.get(endpoint.name).retry_after()
+            for endpoint in upstream_router.endpoints_for(model)
+        ]
+        return min(waits) if waits else 0
 
     def _extract_server_name(self, messages: List[Dict[str, str]]) -> Optional[str]:
         """从消息中提取服务器名称"""
@@ -142,7 +402,10 @@ class DeepSeekChatService:
         return None
 
     async def _prepare_tools(
-        self, user_mcp_config: Optional[UserMCPConfig], server_name: Optional[str]
+        self,
+        user_mcp_config: Optional[UserMCPConfig],
+        server_name: Optional[str],
+        user_id: Optional[int] = None,
     ) -> Optional[List[Dict[str, Any]]]:
         """准备MCP工具"""
         tools = None
@@ -150,7 +413,7 @@ class DeepSeekChatService:
         try:
             if user_mcp_config:
                 # 使用用户自定义配置
-                await self.initialize_user_mcp_client(user_mcp_config)
+                await self.initialize_user_mcp_client(user_mcp_config, user_id)
                 tools = await self.mcp_manager.get_all_tools()
             elif server_name:
                 # 使用指定服务器
@@ -180,7 +443,10 @@ class DeepSeekChatService:
             "model": model,
             "messages": messages,
             "stream": True,
-            "temperature": temperature or settings.DEEPSEEK_DEFAULT_TEMPERATURE,
+            # 显式传入0时保留，以支持确定性生成
+            "temperature": (
+                temperature if temperature is not None else settings.DEEPSEEK_DEFAULT_TEMPERATURE
+            ),
         }
 
         if tools:
@@ -195,11 +461,62 @@ class DeepSeekChatService:
         messages: List[Dict[str, str]],
         model: str,
         temperature: float,
+        slot: Optional[SchedulerSlot] = None,
+        user_id: Optional[int] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        fallback_tools: Optional[List[Dict[str, Any]]] = None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """处理流式响应"""
+        try:
+            async for chunk_dict in self._iterate_streaming_response(
+                response,
+                use_mcp,
+                messages,
+                model,
+                temperature,
+                slot,
+                user_id,
+                tools=tools,
+                fallback_tools=fallback_tools,
+            ):
+                yield chunk_dict
+        finally:
+            # 生成被中止时取消尚未使用的提前执行工具调用
+            self.tool_handler.cancel_pending()
+            # 生成结束或被中止时关闭上游HTTP流，释放连接
+            close = getattr(response, "close", None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception as e:
+                    logger.debug(f"关闭上游流时出错: {str(e)}")
+
+    async def _iterate_streaming_response(
+        self,
+        response,
+        use_mcp: bool,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        slot: Optional[SchedulerSlot] = None,
+        user_id: Optional[int] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        fallback_tools: Optional[List[Dict[str, Any]]] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """逐块处理流式响应，必要时执行工具调用并递归生成"""
         tool_calls = []
-        content_buffer = ""
+        content_parts = []  # 内容片段，需要时再拼接，避免逐块拼接字符串
         sent_tool_calls = set()  # 记录已发送的工具调用ID
+        self.tool_handler.reset()
+        # 参数完整后允许提前执行的工具
+        early_dispatch_names = (
+            {tool["function"]["name"] for tool in tools} if use_mcp and tools else None
+        )
+        # 只发送了工具子集时，模型可能请求子集之外的工具而需要用完整工具列表重新生成，
+        # 本轮输出暂存到工具名称校验通过（或没有工具调用）后再发送，避免客户端收到重复内容
+        held_chunks: Optional[List[Dict[str, Any]]] = (
+            [] if fallback_tools is not None else None
+        )
 
         # 处理流式响应
         async for chunk in response:
@@ -215,7 +532,7 @@ class DeepSeekChatService:
                 hasattr(chunk.choices[0].delta, "content")
                 and chunk.choices[0].delta.content
             ):
-                content_buffer += chunk.choices[0].delta.content
+                content_parts.append(chunk.choices[0].delta.content)
 
             # 处理推理内容 (特别针对deepseek-reasoner模型)
             if (
@@ -232,16 +549,34 @@ class DeepSeekChatService:
                 hasattr(chunk.choices[0].delta, "tool_calls")
                 and chunk.choices[0].delta.tool_calls
             ):
-                tool_calls = await self.tool_handler.update_tool_calls(
-                    chunk, tool_calls
-                )
+                self.tool_handler.update_tool_calls(chunk)
+
+                # 参数JSON已闭合的工具调用立即开始执行，不等待模型输出其余工具调用
+                if early_dispatch_names is not None:
+                    for i, tool_call in self.tool_handler.dispatch_ready(
+                        early_dispatch_names
+                    ):
+                        tool_id = tool_call.get("id", str(i))
+                        start_chunk = {
+                            "choices": [{"delta": {}, "finish_reason": None}],
+                            "tool_call_start": True,
+                            "complete_tool_calls": [tool_call],
+                        }
+                        if held_chunks is not None:
+                            held_chunks.append(start_chunk)
+                        else:
+                            yield start_chunk
+                        sent_tool_calls.add(tool_id)
 
             # 发送内容（没有工具调用信息）
             if (
                 hasattr(chunk.choices[0].delta, "content")
                 and chunk.choices[0].delta.content
             ):
-                yield chunk_dict
+                if held_chunks is not None:
+                    held_chunks.append(chunk_dict)
+                else:
+                    yield chunk_dict
 
             # 如果是最后一个块且包含usage信息，确保传递它
             if (
@@ -250,13 +585,53 @@ class DeepSeekChatService:
                 and hasattr(chunk, "usage")
             ):
                 logger.info(f"检测到包含token使用统计的最终响应: {chunk.usage}")
-                yield chunk_dict
+                if held_chunks is not None:
+                    held_chunks.append(chunk_dict)
+                else:
+                    yield chunk_dict
 
             # 处理工具调用完成事件
             is_tool_call_finished = (
                 hasattr(chunk.choices[0], "finish_reason")
                 and chunk.choices[0].finish_reason == "tool_calls"
             )
+            if is_tool_call_finished:
+                # 工具调用输出结束，一次性拼接各工具调用的参数片段
+                tool_calls = self.tool_handler.get_tool_calls()
+
+            # 模型请求了工具子集之外的工具：使用完整工具列表重新生成本轮回复
+            if tool_calls and is_tool_call_finished and fallback_tools is not None:
+                offered = {tool["function"]["name"] for tool in tools or []}
+                unknown = [
+                    tool_call.get("function", {}).get("name")
+                    for tool_call in tool_calls
+                    if tool_call.get("function", {}).get("name") not in offered
+                ]
+                if unknown:
+                    logger.info(
+                        f"模型请求了未发送的工具 {unknown}，丢弃本轮暂存的 {len(held_chunks or [])} 个响应块，"
+                        f"使用完整工具列表重试"
+                    )
+                    if slot is not None:
+                        slot.release()
+                    async for new_chunk in self._stream_completion(
+                        messages,
+                        model,
+                        temperature,
+                        use_mcp,
+                        fallback_tools,
+                        None,
+                        user_id,
+                        UpstreamPriority.AGENT,
+                    ):
+                        yield new_chunk
+                    return
+
+            # 本轮输出结束且不需要重试，发送暂存的响应块
+            if held_chunks is not None and getattr(chunk.choices[0], "finish_reason", None):
+                for held_chunk in held_chunks:
+                    yield held_chunk
+                held_chunks = None
 
             # 检查是否有新完成的工具调用需要发送
             if tool_calls and is_tool_call_finished:
@@ -275,12 +650,17 @@ class DeepSeekChatService:
 
                 # 如果启用了工具，执行工具调用
                 if use_mcp:
+                    # 本次上游流已结束，执行工具期间归还调度名额，避免与后续请求互相等待
+                    if slot is not None:
+                        slot.release()
+
                     # 处理工具调用并获取结果
                     tool_results = await self.tool_handler.process_tool_calls(
                         tool_calls
                     )
                     
-                    # 发送工具调用结果
+                    # 发送工具调用结果，共享内存中的大结果在这里解码一次，
+                    # 之后写入消息列表时的str()复用同一个字符串
                     for tool_call, result in tool_results:
                         result_chunk = {
                             "choices": [{"delta": {}, "finish_reason": None}],
@@ -292,7 +672,7 @@ class DeepSeekChatService:
 
                     # 更新消息列表，添加工具调用和结果
                     updated_messages = self._update_messages_with_tool_results(
-                        messages, content_buffer, tool_calls, tool_results
+                        messages, "".join(content_parts), tool_calls, tool_results
                     )
                     
                     # 递归调用生成新的完成
@@ -302,6 +682,8 @@ class DeepSeekChatService:
                             model=model,
                             temperature=temperature,
                             use_mcp=False,  # 避免无限递归
+                            user_id=user_id,
+                            priority=UpstreamPriority.AGENT,  # 进行中的智能体回合优先完成
                         ):
                             yield new_chunk
                     except Exception as recursive_error:
@@ -317,6 +699,11 @@ class DeepSeekChatService:
                             ]
                         }
 
+        # 上游流没有给出结束原因就结束时，仍发送暂存的响应块
+        if held_chunks:
+            for held_chunk in held_chunks:
+                yield held_chunk
+
     def _process_reasoner_chunk(self, chunk, chunk_dict):
         """处理推理模型的响应块"""
         if (
@@ -328,9 +715,6 @@ class DeepSeekChatService:
                 chunk_dict["choices"][0]["delta"]["reasoning_content"] = (
                     chunk.choices[0].delta.reasoning_content
                 )
-        logger.debug(
-            f"处理推理内容: {chunk.choices[0].delta.reasoning_content}"
-        )
         return chunk_dict
 
     def _update_messages_with_tool_results(
@@ -4,14 +4,188 @@
 
 import json
 import logging
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Union
+
+from app.utils.json_utils import dumps_bytes
 
 logger = logging.getLogger(__name__)
 
 
+class SSEVersion:
+    """SSE帧格式版本常量"""
+    V1 = 1  # 完整字段帧，兼容现有Flutter客户端
+    V2 = 2  # 紧凑帧，只携带存在的字段，短事件类型，UTF-8直出
+
+
+class StreamEventType:
+    """流事件类型常量"""
+    DELTA = "delta"  # 正文/推理内容增量
+    TOOL = "tool"  # 工具调用开始或结果
+    ERROR = "error"  # 错误
+    DONE = "done"  # 结束标记
+
+
+# v2帧中事件类型和字段名的短名称
+_V2_EVENT_TYPES = {
+    StreamEventType.DELTA: "d",
+    StreamEventType.TOOL: "t",
+    StreamEventType.ERROR: "e",
+}
+_V2_FIELD_NAMES = {
+    "content": "c",
+    "reasoning_content": "r",
+    "tool_calls": "tc",
+    "error": "e",
+    "code": "code",
+    "retry_after": "ra",
+}
+
+# 预编码的常量帧缓存，键为(版本, 事件类型)
+_CONSTANT_FRAMES = {
+    (SSEVersion.V1, StreamEventType.DONE): b"data: [DONE]\n\n",
+    (SSEVersion.V2, StreamEventType.DONE): b"data: [DONE]\n\n",
+}
+
+
 class MessageProcessor:
     """消息处理器，处理并格式化聊天消息"""
 
+    DONE_EVENT: Dict[str, Any] = {"type": StreamEventType.DONE}
+
+    @staticmethod
+    def negotiate_version(requested: Optional[Union[int, str]]) -> int:
+        """
+        根据客户端请求的版本号（请求头或查询参数）确定SSE帧格式版本
+
+        Args:
+            requested: 客户端请求的版本号
+
+        Returns:
+            实际使用的SSE帧格式版本，无法识别时回退到v1
+        """
+        try:
+            version = int(requested) if requested is not None else SSEVersion.V1
+        except (TypeError, ValueError):
+            return SSEVersion.V1
+        return version if version in (SSEVersion.V1, SSEVersion.V2) else SSEVersion.V1
+
+    @staticmethod
+    def build_event(
+        content: Optional[str] = None,
+        reasoning_content: Optional[str] = None,
+        tool_calls: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        构建流事件，只包含存在的字段
+
+        Args:
+            content: 正文内容
+            reasoning_content: 推理过程内容
+            tool_calls: 工具调用信息
+
+        Returns:
+            流事件字典
+        """
+        if tool_calls:
+            return {"type": StreamEventType.TOOL, "tool_calls": tool_calls}
+
+        event = {"type": StreamEventType.DELTA}
+        if content:
+            event["content"] = content
+        if reasoning_content:
+            event["reasoning_content"] = reasoning_content
+        return event
+
+    @staticmethod
+    def build_error_event(
+        error: str, code: Optional[str] = None, retry_after: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        构建错误事件
+
+        Args:
+            error: 错误信息
+            code: 结构化错误代码，便于客户端区分处理
+            retry_after: 建议的重试等待时间（秒）
+
+        Returns:
+            错误事件字典
+        """
+        event = {"type": StreamEventType.ERROR, "error": error}
+        if code:
+            event["code"] = code
+        if retry_after is not None:
+            event["retry_after"] = retry_after
+        return event
+
+    @staticmethod
+    def is_empty_delta(event: Dict[str, Any]) -> bool:
+        """
+        判断是否为没有实际内容的增量事件
+
+        v1保留这类事件以保持与原有帧序列一致，v2不发送
+
+        Args:
+            event: 流事件字典
+
+        Returns:
+            是否为空增量事件
+        """
+        return (
+            event.get("type", StreamEventType.DELTA) == StreamEventType.DELTA
+            and not event.get("content")
+            and not event.get("reasoning_content")
+        )
+
+    @staticmethod
+    def encode_event(
+        event: Dict[str, Any],
+        version: int = SSEVersion.V1,
+        event_id: Optional[int] = None,
+    ) -> bytes:
+        """
+        将流事件编码为指定版本的SSE帧
+
+        Args:
+            event: 流事件字典
+            version: SSE帧格式版本
+            event_id: SSE事件ID，客户端重连时通过Last-Event-ID带回
+
+        Returns:
+            UTF-8编码的SSE帧
+        """
+        frame = MessageProcessor._encode_data(event, version)
+        if event_id is None:
+            return frame
+        return b"id: %d\n" % event_id + frame
+
+    @staticmethod
+    def _encode_data(event: Dict[str, Any], version: int) -> bytes:
+        """将流事件编码为SSE data帧（不含事件ID）"""
+        event_type = event.get("type", StreamEventType.DELTA)
+
+        # 常量帧直接使用预编码结果
+        frame = _CONSTANT_FRAMES.get((version, event_type))
+        if frame is not None:
+            return frame
+
+        if version == SSEVersion.V2:
+            data = {"t": _V2_EVENT_TYPES.get(event_type, event_type)}
+            for field, short_name in _V2_FIELD_NAMES.items():
+                value = event.get(field)
+                if value is not None:
+                    data[short_name] = value
+            return b"data: " + dumps_bytes(data) + b"\n\n"
+
+        # v1：保持原有的完整字段帧格式
+        if event_type == StreamEventType.ERROR:
+            return MessageProcessor.format_error_message(
+                event.get("error", ""), event.get("code"), event.get("retry_after")
+            ).encode("utf-8")
+        return MessageProcessor.format_sse_message(
+            event.get("content"), event.get("reasoning_content"), event.get("tool_calls")
+        ).encode("utf-8")
+
     @staticmethod
     def format_sse_message(
         content: Optional[str] = None,
@@ -38,12 +212,16 @@ class MessageProcessor:
         return f"data: {json.dumps(data)}\n\n"
 
     @staticmethod
-    def format_error_message(error: str) -> str:
+    def format_error_message(
+        error: str, code: Optional[str] = None, retry_after: Optional[int] = None
+    ) -> str:
         """
         将错误信息格式化为SSE消息
 
         Args:
             error: 错误信息
+            code: 结构化错误代码，存在时才写入
+            retry_after: 建议的重试等待时间（秒），存在时才写入
 
         Returns:
             格式化后的SSE错误消息
@@ -54,6 +232,10 @@ class MessageProcessor:
             "reasoning_content": "",
             "tool_calls": [],
         }
+        if code:
+            data["code"] = code
+        if retry_after is not None:
+            data["retry_after"] = retry_after
         return f"data: {json.dumps(data)}\n\n"
 
     @staticmethod
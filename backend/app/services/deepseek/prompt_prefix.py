@@ -0,0 +1,113 @@
+"""
+提示前缀稳定模块，让连续多轮请求共享尽可能长的相同前缀，提高DeepSeek上下文缓存命中率，
+并按用户和模型统计缓存命中情况
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def truncate_context_aligned(
+    context_messages: Sequence[T], context_length: int, block_size: int
+) -> List[T]:
+    """
+    按对齐的块截断上下文
+
+    窗口起点只以block_size为步长前移，而不是每轮滑动一条消息，
+    这样连续多轮请求的消息前缀保持不变。起点向下对齐，保证至少保留context_length条消息，
+    保留的消息数在 context_length 到 context_length + block_size - 1 之间
+
+    Args:
+        context_messages: 完整的上下文消息
+        context_length: 至少保留的消息数
+        block_size: 截断块大小，1表示逐条滑动
+
+    Returns:
+        截断后的上下文消息
+    """
+    overflow = len(context_messages) - context_length
+    if overflow <= 0:
+        return list(context_messages)
+    block_size = max(1, min(block_size, context_length)) if context_length > 0 else 1
+    start = overflow // block_size * block_size
+    return list(context_messages[start:])
+
+
+class PromptCacheStats:
+    """按(用户ID, 模型)统计上下文缓存命中的token数，条目数有上限，超出时淘汰最久未更新的条目"""
+
+    def __init__(self, max_keys: int = 10000):
+        """
+        初始化统计
+
+        Args:
+            max_keys: 最多保留的(用户ID, 模型)组合数
+        """
+        self.max_keys = max_keys
+        self._stats: "OrderedDict[Tuple[int, str], Dict[str, int]]" = OrderedDict()
+
+    def record(self, user_id: int, model: str, usage: Dict[str, Any]) -> None:
+        """
+        记录一次请求的缓存命中情况
+
+        Args:
+            user_id: 用户ID
+            model: 模型名称
+            usage: DeepSeek API返回的token使用信息
+        """
+        key = (user_id, model)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = {"requests": 0, "hit_tokens": 0, "miss_tokens": 0}
+            self._stats[key] = stats
+            if len(self._stats) > self.max_keys:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(key)
+
+        stats["requests"] += 1
+        stats["hit_tokens"] += usage.get("prompt_cache_hit_tokens") or 0
+        stats["miss_tokens"] += usage.get("prompt_cache_miss_tokens") or 0
+
+    def metrics(self, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        获取各模型的缓存命中率
+
+        Args:
+            user_id: 指定时只统计该用户，否则统计所有用户
+
+        Returns:
+            以模型名称为键的命中统计
+        """
+        by_model: Dict[str, Dict[str, int]] = {}
+        for (uid, model), stats in self._stats.items():
+            if user_id is not None and uid != user_id:
+                continue
+            total = by_model.setdefault(
+                model, {"requests": 0, "hit_tokens": 0, "miss_tokens": 0}
+            )
+            for name, value in stats.items():
+                total[name] += value
+
+        return {
+            model: {
+                **total,
+                "hit_ratio": _hit_ratio(total["hit_tokens"], total["miss_tokens"]),
+            }
+            for model, total in by_model.items()
+        }
+
+
+def _hit_ratio(hit_tokens: int, miss_tokens: int) -> float:
+    """计算缓存命中率"""
+    prompt_tokens = hit_tokens + miss_tokens
+    return round(hit_tokens / prompt_tokens, 3) if prompt_tokens else 0.0
+
+
+# 当前工作进程的全局上下文缓存命中统计
+prompt_cache_stats = PromptCacheStats()
@@ -4,13 +4,14 @@ Token使用量管理模块，负责处理和更新用户的token使用情况
 
 import logging
 import traceback
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.token_usage import TokenUsage
 from app.crud.user import user as user_crud
 from app.utils.datetime_utils import get_now_naive
+from app.utils.token_utils import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +19,13 @@ logger = logging.getLogger(__name__)
 class TokenManager:
     """Token使用量管理器，负责处理和更新用户的token使用情况"""
 
+    # 零成本的使用量，用于记录响应缓存命中等不消耗上游token的请求
+    ZERO_USAGE: Dict[str, int] = {
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+    }
+
     @staticmethod
     async def update_token_usage(
         db: AsyncSession,
@@ -67,6 +75,48 @@ class TokenManager:
             # 记录详细错误信息
             logger.error(f"错误详情: {traceback.format_exc()}")
 
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """
+        估算文本的token数量
+
+        按DeepSeek官方换算比例估算：1个中文字符约0.6个token，1个英文字符约0.3个token
+
+        Args:
+            text: 要估算的文本
+
+        Returns:
+            估算的token数量
+        """
+        return estimate_tokens(text)
+
+    @staticmethod
+    def estimate_usage(
+        messages: List[Dict[str, Any]], completion_text: str
+    ) -> Dict[str, Any]:
+        """
+        在上游未返回usage时（如生成被中止）估算token使用信息
+
+        Args:
+            messages: 发送给模型的消息列表
+            completion_text: 已生成的内容
+
+        Returns:
+            与DeepSeek API格式一致的token使用信息
+        """
+        prompt_tokens = sum(
+            TokenManager.estimate_tokens(str(msg.get("content") or ""))
+            for msg in messages
+        )
+        completion_tokens = TokenManager.estimate_tokens(completion_text)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": prompt_tokens,
+        }
+
     @staticmethod
     def _extract_token_info(usage: Dict[str, Any]) -> Dict[str, int]:
         """从API响应中提取token使用信息"""
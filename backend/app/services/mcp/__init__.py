@@ -3,9 +3,10 @@ MCP服务模块，提供与MCP (Model Control Protocol) 工具交互的功能
 """
 
 from app.services.mcp.service import MCPServiceManager
-from app.services.mcp.models import MCPTransportType
+from app.services.mcp.models import MCPClientMode, MCPTransportType
 
 __all__ = [
+    "MCPClientMode",
     "MCPServiceManager",
     "MCPTransportType",
 ] 
\ No newline at end of file
@@ -6,12 +6,24 @@ MCP客户端服务模块，提供与MCP服务器的连接和工具调用功能
 import json
 import logging
 import asyncio
+import itertools
 import time
 import queue
 from typing import Dict, Any, Optional
 from multiprocessing import Process, Queue, Manager
 
-from .models import MCPToolRequest, MCPListToolsRequest, MCPToolResponse, MCPTransportType
+from app.core.config import settings
+from .models import (
+    MCPAssignRequest,
+    MCPToolRequest,
+    MCPListToolsRequest,
+    MCPPingRequest,
+    MCPToolResponse,
+    MCPTransportType,
+)
+from .session import server_key
+from .spare_workers import spare_worker_pool
+from .tool_list_cache import tool_list_cache
 from .worker import mcp_worker_process
 
 logger = logging.getLogger(__name__)
@@ -42,7 +54,13 @@ class MultiprocessMCPClientService:
         self.request_queue = None
         self.response_queue = None
         self.shutdown_event = None
+        self.tools_changed = None
         self.manager = None
+        self.cache_key = server_key(url, transport_type, self.env)
+        # 请求和响应共用一对队列，响应按请求ID分发给等待方，多个请求可以同时进行
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._worker_error: Optional[str] = None  # 工作进程级别的错误（如连接MCP服务器失败）
 
     async def connect(self) -> bool:
         """
@@ -54,30 +72,52 @@ class MultiprocessMCPClientService:
         # 如果已经有进程在运行，先清理
         if self.process and self.process.is_alive():
             await self.disconnect()
+        self._worker_error = None
 
         try:
-            # 创建进程间通信所需的队列和事件
-            self.manager = Manager()
-            self.request_queue = Queue()
-            self.response_queue = Queue()
-            self.shutdown_event = self.manager.Event()
-
-            # 启动工作进程
-            self.process = Process(
-                target=mcp_worker_process,
-                args=(
-                    self.url,
-                    self.env,
-                    self.request_queue,
-                    self.response_queue,
-                    self.shutdown_event,
-                    self.transport_type,
-                ),
-            )
-            self.process.daemon = True  # 设置为守护进程，主进程退出时自动终止
-            self.process.start()
-
-            logger.info(f"已启动MCP工作进程 PID: {self.process.pid} 连接到 {self.url} 使用 {self.transport_type}")
+            # 有缓存的工具列表时交给工作进程直接使用，连接时不再向服务器获取
+            cached = tool_list_cache.get(self.cache_key)
+
+            # 优先使用预热的空闲工作进程，省去启动进程和导入MCP SDK的时间
+            spare = spare_worker_pool.take() if settings.MCP_SPARE_WORKERS_ENABLED else None
+            if spare is not None:
+                self.manager = spare.manager
+                self.request_queue = spare.request_queue
+                self.response_queue = spare.response_queue
+                self.shutdown_event = spare.shutdown_event
+                self.tools_changed = spare.tools_changed
+                self.process = spare.process
+                self.request_queue.put(
+                    MCPAssignRequest(self.url, self.env, self.transport_type, cached)
+                )
+                logger.info(f"已分配预热的MCP工作进程 PID: {self.process.pid} 连接到 {self.url} 使用 {self.transport_type}")
+            else:
+                # 创建进程间通信所需的队列和事件
+                self.manager = Manager()
+                self.request_queue = Queue()
+                self.response_queue = Queue()
+                self.shutdown_event = self.manager.Event()
+                self.tools_changed = self.manager.Event()
+
+                # 启动工作进程
+                self.process = Process(
+                    target=mcp_worker_process,
+                    args=(
+                        self.url,
+                        self.env,
+                        self.request_queue,
+                        self.response_queue,
+                        self.shutdown_event,
+                        self.transport_type,
+                        cached,
+                        self.tools_changed,
+                        settings.MCP_SHM_RESULT_THRESHOLD,
+                    ),
+                )
+                self.process.daemon = True  # 设置为守护进程，主进程退出时自动终止
+                self.process.start()
+
+                logger.info(f"已启动MCP工作进程 PID: {self.process.pid} 连接到 {self.url} 使用 {self.transport_type}")
 
             # 等待工作进程连接成功或返回错误
             # 使用异步方式轮询队列
@@ -87,12 +127,11 @@ class MultiprocessMCPClientService:
             while time.time() - start_time < timeout:
                 try:
                     # 非阻塞检查响应队列
-                    if not self.response_queue.empty():
-                        response = self.response_queue.get_nowait()
-                        if response.error:
-                            logger.error(f"MCP工作进程连接失败: {response.error}")
-                            await self.disconnect()
-                            return False
+                    self._dispatch_responses()
+                    if self._worker_error:
+                        logger.error(f"MCP工作进程连接失败: {self._worker_error}")
+                        await self.disconnect()
+                        return False
 
                     # 检查进程是否还活着
                     if not self.process.is_alive():
@@ -100,9 +139,16 @@ class MultiprocessMCPClientService:
                         await self.disconnect()
                         return False
 
-                    # 获取可用工具列表
-                    await self.update_available_tools()
-                    if self.available_tools:
+                    # 工作进程连接成功后才处理请求，收到工具列表即表示连接成功
+                    tools = await self._request_tools()
+                    if self._worker_error:
+                        continue
+                    if tools:
+                        if cached is None:
+                            self.available_tools = tool_list_cache.put(self.cache_key, tools)
+                        else:
+                            self.available_tools = cached
+                            tool_list_cache.refresh_if_stale(self.cache_key, self._fetch_tools)
                         logger.info(
                             f"MCP工作进程连接成功，可用工具: {list(self.available_tools.keys())}"
                         )
@@ -126,97 +172,145 @@ class MultiprocessMCPClientService:
             await self.disconnect()
             return False
 
+    async def _request_tools(self, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        向工作进程请求工具列表
+
+        Args:
+            refresh: 是否让工作进程重新从MCP服务器获取
+
+        Returns:
+            工具字典，未收到响应时返回None
+        """
+        logger.debug(f"发送获取工具列表请求到进程 {self.process.pid}")
+        # 重新获取需要访问MCP服务器，使用更长的超时时间
+        response = await self._request(
+            MCPListToolsRequest(refresh=refresh), timeout=10.0 if refresh else 3.0
+        )
+        if response is None:
+            return None
+        if response.error:
+            logger.error(f"获取工具列表时出错: {response.error}")
+            return None
+        return response.tools
+
+    async def _fetch_tools(self) -> Dict[str, Any]:
+        """从服务器获取最新工具列表，供工具列表缓存在后台刷新"""
+        if not self.process or not self.process.is_alive():
+            raise ConnectionError("MCP工作进程未运行")
+        tools = await self._request_tools(refresh=True)
+        if tools is None:
+            raise Exception("未能从MCP工作进程获取工具列表")
+        return tools
+
     async def update_available_tools(self) -> Dict[str, Any]:
         """
-        获取可用工具列表
+        获取可用工具列表，从共享的工具列表缓存读取，过期或服务器通知变化时在后台刷新
 
         Returns:
             可用工具的字典
         """
-        # 如果工具列表已经存在且进程仍在运行，直接返回
-        if self.available_tools and self.process and self.process.is_alive():
-            return self.available_tools
-
         # 如果进程未运行，返回空字典
         if not self.process or not self.process.is_alive():
             self.available_tools = {}
             return self.available_tools
 
         try:
-            # 清理任何现有的响应
-            self._clear_response_queue()
-
-            # 发送获取工具列表的请求
-            logger.debug(f"发送获取工具列表请求到进程 {self.process.pid}")
-            self.request_queue.put(MCPListToolsRequest())
-
-            # 等待响应，使用更短的超时时间
-            response = await self._wait_for_response(timeout=3.0)
-
-            # 如果有响应且包含工具列表
-            if response and response.tools:
-                logger.info(f"成功获取工具列表: {list(response.tools.keys())}")
-                self.available_tools = response.tools
-                return self.available_tools
-
-            # 如果没有获取到工具列表，但进程仍在运行，使用空字典
-            logger.warning("未能获取工具列表，使用空字典")
-            self.available_tools = {}
+            if self.tools_changed is not None and self.tools_changed.is_set():
+                self.tools_changed.clear()
+                tool_list_cache.invalidate(self.cache_key, self._fetch_tools)
+
+            tools = tool_list_cache.get(self.cache_key, self._fetch_tools)
+            if tools is None:
+                tools = tool_list_cache.put(self.cache_key, await self._fetch_tools())
+                logger.info(f"成功获取工具列表: {list(tools.keys())}")
+            self.available_tools = tools
             return self.available_tools
 
         except Exception as e:
             logger.error(f"更新可用工具列表时出错: {str(e)}")
-            self.available_tools = {}
-            return {}
+            return self.available_tools
 
-    def _clear_response_queue(self):
-        """清空响应队列"""
+    def _dispatch_responses(self) -> None:
+        """读取响应队列中的所有响应，按请求ID交给等待方，已无人等待的响应直接丢弃"""
         try:
             while not self.response_queue.empty():
                 try:
-                    self.response_queue.get_nowait()
+                    response = self.response_queue.get_nowait()
                 except queue.Empty:
                     break
+                request_id = getattr(response, "request_id", None)
+                if request_id is None:
+                    # 工作进程级别的错误，所有等待中的请求都以该错误结束
+                    self._worker_error = response.error or "MCP工作进程出错"
+                    for future in self._pending.values():
+                        if not future.done():
+                            future.set_result(response)
+                    continue
+                # 超时后才到达的响应（包括其中的共享内存结果）丢弃后随回收释放
+                future = self._pending.get(request_id)
+                if future is not None and not future.done():
+                    future.set_result(response)
         except Exception as e:
-            logger.error(f"清空响应队列时出错: {str(e)}")
+            logger.error(f"读取响应队列时出错: {str(e)}")
+
+    async def _request(
+        self, request: Any, timeout: float = 5.0
+    ) -> Optional[MCPToolResponse]:
+        """
+        发送请求并等待对应的响应，多个请求可以同时等待
+
+        Args:
+            request: 请求对象
+            timeout: 超时时间（秒）
+
+        Returns:
+            响应或None（如果超时或工作进程已终止）
+        """
+        request.request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request.request_id] = future
+        try:
+            self.request_queue.put(request)
+            return await self._wait_for_response(future, timeout)
+        finally:
+            self._pending.pop(request.request_id, None)
 
     async def _wait_for_response(
-        self, timeout: float = 5.0
+        self, future: asyncio.Future, timeout: float = 5.0
     ) -> Optional[MCPToolResponse]:
         """
         等待响应
 
         Args:
+            future: 该请求的响应
             timeout: 超时时间（秒）
 
         Returns:
             响应或None（如果超时或出错）
         """
         start_time = time.time()
+        # 轮询间隔从很短开始逐步加长，快速响应（如连接时获取工具列表）不必等满一个间隔；
+        # 其他等待方读到本请求的响应时会立即唤醒
+        delay = 0.005
 
         while time.time() - start_time < timeout:
+            if future.done():
+                return future.result()
+
             # 检查进程是否还活着
-            if not self.process.is_alive():
+            if self.process is None or not self.process.is_alive():
                 logger.error("MCP工作进程已终止")
                 return None
 
             # 检查是否有响应
-            if not self.response_queue.empty():
-                try:
-                    response = self.response_queue.get()
-
-                    # 检查是否有错误
-                    if response.error:
-                        logger.error(f"获取响应时出错: {response.error}")
-                        return None
-
-                    return response
-                except Exception as e:
-                    logger.error(f"获取响应时出错: {str(e)}")
-                    return None
+            self._dispatch_responses()
+            if future.done():
+                return future.result()
 
             # 短暂等待后继续检查
-            await asyncio.sleep(0.1)
+            await asyncio.wait({future}, timeout=delay)
+            delay = min(delay * 2, 0.1)
 
         # 超时处理
         logger.error(f"等待响应超时 ({timeout}秒)")
@@ -231,15 +325,16 @@ class MultiprocessMCPClientService:
             arguments: 工具参数
 
         Returns:
-            工具执行结果
+            工具执行结果，大结果为共享内存中的SharedToolResult，str()时才解码
 
         Raises:
-            ValueError: 当MCP会话未初始化或工具不可用时
-            Exception: 调用工具过程中的其他错误
+            ValueError: 当工具不可用时
+            ConnectionError: 工作进程未运行、MCP服务器连接出错或调用超时时
+            Exception: 工具本身返回的错误
         """
         # 验证工具调用的有效性
         if not self.process or not self.process.is_alive():
-            raise ValueError("MCP工作进程未运行")
+            raise ConnectionError("MCP工作进程未运行")
 
         if tool_name not in self.available_tools:
             raise ValueError(f"工具 '{tool_name}' 不可用")
@@ -254,20 +349,18 @@ class MultiprocessMCPClientService:
                 f"输入参数: {json.dumps(arguments, ensure_ascii=False, indent=2)}"
             )
 
-            # 清理任何现有的响应
-            self._clear_response_queue()
-
-            # 发送工具调用请求
-            self.request_queue.put(MCPToolRequest(tool_name=tool_name, arguments=arguments))
-
-            # 等待响应，使用较长的超时时间
-            response = await self._wait_for_response(timeout=60.0)
+            # 发送工具调用请求并等待响应，使用较长的超时时间
+            response = await self._request(
+                MCPToolRequest(tool_name=tool_name, arguments=arguments), timeout=60.0
+            )
 
             # 如果没有获取到响应或有错误
             if not response:
-                raise Exception("工具调用超时或未收到响应")
+                raise ConnectionError("工具调用超时或未收到响应")
 
             if response.error:
+                if response.transport_error:
+                    raise ConnectionError(f"工具调用出错: {response.error}")
                 raise Exception(f"工具调用出错: {response.error}")
 
             return response.result or ""
@@ -275,10 +368,30 @@ class MultiprocessMCPClientService:
         except ValueError as e:
             # 重新抛出ValueError
             raise e
+        except ConnectionError as e:
+            # 连接和超时错误保留类型，调用方（如监管器的熔断器）据此区分服务器故障和工具错误
+            logger.error(f"调用工具 '{tool_name}' 时出错: {str(e)}")
+            raise ConnectionError(f"调用工具 '{tool_name}' 时出错: {str(e)}")
         except Exception as e:
             logger.error(f"调用工具 '{tool_name}' 时出错: {str(e)}")
             raise Exception(f"调用工具 '{tool_name}' 时出错: {str(e)}")
 
+    async def ping(self) -> None:
+        """
+        检查工作进程及其MCP连接是否可用
+
+        Raises:
+            ConnectionError: 工作进程未运行或MCP服务器未响应时
+        """
+        if not self.process or not self.process.is_alive():
+            raise ConnectionError("MCP工作进程未运行")
+
+        response = await self._request(MCPPingRequest(), timeout=5.0)
+        if not response:
+            raise ConnectionError("MCP服务器未响应ping")
+        if response.error:
+            raise ConnectionError(response.error)
+
     async def disconnect(self) -> None:
         """关闭连接并清理资源"""
         try:
@@ -306,10 +419,19 @@ class MultiprocessMCPClientService:
                     self.process.terminate()
                     self.process.join(timeout=1.0)
 
-            # 清理队列和共享对象
+            # 结束仍在等待的请求
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_result(None)
+
+            # 清理队列和共享对象，未读取的响应中的共享内存结果随之释放
+            if self.response_queue:
+                self._dispatch_responses()
             self.request_queue = None
             self.response_queue = None
             self.shutdown_event = None
+            self.tools_changed = None
             self.process = None
 
             # 关闭manager
@@ -328,6 +450,7 @@ class MultiprocessMCPClientService:
             self.request_queue = None
             self.response_queue = None
             self.shutdown_event = None
+            self.tools_changed = None
             self.process = None
             self.manager = None
             self.available_tools = {} 
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""
+MCP网关，每台主机运行一个旁路进程，所有Web工作进程共享MCP会话、工具列表和工具结果
+"""
+
+from app.services.mcp.gateway.client import (
+    GatewayConnection,
+    GatewayError,
+    GatewayMCPClientService,
+    get_gateway_connection,
+)
+from app.services.mcp.gateway.protocol import GatewayOp
+from app.services.mcp.gateway.server import MCPGatewayServer
+
+__all__ = [
+    "GatewayConnection",
+    "GatewayError",
+    "GatewayMCPClientService",
+    "GatewayOp",
+    "MCPGatewayServer",
+    "get_gateway_connection",
+]
@@ -0,0 +1,41 @@
+"""
+MCP网关入口: python -m app.services.mcp.gateway
+"""
+
+import asyncio
+import signal
+
+from app.core.config import settings
+from app.services.mcp.gateway.server import MCPGatewayServer
+from app.utils.logger import setup_logger
+
+
+async def _run(server: MCPGatewayServer) -> None:
+    """运行网关，收到SIGTERM或SIGINT时关闭所有会话后退出"""
+    task = asyncio.create_task(server.serve_forever())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def main() -> None:
+    """按配置启动MCP网关"""
+    setup_logger()
+    server = MCPGatewayServer(
+        socket_path=settings.MCP_GATEWAY_SOCKET,
+        pool_size=settings.MCP_GATEWAY_POOL_SIZE,
+        max_concurrency=settings.MCP_GATEWAY_MAX_CONCURRENCY,
+        tools_ttl=settings.MCP_GATEWAY_TOOLS_TTL,
+        tools_max_stale=settings.MCP_TOOLS_CACHE_MAX_STALE,
+        result_cache_ttl=settings.MCP_GATEWAY_RESULT_CACHE_TTL,
+        result_cache_size=settings.MCP_GATEWAY_RESULT_CACHE_SIZE,
+    )
+    asyncio.run(_run(server))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+MCP网关客户端，Web工作进程通过一条共享的Unix域套接字连接访问网关，
+同一连接上的请求按ID多路复用
+"""
+
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from ..models import MCPTransportType
+from ..session import server_key
+from ..tool_list_cache import tool_list_cache
+from .protocol import GatewayOp, GatewayProtocolError, encode_frame, read_frame
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayError(Exception):
+    """网关返回的错误或网关不可用"""
+
+    def __init__(self, message: str, transport_error: bool = True):
+        """
+        Args:
+            message: 错误信息
+            transport_error: 是否为连接、传输或超时错误，网关不可用时总是True，
+                             网关转发的MCP服务器错误按网关的判断
+        """
+        super().__init__(message)
+        self.transport_error = transport_error
+
+
+class GatewayConnection:
+    """到MCP网关的单条多路复用连接，每个工作进程共享一个实例"""
+
+    def __init__(self, socket_path: str, request_timeout: float = 60.0):
+        """
+        初始化网关连接
+
+        Args:
+            socket_path: 网关Unix域套接字路径
+            request_timeout: 单个请求的超时时间（秒）
+        """
+        self.socket_path = socket_path
+        self.request_timeout = request_timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def connected(self) -> bool:
+        """连接是否可用"""
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _ensure_connected(self) -> None:
+        """按需建立连接，连接断开后自动重连"""
+        if self.connected:
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.connected:
+                return
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(
+                    self.socket_path
+                )
+            except OSError as e:
+                raise GatewayError(f"无法连接到MCP网关 {self.socket_path}: {str(e)}")
+            self._reader_task = asyncio.create_task(self._read_loop(self._reader))
+            logger.info(f"已连接到MCP网关: {self.socket_path}")
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        """读取响应并按请求ID分发"""
+        error = "MCP网关连接已关闭"
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except (asyncio.IncompleteReadError, ConnectionError, GatewayProtocolError) as e:
+            error = f"MCP网关连接异常: {str(e)}"
+            logger.warning(error)
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(GatewayError(error))
+
+    async def request(self, op: str, **params: Any) -> Dict[str, Any]:
+        """
+        发送请求并等待响应
+
+        Args:
+            op: 操作类型
+            **params: 请求参数
+
+        Returns:
+            响应字典
+
+        Raises:
+            GatewayError: 网关不可用、请求超时或网关返回错误时
+        """
+        await self._ensure_connected()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(encode_frame({"id": request_id, "op": op, **params}))
+            await self._writer.drain()
+            response = await asyncio.wait_for(future, timeout=self.request_timeout)
+        except asyncio.TimeoutError:
+            raise GatewayError(f"MCP网关请求超时 ({self.request_timeout}秒)")
+        except (ConnectionError, AttributeError) as e:
+            raise GatewayError(f"MCP网关连接异常: {str(e)}")
+        finally:
+            self._pending.pop(request_id, None)
+
+        if not response.get("ok"):
+            raise GatewayError(
+                response.get("error") or "MCP网关返回未知错误",
+                transport_error=bool(response.get("transport_error")),
+            )
+        return response
+
+    async def close(self) -> None:
+        """关闭连接"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+_connection: Optional[GatewayConnection] = None
+
+
+def get_gateway_connection() -> GatewayConnection:
+    """
+    获取当前进程共享的网关连接
+
+    Returns:
+        网关连接实例
+    """
+    global _connection
+    if _connection is None:
+        _connection = GatewayConnection(
+            settings.MCP_GATEWAY_SOCKET, settings.MCP_GATEWAY_REQUEST_TIMEOUT
+        )
+    return _connection
+
+
+class GatewayMCPClientService:
+    """通过MCP网关访问MCP服务器的客户端服务，接口与MultiprocessMCPClientService一致"""
+
+    def __init__(
+        self,
+        url: str,
+        transport_type: str = MCPTransportType.SSE,
+        env: Optional[Dict[str, str]] = None,
+        connection: Optional[GatewayConnection] = None,
+    ):
+        """
+        初始化网关MCP客户端服务
+
+        Args:
+            url: MCP服务器URL
+            transport_type: 传输类型，可以是"sse"或"streamable_http"
+            env: 环境变量，如API密钥等
+            connection: 网关连接，默认使用进程共享的连接
+        """
+        self.url = url
+        self.transport_type = transport_type
+        self.env = env or {}
+        self.available_tools = {}
+        self.connection = connection or get_gateway_connection()
+        self.cache_key = server_key(url, transport_type, self.env)
+
+    @property
+    def _server(self) -> Dict[str, Any]:
+        """请求中携带的服务器配置"""
+        return {"url": self.url, "transport": self.transport_type, "env": self.env}
+
+    async def _fetch_tools(self) -> Dict[str, Any]:
+        """通过网关获取工具列表（网关按TTL缓存，所有工作进程共享），供工具列表缓存刷新"""
+        response = await self.connection.request(GatewayOp.LIST_TOOLS, server=self._server)
+        return response.get("tools") or {}
+
+    async def connect(self) -> bool:
+        """
+        通过网关连接到MCP服务器并获取工具列表，工具列表已缓存时不访问网关，
+        网关中的会话在首次调用工具时建立
+
+        Returns:
+            连接是否成功
+        """
+        tools = tool_list_cache.get(self.cache_key, self._fetch_tools)
+        if tools is None:
+            try:
+                tools = tool_list_cache.put(self.cache_key, await self._fetch_tools())
+            except GatewayError as e:
+                logger.error(f"通过MCP网关连接 {self.url} 失败: {str(e)}")
+                return False
+        self.available_tools = tools
+        logger.info(
+            f"通过MCP网关连接成功，可用工具: {list(self.available_tools.keys())}"
+        )
+        return bool(self.available_tools)
+
+    async def update_available_tools(self) -> Dict[str, Any]:
+        """
+        获取可用工具列表，从共享的工具列表缓存读取，过期时在后台刷新
+
+        Returns:
+            可用工具的字典
+        """
+        tools = tool_list_cache.get(self.cache_key, self._fetch_tools)
+        if tools is None:
+            try:
+                tools = tool_list_cache.put(self.cache_key, await self._fetch_tools())
+            except GatewayError as e:
+                logger.error(f"更新可用工具列表时出错: {str(e)}")
+                return self.available_tools
+        self.available_tools = tools
+        return self.available_tools
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        调用MCP工具
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+
+        Returns:
+            工具执行结果
+
+        Raises:
+            ValueError: 当工具不可用时
+            ConnectionError: 网关或MCP服务器连接出错、调用超时时
+            Exception: 工具本身返回的错误
+        """
+        if tool_name not in self.available_tools:
+            raise ValueError(f"工具 '{tool_name}' 不可用")
+
+        logger.info(f"正在通过MCP网关调用工具: {tool_name}")
+        try:
+            response = await self.connection.request(
+                GatewayOp.CALL_TOOL,
+                server=self._server,
+                tool=tool_name,
+                arguments=arguments,
+            )
+        except GatewayError as e:
+            logger.error(f"调用工具 '{tool_name}' 时出错: {str(e)}")
+            # 连接错误保留类型，调用方（如监管器的熔断器）据此区分服务器故障和工具错误
+            error_class = ConnectionError if e.transport_error else Exception
+            raise error_class(f"调用工具 '{tool_name}' 时出错: {str(e)}")
+        return response.get("result") or ""
+
+    async def ping(self) -> None:
+        """
+        通过网关向MCP服务器发送ping
+
+        Raises:
+            GatewayError: 网关不可用或MCP服务器ping失败时
+        """
+        await self.connection.request(GatewayOp.PING, server=self._server)
+
+    async def disconnect(self) -> None:
+        """断开连接，网关中的会话由网关统一管理，这里只清空本地状态"""
+        self.available_tools = {}
@@ -0,0 +1,73 @@
+"""
+MCP网关帧协议
+
+每个帧由4字节大端无符号长度前缀和紧凑JSON消息体组成。
+请求: {"id": 请求ID, "op": 操作, ...参数}
+响应: {"id": 请求ID, "ok": 是否成功, ...结果, "error": 错误信息, "transport_error": 是否为连接错误}
+"""
+
+import asyncio
+import struct
+from typing import Any, Dict, Optional
+
+from app.utils.json_utils import dumps_bytes, loads
+
+# 长度前缀格式
+_HEADER = struct.Struct(">I")
+
+# 单帧最大字节数，防止异常数据导致内存耗尽
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class GatewayOp:
+    """网关操作类型常量"""
+
+    PING = "ping"
+    LIST_TOOLS = "list_tools"
+    CALL_TOOL = "call_tool"
+    STATS = "stats"
+
+
+class GatewayProtocolError(Exception):
+    """网关帧格式错误"""
+
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """
+    编码一个帧
+
+    Args:
+        message: 消息字典
+
+    Returns:
+        带长度前缀的帧字节串
+    """
+    body = dumps_bytes(message)
+    return _HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """
+    读取一个帧
+
+    Args:
+        reader: 流读取器
+
+    Returns:
+        消息字典，连接在帧边界处关闭时返回None
+
+    Raises:
+        GatewayProtocolError: 帧长度超出限制时
+        asyncio.IncompleteReadError: 连接在帧中途关闭时
+    """
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise GatewayProtocolError(f"帧长度 {length} 超出限制")
+    return loads(await reader.readexactly(length))
+
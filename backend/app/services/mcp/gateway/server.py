@@ -0,0 +1,380 @@
+"""
+MCP网关服务端，作为每台主机一个的旁路进程运行，所有Web工作进程通过Unix域套接字访问，
+按MCP服务器配置共享会话池，跨工作进程缓存工具列表和工具结果，并限制每个服务器的并发
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.json_utils import dumps_canonical
+from ..session import MCPSession, is_transport_error, server_key
+from ..tool_list_cache import ToolListCache
+from .protocol import GatewayOp, GatewayProtocolError, encode_frame, read_frame
+
+logger = logging.getLogger(__name__)
+
+
+class _SessionPool:
+    """单个MCP服务器配置的会话池"""
+
+    def __init__(
+        self,
+        url: str,
+        transport_type: str,
+        env: Dict[str, str],
+        pool_size: int,
+        max_concurrency: int,
+        tool_lists: ToolListCache,
+        key: str,
+    ):
+        self.url = url
+        self.transport_type = transport_type
+        self.env = env
+        self.pool_size = pool_size
+        self.tool_lists = tool_lists
+        self.key = key
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.last_used = time.monotonic()
+        self.calls = 0
+        self.errors = 0
+        self._sessions: List[MCPSession] = []
+        self._in_flight: Dict[int, int] = {}
+        self._connect_lock = asyncio.Lock()
+
+    async def _acquire_session(self) -> MCPSession:
+        """选择进行中请求最少的会话，会话数未达上限且都在忙时新建会话"""
+        for session in [s for s in self._sessions if not s.connected]:
+            await self._discard(session)
+        idle = [s for s in self._sessions if self._in_flight.get(id(s), 0) == 0]
+        if idle or len(self._sessions) >= self.pool_size:
+            candidates = idle or self._sessions
+            return min(candidates, key=lambda s: self._in_flight.get(id(s), 0))
+
+        async with self._connect_lock:
+            if len(self._sessions) < self.pool_size:
+                session = MCPSession(
+                    self.url,
+                    self.env,
+                    self.transport_type,
+                    on_tools_changed=self._on_tools_changed,
+                )
+                # 工具列表由网关的工具列表缓存管理，新会话连接时不重复获取
+                await session.connect(tools=self.tool_lists.get(self.key))
+                self._sessions.append(session)
+                return session
+        return min(self._sessions, key=lambda s: self._in_flight.get(id(s), 0))
+
+    async def _discard(self, session: MCPSession) -> None:
+        """丢弃出错的会话，下次请求时重新连接"""
+        if session in self._sessions:
+            self._sessions.remove(session)
+        self._in_flight.pop(id(session), None)
+        await session.close()
+
+    async def _fetch_tools(self) -> Dict[str, Dict[str, Any]]:
+        """从MCP服务器获取工具列表"""
+        async with self.semaphore:
+            session = await self._acquire_session()
+            try:
+                return await session.list_tools(refresh=True)
+            except Exception:
+                self.errors += 1
+                await self._discard(session)
+                raise
+
+    def _on_tools_changed(self) -> None:
+        """服务器通知工具列表已变化，作废缓存并在后台刷新"""
+        self.tool_lists.invalidate(self.key, self._fetch_tools)
+
+    async def list_tools(self, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """获取工具列表，有缓存时直接返回，过期时在后台刷新"""
+        self.last_used = time.monotonic()
+        if not refresh:
+            tools = self.tool_lists.get(self.key, self._fetch_tools)
+            if tools is not None:
+                return tools
+        return self.tool_lists.put(self.key, await self._fetch_tools())
+
+    async def ping(self) -> None:
+        """向MCP服务器发送ping，失败的会话被丢弃"""
+        self.last_used = time.monotonic()
+        async with self.semaphore:
+            session = await self._acquire_session()
+            try:
+                await session.ping()
+            except Exception:
+                self.errors += 1
+                await self._discard(session)
+                raise
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """在并发限制内调用工具"""
+        self.last_used = time.monotonic()
+        async with self.semaphore:
+            session = await self._acquire_session()
+            key = id(session)
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            self.calls += 1
+            try:
+                return await session.call_tool(tool_name, arguments)
+            except ValueError:
+                # 工具不存在等调用方错误，会话本身仍可用
+                if not session.connected:
+                    await self._discard(session)
+                raise
+            except Exception:
+                self.errors += 1
+                await self._discard(session)
+                raise
+            finally:
+                if key in self._in_flight:
+                    self._in_flight[key] -= 1
+
+    async def close(self) -> None:
+        """关闭池中所有会话"""
+        sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            await session.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        """会话池指标，只以服务器配置标识的前缀区分，不包含URL（可能是用户的私有服务器）和环境变量（可能含有密钥）"""
+        return {
+            "server": self.key[:12],
+            "transport": self.transport_type,
+            "sessions": len(self._sessions),
+            "in_flight": sum(self._in_flight.values()),
+            "calls": self.calls,
+            "errors": self.errors,
+        }
+
+
+class MCPGatewayServer:
+    """MCP网关服务端"""
+
+    def __init__(
+        self,
+        socket_path: str,
+        pool_size: int = 2,
+        max_concurrency: int = 16,
+        tools_ttl: float = 300.0,
+        tools_max_stale: float = 3600.0,
+        result_cache_ttl: float = 0.0,
+        result_cache_size: int = 1024,
+        idle_timeout: float = 600.0,
+    ):
+        """
+        初始化MCP网关服务端
+
+        Args:
+            socket_path: Unix域套接字路径
+            pool_size: 每个MCP服务器最多保持的会话数
+            max_concurrency: 每个MCP服务器的最大并发请求数
+            tools_ttl: 工具列表缓存时间（秒），过期后先返回旧列表并在后台刷新
+            tools_max_stale: 过期的工具列表最多继续使用的时间（秒）
+            result_cache_ttl: 工具结果缓存时间（秒），0表示不缓存
+            result_cache_size: 最多缓存的工具结果数
+            idle_timeout: 会话池空闲超过该时间（秒）后关闭
+        """
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.tool_lists = ToolListCache(ttl=tools_ttl, max_stale=tools_max_stale)
+        self.result_cache_ttl = result_cache_ttl
+        self.result_cache_size = result_cache_size
+        self.idle_timeout = idle_timeout
+        self._pools: Dict[str, _SessionPool] = {}
+        self._results: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight_results: Dict[str, asyncio.Future] = {}
+        self._result_hits = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._connections = 0
+
+    def _get_pool(self, message: Dict[str, Any]) -> _SessionPool:
+        """根据请求中的服务器配置获取或创建会话池"""
+        server = message.get("server") or {}
+        url = server.get("url")
+        if not url:
+            raise ValueError("请求中未指定MCP服务器URL")
+        transport_type = server.get("transport")
+        env = server.get("env") or {}
+        key = server_key(url, transport_type, env)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = _SessionPool(
+                url,
+                transport_type,
+                env,
+                self.pool_size,
+                self.max_concurrency,
+                self.tool_lists,
+                key,
+            )
+            self._pools[key] = pool
+        return pool
+
+    async def _call_tool(self, message: Dict[str, Any]) -> str:
+        """调用工具，启用结果缓存时相同服务器、工具和参数的调用在TTL内共享结果"""
+        pool = self._get_pool(message)
+        tool_name = message["tool"]
+        arguments = message.get("arguments") or {}
+        if self.result_cache_ttl <= 0:
+            return await pool.call_tool(tool_name, arguments)
+
+        cache_key = hashlib.sha256(
+            dumps_canonical([pool.url, pool.transport_type, pool.env, tool_name, arguments])
+        ).hexdigest()
+        cached = self._results.get(cache_key)
+        if cached is not None and cached[0] > time.monotonic():
+            self._results.move_to_end(cache_key)
+            self._result_hits += 1
+            return cached[1]
+
+        # 相同的调用正在进行时等待其结果，不重复调用MCP服务器
+        inflight = self._inflight_results.get(cache_key)
+        if inflight is not None:
+            self._result_hits += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_results[cache_key] = future
+        try:
+            result = await pool.call_tool(tool_name, arguments)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免未获取异常的警告
+            future.exception()
+            raise
+        finally:
+            self._inflight_results.pop(cache_key, None)
+            if not future.done():
+                future.cancel()
+
+        self._results[cache_key] = (time.monotonic() + self.result_cache_ttl, result)
+        self._results.move_to_end(cache_key)
+        while len(self._results) > self.result_cache_size:
+            self._results.popitem(last=False)
+        return result
+
+    async def _dispatch(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """处理一个请求并生成响应"""
+        op = message.get("op")
+        if op == GatewayOp.PING:
+            # 携带服务器配置时检查该MCP服务器，否则只检查网关本身
+            if message.get("server"):
+                await self._get_pool(message).ping()
+            return {"ok": True}
+        if op == GatewayOp.LIST_TOOLS:
+            tools = await self._get_pool(message).list_tools(bool(message.get("refresh")))
+            return {"ok": True, "tools": tools}
+        if op == GatewayOp.CALL_TOOL:
+            return {"ok": True, "result": await self._call_tool(message)}
+        if op == GatewayOp.STATS:
+            return {"ok": True, "stats": self.metrics()}
+        raise ValueError(f"不支持的操作: {op}")
+
+    async def _handle_request(
+        self, message: Dict[str, Any], writer: asyncio.StreamWriter
+    ) -> None:
+        """处理单个请求，同一连接上的请求并发执行，响应按完成顺序写回"""
+        try:
+            response = await self._dispatch(message)
+        except Exception as e:
+            response = {"ok": False, "error": str(e), "transport_error": is_transport_error(e)}
+        response["id"] = message.get("id")
+        try:
+            writer.write(encode_frame(response))
+            await writer.drain()
+        except (ConnectionError, RuntimeError) as e:
+            logger.debug(f"写回网关响应失败: {str(e)}")
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """处理一个Web工作进程的连接"""
+        self._connections += 1
+        tasks = set()
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                task = asyncio.create_task(self._handle_request(message, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, GatewayProtocolError) as e:
+            logger.warning(f"网关连接异常关闭: {str(e)}")
+        finally:
+            self._connections -= 1
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _reap_idle_pools(self) -> None:
+        """定期关闭空闲的会话池"""
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1.0))
+            now = time.monotonic()
+            for key, pool in list(self._pools.items()):
+                if now - pool.last_used > self.idle_timeout and not any(pool._in_flight.values()):
+                    del self._pools[key]
+                    logger.info(f"关闭空闲的MCP会话池: {pool.url}")
+                    await pool.close()
+
+    async def start(self) -> None:
+        """开始监听Unix域套接字"""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(
+            self._handle_connection, path=self.socket_path
+        )
+        # 只允许同一用户的进程访问
+        os.chmod(self.socket_path, 0o600)
+        self._reaper = asyncio.create_task(self._reap_idle_pools())
+        logger.info(f"MCP网关已启动，监听 {self.socket_path}")
+
+    async def serve_forever(self) -> None:
+        """启动并持续运行，直到被取消"""
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        """停止服务并关闭所有会话"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            await pool.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        logger.info("MCP网关已关闭")
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取网关指标
+
+        Returns:
+            包含连接数、各会话池状态、工具列表缓存和结果缓存情况的指标字典
+        """
+        return {
+            "connections": self._connections,
+            "pools": [pool.metrics() for pool in self._pools.values()],
+            "tool_lists": self.tool_lists.metrics(),
+            "result_cache": {
+                "entries": len(self._results),
+                "hits": self._result_hits,
+            },
+        }
@@ -0,0 +1,235 @@
+"""
+进程内MCP客户端服务模块，直接在Web工作进程的事件循环中运行MCP会话，
+省去工作进程的启动开销和每次请求、响应的序列化，适合可信、稳定的服务器和本机stdio服务器
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Any, Optional
+
+from .models import MCPTransportType
+from .session import MCPSession, is_transport_error, server_key
+from .tool_list_cache import tool_list_cache
+
+logger = logging.getLogger(__name__)
+
+# 会话断开后重启的最大等待时间（秒），会话在启动后该时间内再次断开时按指数退避
+RESTART_MAX_DELAY = 30.0
+
+
+class InProcessMCPClientService:
+    """进程内MCP客户端服务，接口与MultiprocessMCPClientService一致"""
+
+    def __init__(
+        self,
+        url: str,
+        transport_type: str = MCPTransportType.SSE,
+        env: Optional[Dict[str, str]] = None,
+        connect_timeout: float = 15.0,
+        call_timeout: float = 60.0,
+    ):
+        """
+        初始化进程内MCP客户端服务
+
+        Args:
+            url: MCP服务器URL，stdio传输时为子进程命令行
+            transport_type: 传输类型，可以是"sse"、"streamable_http"或"stdio"
+            env: 环境变量，如API密钥等
+            connect_timeout: 连接超时时间（秒）
+            call_timeout: 工具调用超时时间（秒）
+        """
+        self.url = url
+        self.transport_type = transport_type
+        self.env = env or {}
+        self.connect_timeout = connect_timeout
+        self.call_timeout = call_timeout
+        self.available_tools = {}
+        self.session: Optional[MCPSession] = None
+        self.cache_key = server_key(url, transport_type, self.env)
+        self.restarts = 0
+        self._ready = asyncio.Event()
+        self._watcher: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def _open_session(self) -> bool:
+        """建立新会话，工具列表优先使用缓存，没有缓存时从服务器获取"""
+        if self.session is not None:
+            await self.session.close()
+
+        session = MCPSession(
+            self.url, self.env, self.transport_type, on_tools_changed=self._on_tools_changed
+        )
+        cached = tool_list_cache.get(self.cache_key)
+        try:
+            await asyncio.wait_for(session.connect(tools=cached), timeout=self.connect_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"连接MCP服务器超时: {self.url}")
+            await session.close()
+            return False
+        except Exception as e:
+            logger.error(f"连接MCP服务器 {self.url} 时出错: {str(e)}")
+            await session.close()
+            return False
+
+        self.session = session
+        self._ready.set()
+        if cached is None:
+            self.available_tools = tool_list_cache.put(self.cache_key, session.available_tools)
+        else:
+            self.available_tools = cached
+            tool_list_cache.refresh_if_stale(self.cache_key, self._fetch_tools)
+        return True
+
+    async def _fetch_tools(self) -> Dict[str, Any]:
+        """从服务器获取最新工具列表，供工具列表缓存在后台刷新"""
+        session = await self._wait_ready()
+        return await session.list_tools(refresh=True)
+
+    def _on_tools_changed(self) -> None:
+        """服务器通知工具列表已变化，作废缓存并在后台刷新"""
+        tool_list_cache.invalidate(self.cache_key, self._fetch_tools)
+
+    async def _watch(self) -> None:
+        """
+        监视会话，会话断开（如stdio子进程崩溃）时自动重启，使服务器保持可用
+
+        会话在启动后不久再次断开时按指数退避，避免反复崩溃的服务器占满CPU
+        """
+        delay = 0.0
+        while not self._closing:
+            started = time.monotonic()
+            await self.session.wait_closed()
+            if self._closing:
+                return
+
+            self._ready.clear()
+            self.restarts += 1
+            if time.monotonic() - started > RESTART_MAX_DELAY:
+                delay = 0.0
+            logger.warning(f"MCP会话已断开，{delay:.0f}秒后重启: {self.url}")
+
+            while not self._closing:
+                if delay:
+                    await asyncio.sleep(delay)
+                delay = min(max(delay * 2, 1.0), RESTART_MAX_DELAY)
+                if self._closing:
+                    return
+                if await self._open_session():
+                    logger.info(f"MCP会话已重启: {self.url}")
+                    break
+
+    async def connect(self) -> bool:
+        """
+        连接到MCP服务器，并在会话断开时自动重启
+
+        Returns:
+            连接是否成功
+        """
+        if self.session is not None or self._watcher is not None:
+            await self.disconnect()
+
+        self._closing = False
+        if not await self._open_session():
+            return False
+
+        self._watcher = asyncio.create_task(self._watch())
+        logger.info(f"进程内MCP会话连接成功，可用工具: {list(self.available_tools.keys())}")
+        return True
+
+    async def update_available_tools(self) -> Dict[str, Any]:
+        """
+        获取可用工具列表，从共享的工具列表缓存读取，过期时在后台刷新，不等待服务器；
+        会话重启期间返回上次获取的列表
+
+        Returns:
+            可用工具的字典
+        """
+        if self.session is None or not self.session.connected:
+            return self.available_tools
+
+        tools = tool_list_cache.get(self.cache_key, self._fetch_tools)
+        if tools is None:
+            try:
+                tools = tool_list_cache.put(self.cache_key, await self._fetch_tools())
+            except Exception as e:
+                logger.error(f"更新可用工具列表时出错: {str(e)}")
+                return self.available_tools
+        self.available_tools = tools
+        return self.available_tools
+
+    async def _wait_ready(self) -> MCPSession:
+        """获取可用的会话，会话正在重启时等待重启完成"""
+        if self.session is not None and self.session.connected:
+            return self.session
+        if self._watcher is None or self._watcher.done():
+            raise ValueError("MCP会话未连接")
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=self.connect_timeout)
+        except asyncio.TimeoutError:
+            raise ValueError("MCP会话正在重启，暂不可用")
+        return self.session
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        调用MCP工具，多个调用可在不同任务中并发进行，取消调用方任务即取消调用
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+
+        Returns:
+            工具执行结果
+
+        Raises:
+            ValueError: 当MCP会话未连接或工具不可用时
+            TimeoutError: 调用超时时
+            ConnectionError: MCP服务器连接出错时
+            Exception: 工具本身返回的错误
+        """
+        if tool_name not in self.available_tools:
+            raise ValueError(f"工具 '{tool_name}' 不可用")
+
+        session = await self._wait_ready()
+
+        logger.info(f"正在调用MCP工具: {tool_name}")
+        logger.debug(f"输入参数: {json.dumps(arguments, ensure_ascii=False)}")
+
+        try:
+            return await asyncio.wait_for(
+                session.call_tool(tool_name, arguments), timeout=self.call_timeout
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"调用工具 '{tool_name}' 超时 ({self.call_timeout}秒)")
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error(f"调用工具 '{tool_name}' 时出错: {str(e)}")
+            # 连接错误保留类型，调用方（如监管器的熔断器）据此区分服务器故障和工具错误
+            error_class = ConnectionError if is_transport_error(e) else Exception
+            raise error_class(f"调用工具 '{tool_name}' 时出错: {str(e)}")
+
+    async def ping(self) -> None:
+        """
+        向MCP服务器发送ping，会话正在重启时等待重启完成
+
+        Raises:
+            ValueError: 会话未连接时
+            Exception: ping失败时
+        """
+        session = await self._wait_ready()
+        await session.ping()
+
+    async def disconnect(self) -> None:
+        """停止自动重启，关闭会话并清理资源"""
+        self._closing = True
+        watcher, self._watcher = self._watcher, None
+        if watcher is not None:
+            watcher.cancel()
+        session, self.session = self.session, None
+        self.available_tools = {}
+        self._ready.clear()
+        if session is not None:
+            await session.close()
+            logger.info(f"进程内MCP会话已关闭: {self.url}")
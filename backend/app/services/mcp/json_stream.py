@@ -0,0 +1,62 @@
+"""
+增量JSON完整性检测模块，在流式接收工具调用参数时判断JSON何时闭合
+"""
+
+
+class IncrementalJSONDetector:
+    """
+    增量JSON完整性检测器
+
+    逐段接收JSON文本，只跟踪括号深度、字符串和转义状态，每个字符只处理一次。
+    顶层对象或数组闭合时即认为完整，不做完整的语法校验（最终仍由json.loads解析）
+    """
+
+    __slots__ = ("_depth", "_in_string", "_escape", "_started", "complete")
+
+    def __init__(self):
+        """初始化检测器"""
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.complete = False
+
+    def feed(self, fragment: str) -> bool:
+        """
+        接收一段JSON文本
+
+        Args:
+            fragment: 新到达的文本片段
+
+        Returns:
+            顶层JSON值是否已经闭合
+        """
+        if self.complete:
+            return True
+
+        depth = self._depth
+        in_string = self._in_string
+        escape = self._escape
+        for ch in fragment:
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{" or ch == "[":
+                depth += 1
+                self._started = True
+            elif ch == "}" or ch == "]":
+                depth -= 1
+                if self._started and depth == 0:
+                    self.complete = True
+                    break
+
+        self._depth = depth
+        self._in_string = in_string
+        self._escape = escape
+        return self.complete
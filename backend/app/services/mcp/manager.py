@@ -8,6 +8,7 @@ from typing import Dict, Any, Optional, List
 from app.core.config import settings
 from app.services.mcp import MCPServiceManager
 from app.services.mcp.models import MCPTransportType
+from app.services.mcp.session import resolve_server_url
 from app.schemas.chat import UserMCPConfig
 
 logger = logging.getLogger(__name__)
@@ -30,20 +31,28 @@ class MCPManager:
         """
         configs = {}
         for server_name, server_config in settings.MCP_SERVERS.items():
+            transport_type = server_config.get("transport_type", MCPTransportType.SSE)
             configs[server_name] = {
-                "url": server_config.get("url"),
+                "url": resolve_server_url(server_config, transport_type),
                 "env": server_config.get("env", {}),
-                "transportType": server_config.get("transport_type", MCPTransportType.SSE)
+                "transportType": transport_type,
+                "mode": server_config.get("mode"),
+                "urls": server_config.get("urls"),
+                "idempotent_tools": server_config.get("idempotent_tools"),
+                "supervised": True,
             }
         
         return await self.mcp_service.initialize_from_configs(configs)
 
-    async def initialize_user_client(self, config: UserMCPConfig) -> Any:
+    async def initialize_user_client(
+        self, config: UserMCPConfig, user_id: Optional[int] = None
+    ) -> Any:
         """
-        初始化用户自定义MCP客户端
+        初始化用户自定义MCP客户端，客户端从用户MCP客户端池取得，相同配置的请求复用已连接的客户端
 
         Args:
             config: 用户自定义MCP配置（字典，键为服务器名称，值为服务器配置）
+            user_id: 用户ID，用于限制每个用户在池中持有的客户端数
 
         Returns:
             初始化后的MCP客户端
@@ -71,18 +80,22 @@ class MCPManager:
             else:
                 env = {}
             
-            # 获取传输类型
+            # 获取传输类型，stdio会在服务器上执行命令，只允许在服务端配置中使用
             transport_type = server_config.get("transportType", MCPTransportType.SSE)
+            if transport_type == MCPTransportType.STDIO:
+                logger.warning(f"用户MCP配置不允许使用stdio传输，已跳过服务器 {server_name}")
+                continue
             
             # 添加到配置字典
             configs[server_name] = {
                 "url": server_config.get("url"),
                 "env": env,
-                "transportType": transport_type
+                "transportType": transport_type,
+                "pooled": True,
             }
         
         # 初始化客户端
-        initialized_clients = await self.mcp_service.initialize_from_configs(configs)
+        initialized_clients = await self.mcp_service.initialize_from_configs(configs, user_id)
         
         # 返回第一个初始化成功的客户端（如果有）
         if initialized_clients:
@@ -105,15 +118,23 @@ class MCPManager:
             raise ValueError(f"未找到服务器名称: {server_name}")
             
         server_config = settings.MCP_SERVERS[server_name]
+        transport_type = server_config.get("transport_type", MCPTransportType.SSE)
         return await self.mcp_service.initialize_mcp_client(
             server_name=server_name,
-            url=server_config.get("url"),
-            transport_type=server_config.get("transport_type", MCPTransportType.SSE),
-            env=server_config.get("env", {})
+            url=resolve_server_url(server_config, transport_type),
+            transport_type=transport_type,
+            env=server_config.get("env", {}),
+            mode=server_config.get("mode"),
+            replica_urls=server_config.get("urls"),
+            idempotent_tools=server_config.get("idempotent_tools"),
+            supervised=True
         )
 
     async def get_active_client(
-        self, server_name: str = None, user_mcp_config: Optional[UserMCPConfig] = None
+        self,
+        server_name: str = None,
+        user_mcp_config: Optional[UserMCPConfig] = None,
+        user_id: Optional[int] = None,
     ) -> Any:
         """
         获取活动的MCP客户端，根据优先级：
@@ -124,6 +145,7 @@ class MCPManager:
         Args:
             server_name: 服务器名称
             user_mcp_config: 用户自定义MCP配置
+            user_id: 用户ID
 
         Returns:
             活动的MCP客户端
@@ -131,7 +153,7 @@ class MCPManager:
         # 优先使用用户自定义配置
         if user_mcp_config:
             try:
-                return await self.initialize_user_client(user_mcp_config)
+                return await self.initialize_user_client(user_mcp_config, user_id)
             except Exception as e:
                 logger.error(f"初始化用户自定义MCP客户端失败: {str(e)}")
                 # 如果用户配置初始化失败，继续尝试其他方法
@@ -148,11 +170,16 @@ class MCPManager:
         if settings.MCP_SERVERS:
             default_server = next(iter(settings.MCP_SERVERS.keys()))
             server_config = settings.MCP_SERVERS[default_server]
+            transport_type = server_config.get("transport_type", MCPTransportType.SSE)
             return await self.mcp_service.initialize_mcp_client(
                 server_name=default_server,
-                url=server_config.get("url"),
-                transport_type=server_config.get("transport_type", MCPTransportType.SSE),
-                env=server_config.get("env", {})
+                url=resolve_server_url(server_config, transport_type),
+                transport_type=transport_type,
+                env=server_config.get("env", {}),
+                mode=server_config.get("mode"),
+                replica_urls=server_config.get("urls"),
+                idempotent_tools=server_config.get("idempotent_tools"),
+                supervised=True
             )
         else:
             raise ValueError("没有可用的MCP服务器")
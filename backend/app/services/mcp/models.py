@@ -2,7 +2,9 @@
 MCP工具调用的请求和响应数据模型
 """
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union
+
+from .shared_result import SharedToolResult
 
 
 class MCPToolRequest:
@@ -12,13 +14,41 @@ class MCPToolRequest:
         self.tool_name = tool_name
         self.arguments = arguments
         self.is_list_tools_request = False  # 标记是否为获取工具列表的请求
+        self.request_id: Optional[int] = None  # 请求ID，响应带回同一ID，多个请求可以同时进行
 
 
 class MCPListToolsRequest:
     """MCP获取工具列表请求"""
 
-    def __init__(self):
+    def __init__(self, refresh: bool = False):
         self.is_list_tools_request = True
+        self.refresh = refresh  # 是否重新从MCP服务器获取，否则返回连接时获取（或传入）的列表
+        self.request_id: Optional[int] = None
+
+
+class MCPAssignRequest:
+    """将预热的空闲工作进程分配给MCP服务器"""
+
+    def __init__(
+        self,
+        url: str,
+        env: Dict[str, str],
+        transport_type: str,
+        tools: Optional[Dict[str, Any]] = None,
+    ):
+        self.url = url
+        self.env = env
+        self.transport_type = transport_type
+        self.tools = tools  # 主进程缓存的工具列表
+
+
+class MCPPingRequest:
+    """MCP健康检查请求"""
+
+    def __init__(self):
+        self.is_list_tools_request = False
+        self.is_ping_request = True
+        self.request_id: Optional[int] = None
 
 
 class MCPToolResponse:
@@ -26,16 +56,27 @@ class MCPToolResponse:
 
     def __init__(
         self, 
-        result: Optional[str] = None, 
+        result: Optional[Union[str, SharedToolResult]] = None, 
         error: Optional[str] = None, 
-        tools: Optional[Dict[str, Any]] = None
+        tools: Optional[Dict[str, Any]] = None,
+        request_id: Optional[int] = None,
+        transport_error: bool = False,
     ):
-        self.result = result
+        self.result = result  # 超过阈值的大结果为共享内存中的SharedToolResult
         self.error = error
         self.tools = tools  # 工具列表
+        self.request_id = request_id  # 对应请求的ID，为None表示工作进程级别的错误（如连接失败）
+        self.transport_error = transport_error  # 错误是否为连接、传输或超时错误（而非工具本身的错误）
 
 
 class MCPTransportType:
     """MCP传输类型常量"""
     SSE = "sse"
-    STREAMABLE_HTTP = "streamable-http" 
\ No newline at end of file
+    STREAMABLE_HTTP = "streamable-http"
+    STDIO = "stdio"  # 以子进程启动本机MCP服务器，通过标准输入输出通信
+
+
+class MCPClientMode:
+    """MCP客户端运行模式常量"""
+    PROCESS = "process"  # 每个服务器一个专用工作进程，隔离性最好
+    INPROCESS = "inprocess"  # 直接在Web工作进程的事件循环中运行会话，适合可信的服务器
@@ -0,0 +1,384 @@
+"""
+MCP副本集模块，一个逻辑MCP服务器可以配置多个副本URL，按延迟加权的最少进行中请求选择副本，
+连续失败的副本被暂时摘除，标记为幂等的工具在响应过慢时向另一个副本发起对冲调用
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Sequence
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaHealth:
+    """单个MCP副本的健康状态，在当前工作进程内跨请求共享"""
+
+    def __init__(self, url: str):
+        """
+        初始化副本健康状态
+
+        Args:
+            url: 副本URL
+        """
+        self.url = url
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.ewma_latency: Optional[float] = None
+        self.calls = 0
+        self.failures = 0
+
+    @property
+    def ejected(self) -> bool:
+        """是否处于摘除期"""
+        return time.monotonic() < self.ejected_until
+
+    def score(self) -> float:
+        """
+        选择得分，越小越优先：按延迟加权的最少进行中请求，即(进行中请求数+1)×EWMA延迟，
+        变慢的副本即使空闲也会少分到请求
+        """
+        # 尚无延迟数据的副本给一个很小的值，让它有机会被选中并积累数据
+        latency = self.ewma_latency if self.ewma_latency is not None else 1e-3
+        return (self.in_flight + 1) * latency
+
+    def observe_latency(self, latency: float) -> None:
+        """
+        更新EWMA延迟，对冲落败被取消的调用也用已耗时间更新，避免变慢的副本一直被选中
+
+        Args:
+            latency: 调用耗时（秒）
+        """
+        alpha = settings.UPSTREAM_EWMA_ALPHA
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = alpha * latency + (1 - alpha) * self.ewma_latency
+
+    def record_success(self, latency: float) -> None:
+        """
+        记录一次成功调用
+
+        Args:
+            latency: 调用耗时（秒）
+        """
+        self.observe_latency(latency)
+        self.calls += 1
+        self.consecutive_failures = 0
+        if self.ejections and not self.ejected:
+            # 摘除结束后调用成功，摘除时长从头计算
+            self.ejections = 0
+
+    def record_failure(self) -> None:
+        """记录一次失败调用，连续失败达到阈值时摘除副本，多次摘除时摘除时长递增"""
+        self.calls += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= settings.MCP_REPLICA_EJECT_FAILURES:
+            self.ejections += 1
+            seconds = settings.MCP_REPLICA_EJECT_SECONDS * min(self.ejections, 10)
+            self.ejected_until = time.monotonic() + seconds
+            self.consecutive_failures = 0
+            logger.warning(f"MCP副本 {self.url} 连续调用失败，摘除 {seconds:.0f}秒")
+
+    def metrics(self) -> Dict[str, Any]:
+        """副本指标"""
+        return {
+            "ejected": self.ejected,
+            "in_flight": self.in_flight,
+            "ewma_latency_seconds": (
+                round(self.ewma_latency, 4) if self.ewma_latency is not None else None
+            ),
+            "calls": self.calls,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class ReplicaHealthRegistry:
+    """副本健康状态注册表，MCP客户端按请求创建，健康状态和延迟样本需要跨请求保留"""
+
+    def __init__(self):
+        """初始化副本健康状态注册表"""
+        self._replicas: Dict[str, ReplicaHealth] = {}
+        self._latency_samples: Dict[str, deque] = {}
+
+    def get(self, url: str) -> ReplicaHealth:
+        """
+        获取副本的健康状态，不存在时创建
+
+        Args:
+            url: 副本URL
+
+        Returns:
+            副本健康状态
+        """
+        health = self._replicas.get(url)
+        if health is None:
+            health = ReplicaHealth(url)
+            self._replicas[url] = health
+        return health
+
+    def record_latency(self, tool_name: str, seconds: float) -> None:
+        """记录工具调用耗时，用于计算对冲阈值"""
+        self._latency_samples.setdefault(tool_name, deque(maxlen=512)).append(seconds)
+
+    def hedge_delay(self, tool_name: str) -> Optional[float]:
+        """
+        计算对冲调用的触发阈值：该工具近期调用耗时的p95，限制在配置的上下限内
+
+        Args:
+            tool_name: 工具名称
+
+        Returns:
+            对冲阈值（秒），未启用对冲时返回None
+        """
+        if not settings.MCP_REPLICA_HEDGE_ENABLED:
+            return None
+
+        samples = self._latency_samples.get(tool_name)
+        if not samples or len(samples) < settings.MCP_REPLICA_HEDGE_MIN_SAMPLES:
+            return settings.MCP_REPLICA_HEDGE_MAX_DELAY
+
+        ordered = sorted(samples)
+        p95 = ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)]
+        return min(
+            max(p95, settings.MCP_REPLICA_HEDGE_MIN_DELAY), settings.MCP_REPLICA_HEDGE_MAX_DELAY
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        """获取所有副本的指标"""
+        return {url: health.metrics() for url, health in self._replicas.items()}
+
+
+# 当前工作进程的全局副本健康状态注册表
+replica_health = ReplicaHealthRegistry()
+
+
+class ReplicaSetMCPClientService:
+    """MCP副本集客户端服务，接口与MultiprocessMCPClientService一致"""
+
+    def __init__(self, clients: Sequence[Any], idempotent_tools: Sequence[str] = ()):
+        """
+        初始化MCP副本集客户端服务
+
+        Args:
+            clients: 每个副本一个MCP客户端（尚未连接）
+            idempotent_tools: 可以安全重复调用的工具名称，只有这些工具会被对冲或在失败后换副本重试
+        """
+        self.clients = list(clients)
+        self.idempotent_tools = set(idempotent_tools)
+        self.url = self.clients[0].url
+        self.transport_type = self.clients[0].transport_type
+        self.available_tools = {}
+        self._connected: List[Any] = []
+        self._connect_tasks: List[asyncio.Task] = []
+
+    async def _connect_replica(self, client: Any) -> bool:
+        """连接单个副本，连接失败计入副本的健康状态"""
+        health = replica_health.get(client.url)
+        try:
+            success = await client.connect()
+        except Exception as e:
+            logger.error(f"连接MCP副本 {client.url} 时出错: {str(e)}")
+            success = False
+        if success:
+            self._connected.append(client)
+            for name, tool in client.available_tools.items():
+                self.available_tools.setdefault(name, tool)
+        else:
+            health.record_failure()
+        return success
+
+    async def connect(self) -> bool:
+        """
+        并发连接所有未被摘除的副本，第一个副本连接成功即返回，其余副本在后台继续连接
+
+        Returns:
+            是否至少有一个副本连接成功
+        """
+        if self._connected or self._connect_tasks:
+            await self.disconnect()
+
+        candidates = [c for c in self.clients if not replica_health.get(c.url).ejected]
+        # 全部被摘除时仍尝试所有副本，避免整个服务器不可用
+        candidates = candidates or self.clients
+        pending = {asyncio.create_task(self._connect_replica(c)) for c in candidates}
+        self._connect_tasks = list(pending)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(task.result() for task in done):
+                logger.info(
+                    f"MCP副本集 {self.url} 已连接 {len(self._connected)}/{len(self.clients)} 个副本"
+                )
+                return True
+        logger.error(f"MCP副本集 {self.url} 的所有副本都无法连接")
+        return False
+
+    async def update_available_tools(self) -> Dict[str, Any]:
+        """
+        获取可用工具列表，各副本提供的工具取并集
+
+        Returns:
+            可用工具的字典
+        """
+        tools = {}
+        for client in list(self._connected):
+            for name, tool in (await client.update_available_tools()).items():
+                tools.setdefault(name, tool)
+        self.available_tools = tools
+        return self.available_tools
+
+    def _select(self, tool_name: str, exclude: Sequence[Any] = ()) -> List[Any]:
+        """按优先顺序返回可用于调用该工具的副本，未被摘除的副本按得分排序在前"""
+        candidates = [
+            client
+            for client in self._connected
+            if client not in exclude and tool_name in client.available_tools
+        ]
+        healthy = [c for c in candidates if not replica_health.get(c.url).ejected]
+        return sorted(healthy or candidates, key=lambda c: replica_health.get(c.url).score())
+
+    async def _attempt(self, client: Any, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """在指定副本上调用一次工具并记录结果"""
+        health = replica_health.get(client.url)
+        health.in_flight += 1
+        started = time.monotonic()
+        try:
+            result = await client.call_tool(tool_name, arguments)
+        except asyncio.CancelledError:
+            health.observe_latency(time.monotonic() - started)
+            raise
+        except ValueError:
+            # 工具不可用等调用方错误不计入副本健康状态
+            raise
+        except Exception:
+            health.record_failure()
+            raise
+        finally:
+            health.in_flight -= 1
+        latency = time.monotonic() - started
+        health.record_success(latency)
+        replica_health.record_latency(tool_name, latency)
+        return result
+
+    async def _call_with_hedge(
+        self,
+        candidates: List[Any],
+        tool_name: str,
+        arguments: Dict[str, Any],
+        attempted: List[Any],
+    ) -> str:
+        """
+        向首选副本发起调用，超过对冲阈值仍未返回时向下一个副本发起对冲调用，采用先成功的结果
+
+        Args:
+            candidates: 按优先顺序排列的副本，至少两个
+            tool_name: 工具名称
+            arguments: 工具参数
+            attempted: 记录已发起调用的副本
+        """
+        delay = replica_health.hedge_delay(tool_name)
+        attempted.append(candidates[0])
+        tasks = {asyncio.create_task(self._attempt(candidates[0], tool_name, arguments))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                logger.info(
+                    f"MCP副本 {candidates[0].url} 调用 {tool_name} 超过 {delay:.2f}秒，"
+                    f"向 {candidates[1].url} 发起对冲调用"
+                )
+                attempted.append(candidates[1])
+                tasks.add(
+                    asyncio.create_task(self._attempt(candidates[1], tool_name, arguments))
+                )
+
+            first_error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            # 取消落败的调用
+            for task in tasks:
+                task.cancel()
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        调用MCP工具
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+
+        Returns:
+            工具执行结果
+
+        Raises:
+            ValueError: 当没有可用副本提供该工具时
+            Exception: 调用工具过程中的其他错误
+        """
+        candidates = self._select(tool_name)
+        if not candidates:
+            raise ValueError(f"工具 '{tool_name}' 不可用")
+
+        if tool_name not in self.idempotent_tools:
+            # 非幂等工具可能已在副本上执行，失败后不能换副本重试
+            return await self._attempt(candidates[0], tool_name, arguments)
+
+        attempted: List[Any] = []
+        try:
+            if len(candidates) > 1 and settings.MCP_REPLICA_HEDGE_ENABLED:
+                return await self._call_with_hedge(candidates, tool_name, arguments, attempted)
+            attempted.append(candidates[0])
+            return await self._attempt(candidates[0], tool_name, arguments)
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.warning(f"MCP副本调用 {tool_name} 失败: {str(e)}")
+            error = e
+
+        # 幂等工具在尚未尝试的副本上重试一次
+        remaining = self._select(tool_name, exclude=attempted)
+        if not remaining:
+            raise error
+        return await self._attempt(remaining[0], tool_name, arguments)
+
+    async def ping(self) -> None:
+        """
+        检查所有已连接的副本，失败的副本计入健康状态，至少一个副本可用即视为成功
+
+        Raises:
+            ConnectionError: 所有副本都不可用时
+        """
+        clients = list(self._connected)
+        results = await asyncio.gather(
+            *(client.ping() for client in clients), return_exceptions=True
+        )
+        for client, result in zip(clients, results):
+            if isinstance(result, Exception):
+                logger.warning(f"MCP副本 {client.url} ping失败: {str(result)}")
+                replica_health.get(client.url).record_failure()
+        if not any(not isinstance(result, Exception) for result in results):
+            raise ConnectionError(f"MCP副本集 {self.url} 的所有副本都不可用")
+
+    async def disconnect(self) -> None:
+        """断开所有副本"""
+        tasks, self._connect_tasks = self._connect_tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._connected = []
+        self.available_tools = {}
+        await asyncio.gather(
+            *(client.disconnect() for client in self.clients), return_exceptions=True
+        )
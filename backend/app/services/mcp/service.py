@@ -5,10 +5,20 @@ MCP服务管理模块，提供统一的MCP客户端管理和工具调用功能
 import json
 import logging
 import asyncio
+import functools
 from typing import Dict, Any, Optional, List
 
+from app.core.config import settings
 from .client import MultiprocessMCPClientService
-from .models import MCPTransportType
+from .gateway import GatewayMCPClientService
+from .inprocess_client import InProcessMCPClientService
+from .models import MCPClientMode, MCPTransportType
+from .replica_set import ReplicaSetMCPClientService
+from .session import resolve_server_url, server_key
+from .shared_result import describe_tool_result
+from .supervisor import mcp_supervisor
+from .tool_catalog import tool_catalog
+from .user_client_pool import user_client_pool
 
 logger = logging.getLogger(__name__)
 
@@ -23,12 +33,56 @@ class MCPServiceManager:
         self.mcp_clients = {}  # 存储多个MCP客户端的字典，键为服务器名称
         self.tool_to_server_map = {}  # 工具名称到服务器名称的映射
 
+    @staticmethod
+    def _create_client(
+        url: str, transport_type: str, env: Optional[Dict[str, str]], mode: str
+    ):
+        """
+        创建单个MCP服务器的客户端：进程内模式直接在当前事件循环中运行会话；
+        启用网关时通过主机共享的网关访问；否则为每个服务器启动专用进程
+        """
+        if mode == MCPClientMode.INPROCESS:
+            client_class = InProcessMCPClientService
+        elif settings.MCP_GATEWAY_ENABLED:
+            client_class = GatewayMCPClientService
+        else:
+            client_class = MultiprocessMCPClientService
+        return client_class(
+            url=url, 
+            transport_type=transport_type, 
+            env=env or {}
+        )
+
+    @classmethod
+    def _build_client(
+        cls,
+        url: str,
+        transport_type: str,
+        env: Optional[Dict[str, str]],
+        mode: str,
+        replica_urls: Optional[List[str]],
+        idempotent_tools: Optional[List[str]],
+    ):
+        """创建MCP服务器的客户端，配置了多个副本时创建副本集"""
+        if replica_urls and len(replica_urls) > 1:
+            return ReplicaSetMCPClientService(
+                [cls._create_client(u, transport_type, env, mode) for u in replica_urls],
+                idempotent_tools=idempotent_tools or (),
+            )
+        return cls._create_client(url, transport_type, env, mode)
+
     async def initialize_mcp_client(
         self, 
         server_name: str,
         url: str,
         transport_type: str = MCPTransportType.SSE,
-        env: Optional[Dict[str, str]] = None
+        env: Optional[Dict[str, str]] = None,
+        mode: Optional[str] = None,
+        replica_urls: Optional[List[str]] = None,
+        idempotent_tools: Optional[List[str]] = None,
+        supervised: bool = False,
+        pooled: bool = False,
+        user_id: Optional[int] = None
     ):
         """
         初始化MCP客户端
@@ -36,8 +90,15 @@ class MCPServiceManager:
         Args:
             server_name: MCP服务器名称
             url: MCP服务器URL
-            transport_type: 传输类型，可以是"sse"或"streamable_http"
+            transport_type: 传输类型，可以是"sse"、"streamable_http"或"stdio"
             env: 环境变量，包含认证信息等
+            mode: 运行模式，"inprocess"在当前事件循环中运行会话，其他值使用默认方式，
+                  未指定时stdio服务器使用进程内模式，其他服务器使用MCP_CLIENT_MODE配置
+            replica_urls: 副本URL列表，多于一个时作为副本集访问，url可为空
+            idempotent_tools: 可以安全重复调用的工具名称，副本集中这些工具可被对冲或换副本重试
+            supervised: 是否由监管器长期保持连接，只用于服务端配置的服务器
+            pooled: 是否从用户MCP客户端池取得客户端，用于用户自定义的服务器
+            user_id: 用户ID，用于用户MCP客户端池的每用户上限
 
         Returns:
             初始化后的MCP客户端
@@ -46,16 +107,45 @@ class MCPServiceManager:
         if server_name in self.mcp_clients and self.mcp_clients[server_name]:
             return self.mcp_clients[server_name]
 
+        url = url or (replica_urls[0] if replica_urls else None)
+
+        # stdio服务器本身已是独立的子进程，未启用网关时默认在当前事件循环中直接管理
+        if mode is None and transport_type == MCPTransportType.STDIO and not settings.MCP_GATEWAY_ENABLED:
+            mode = MCPClientMode.INPROCESS
+        mode = mode or settings.MCP_CLIENT_MODE
+
         # 初始化MCP客户端
-        logger.info(f"初始化MCP客户端: {server_name}，使用传输类型: {transport_type}，URL: {url}")
+        logger.info(
+            f"初始化MCP客户端: {server_name}，使用传输类型: {transport_type}，"
+            f"运行模式: {mode}，URL: {url}"
+        )
         
         try:
-            # 创建新的MCP客户端
-            mcp_client = MultiprocessMCPClientService(
-                url=url, 
-                transport_type=transport_type, 
-                env=env or {}
+            client_factory = functools.partial(
+                self._build_client, url, transport_type, env, mode, replica_urls, idempotent_tools
             )
+            if supervised and settings.MCP_SUPERVISOR_ENABLED:
+                # 服务端配置的服务器由监管器在工作进程内保持连接，请求之间共享；
+                # process模式下保持多个工作进程，所有用户的工具调用分摊到这些进程
+                size = 1
+                if (
+                    mode == MCPClientMode.PROCESS
+                    and not settings.MCP_GATEWAY_ENABLED
+                    and not (replica_urls and len(replica_urls) > 1)
+                ):
+                    size = settings.MCP_SUPERVISOR_PROCESS_WORKERS
+                mcp_client = mcp_supervisor.get(server_name, client_factory, size)
+            elif pooled and settings.MCP_USER_POOL_ENABLED:
+                # 用户自定义的服务器按配置哈希从池中取得，相同配置的请求复用已连接的客户端
+                mcp_client = user_client_pool.lease(
+                    user_id,
+                    server_key(url, transport_type, env),
+                    url,
+                    transport_type,
+                    client_factory,
+                )
+            else:
+                mcp_client = client_factory()
             
             # 连接到服务器
             success = await mcp_client.connect()
@@ -95,12 +185,12 @@ class MCPServiceManager:
         if not config:
             raise ValueError("MCP配置为空")
         
-        url = config.get("url")
-        if not url:
-            raise ValueError("MCP配置中未指定URL")
-        
         # 获取传输类型，默认为SSE
         transport_type = config.get("transportType", MCPTransportType.SSE)
+
+        url = resolve_server_url(config, transport_type)
+        if not url:
+            raise ValueError("MCP配置中未指定URL")
         
         # 获取环境变量
         env = config.get("env", {})
@@ -116,16 +206,20 @@ class MCPServiceManager:
             env=env
         )
 
-    async def initialize_from_configs(self, configs: Dict[str, Dict[str, Any]]):
+    async def initialize_from_configs(
+        self, configs: Dict[str, Dict[str, Any]], user_id: Optional[int] = None
+    ):
         """
         从多个配置初始化MCP客户端
 
         Args:
             configs: 服务器名称到配置的映射，格式为：
                     {
-                      "server1": {"url": "...", "env": {...}, "transportType": "..."},
+                      "server1": {"url": "...", "env": {...}, "transportType": "...", "mode": "..."},
+                      "server3": {"urls": ["...", "..."], "idempotent_tools": ["..."]},
                       "server2": {"url": "...", "env": {...}, "transportType": "..."}
                     }
+            user_id: 用户ID，配置中pooled为True时用于用户MCP客户端池
 
         Returns:
             初始化的MCP客户端字典
@@ -134,11 +228,18 @@ class MCPServiceManager:
         
         for server_name, config in configs.items():
             try:
+                transport_type = config.get("transportType", MCPTransportType.SSE)
                 client = await self.initialize_mcp_client(
                     server_name=server_name,
-                    url=config.get("url"),
-                    transport_type=config.get("transportType", MCPTransportType.SSE),
-                    env=config.get("env", {})
+                    url=resolve_server_url(config, transport_type),
+                    transport_type=transport_type,
+                    env=config.get("env", {}),
+                    mode=config.get("mode"),
+                    replica_urls=config.get("urls"),
+                    idempotent_tools=config.get("idempotent_tools"),
+                    supervised=config.get("supervised", False),
+                    pooled=config.get("pooled", False),
+                    user_id=user_id
                 )
                 initialized_clients[server_name] = client
             except Exception as e:
@@ -168,31 +269,25 @@ class MCPServiceManager:
         获取所有服务器的所有工具
 
         Returns:
-            所有工具的列表，格式符合OpenAI API工具格式
+            所有工具的列表，格式符合OpenAI API工具格式。列表在请求之间共享，调用方不得修改
         """
-        all_tools = []
-        # 从所有客户端收集工具
-        for client_name, client in self.mcp_clients.items():
+        servers = []
+        # 从所有客户端收集工具，按服务器名称排序保证顺序与字典插入顺序无关
+        for client_name, client in sorted(self.mcp_clients.items()):
+            # 不可用（断开或熔断）的服务器不提供工具，避免模型在对话中调用后失败
+            if not getattr(client, "available", True):
+                logger.warning(f"MCP服务器 {client_name} 当前不可用，省略其工具")
+                continue
+
             logger.debug(f"从客户端 {client_name} 获取工具列表")
 
             # 确保工具列表是最新的
             await client.update_available_tools()
+            servers.append((client_name, client.available_tools))
 
-            for tool_name, tool_info in client.available_tools.items():
-                # 处理不同类型客户端的工具信息格式
-                tool_function = {
-                    "name": tool_name,
-                    "description": tool_info.get("description", ""),
-                    "parameters": tool_info.get("inputSchema", {}),
-                }
-
-                # 添加到工具列表
-                all_tools.append(
-                    {
-                        "type": "function",
-                        "function": tool_function,
-                    }
-                )
+        # 工具目录按服务器集合指纹缓存精简后的工具列表，工具按名称排序、Schema键有序，
+        # 序列化结果稳定，便于命中上下文缓存
+        all_tools = tool_catalog.compile(servers)
 
         logger.info(
             f"收集了 {len(all_tools)} 个工具，来自 {len(self.mcp_clients)} 个服务器"
@@ -220,7 +315,7 @@ class MCPServiceManager:
             
             # 调用工具
             result = await mcp_client.call_tool(tool_name, arguments)
-            logger.info(f"工具 {tool_name} 返回结果: {result}")
+            logger.info(f"工具 {tool_name} 返回结果: {describe_tool_result(result)}")
             return result
         except Exception as e:
             logger.error(f"调用工具 '{tool_name}' 时出错: {str(e)}")
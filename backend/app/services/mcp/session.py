@@ -0,0 +1,412 @@
+"""
+MCP会话模块，封装单个MCP服务器在不同传输方式下的连接、工具列表获取和工具调用，
+供MCP工作进程和MCP网关共用
+"""
+
+import asyncio
+import hashlib
+import logging
+import shlex
+from contextlib import AsyncExitStack
+from typing import Any, Callable, Dict, List, Optional
+
+from app.utils.json_utils import dumps, dumps_canonical
+from .models import MCPTransportType
+
+logger = logging.getLogger(__name__)
+
+
+def format_tool_result(content: Any) -> str:
+    """
+    将MCP工具返回的内容列表转换为文本
+
+    文本内容直接拼接，其他类型（图片、资源等）序列化为JSON
+
+    Args:
+        content: MCP工具调用结果中的content
+
+    Returns:
+        工具结果文本
+    """
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+
+    parts = []
+    for item in content if isinstance(content, list) else [content]:
+        text = getattr(item, "text", None)
+        if isinstance(text, str):
+            parts.append(text)
+        elif hasattr(item, "model_dump"):
+            parts.append(dumps(item.model_dump(mode="json")))
+        else:
+            parts.append(str(item))
+    return "\n".join(parts)
+
+
+def stdio_command_line(command: str, args: Optional[List[str]] = None) -> str:
+    """
+    将stdio服务器的命令和参数拼接为命令行，作为该服务器的URL（标识）
+
+    Args:
+        command: 可执行文件
+        args: 命令行参数
+
+    Returns:
+        经过shell转义的命令行
+    """
+    return shlex.join([command, *(args or [])])
+
+
+def resolve_server_url(config: Dict[str, Any], transport_type: Optional[str]) -> Optional[str]:
+    """
+    获取MCP服务器配置的URL，stdio服务器使用command和args拼接的命令行
+
+    Args:
+        config: 服务器配置
+        transport_type: 传输类型
+
+    Returns:
+        服务器URL，未配置时返回None
+    """
+    if transport_type == MCPTransportType.STDIO and config.get("command"):
+        return stdio_command_line(config["command"], config.get("args"))
+    return config.get("url")
+
+
+def server_key(url: str, transport_type: str, env: Optional[Dict[str, str]]) -> str:
+    """
+    计算MCP服务器配置的标识，相同配置共享网关中的会话池和工作进程内的工具列表缓存
+
+    环境变量中可能包含密钥，只参与哈希，不会以明文出现在标识、日志或指标中
+
+    Args:
+        url: MCP服务器URL
+        transport_type: 传输类型
+        env: 环境变量
+
+    Returns:
+        十六进制哈希字符串
+    """
+    payload = {"url": url, "transport": transport_type, "env": env or {}}
+    return hashlib.sha256(dumps_canonical(payload)).hexdigest()
+
+
+# 表示连接问题的MCP错误码：连接已关闭（CONNECTION_CLOSED）和等待响应超时
+_TRANSPORT_ERROR_CODES = (-32000, 408)
+
+
+def is_transport_error(error: BaseException) -> bool:
+    """
+    判断调用MCP服务器时的异常是否为连接、传输或超时错误，
+    参数错误、工具执行失败等工具本身的错误说明服务器仍在正常响应，返回False
+
+    Args:
+        error: 异常
+
+    Returns:
+        是否为传输错误
+    """
+    if isinstance(error, (ConnectionError, TimeoutError, EOFError, OSError)):
+        return True
+    if isinstance(error, BaseExceptionGroup):
+        return any(is_transport_error(e) for e in error.exceptions)
+    # McpError携带JSON-RPC错误数据
+    if getattr(getattr(error, "error", None), "code", None) in _TRANSPORT_ERROR_CODES:
+        return True
+    try:
+        import anyio
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(
+        error,
+        (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, httpx.TransportError),
+    )
+
+
+class MCPSession:
+    """单个MCP服务器的异步会话"""
+
+    def __init__(
+        self,
+        url: str,
+        env: Optional[Dict[str, str]] = None,
+        transport_type: str = MCPTransportType.SSE,
+        on_tools_changed: Optional[Callable[[], None]] = None,
+    ):
+        """
+        初始化MCP会话
+
+        Args:
+            url: MCP服务器URL，stdio传输时为子进程命令行
+            env: 环境变量，HTTP传输时作为请求头发送，stdio传输时传给子进程
+            transport_type: 传输类型
+            on_tools_changed: 服务器发送tools/list_changed通知时调用的函数
+        """
+        self.url = url
+        self.env = env or {}
+        self.transport_type = transport_type
+        self.on_tools_changed = on_tools_changed
+        self.available_tools: Dict[str, Dict[str, Any]] = {}
+        self._session = None
+        self._owner: Optional[asyncio.Task] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._forwarder: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        """会话是否已连接"""
+        return self._session is not None
+
+    async def connect(self, tools: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        """
+        连接到MCP服务器并获取工具列表
+
+        传输和会话上下文由一个专用任务进入和退出（MCP SDK基于anyio任务组，
+        必须在同一任务中退出），因此会话可以在任意任务中使用和关闭
+
+        Args:
+            tools: 已缓存的工具列表，提供时直接使用，连接时不再向服务器获取
+
+        Raises:
+            ImportError: 所需的MCP SDK传输模块不可用时
+            ValueError: 传输类型不受支持时
+            Exception: 连接或初始化失败时
+        """
+        if self._owner is not None:
+            return
+
+        ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._owner = asyncio.create_task(self._run(ready))
+        try:
+            await ready
+        except BaseException:
+            await self.close()
+            raise
+
+        if tools is not None:
+            self.available_tools = tools
+        else:
+            await self.list_tools(refresh=True)
+        logger.info(f"已连接到MCP服务器: {self.url}，可用工具: {list(self.available_tools)}")
+
+    async def _run(self, ready: asyncio.Future) -> None:
+        """会话所有者任务，保持传输连接直到close被调用或连接断开"""
+        try:
+            from mcp import ClientSession
+
+            async with AsyncExitStack() as exit_stack:
+                headers = dict(self.env)
+                if self.transport_type == MCPTransportType.SSE:
+                    from mcp.client.sse import sse_client
+
+                    streams = await exit_stack.enter_async_context(
+                        sse_client(url=self.url, headers=headers)
+                    )
+                    read_stream, write_stream = streams
+                    session = await exit_stack.enter_async_context(
+                        ClientSession(
+                            self._monitor(read_stream),
+                            write_stream,
+                            message_handler=self._handle_message,
+                        )
+                    )
+
+                elif self.transport_type == MCPTransportType.STREAMABLE_HTTP:
+                    try:
+                        from mcp.client.streamable_http import streamablehttp_client
+                    except ImportError as ie:
+                        raise ImportError(
+                            f"Streamable HTTP传输需要MCP SDK 1.8.0及以上版本，错误: {str(ie)}"
+                        )
+
+                    # streamablehttp_client返回(读流, 写流, 会话ID获取函数)三元组
+                    read_stream, write_stream, _ = await exit_stack.enter_async_context(
+                        streamablehttp_client(url=self.url, headers=headers)
+                    )
+                    session = await exit_stack.enter_async_context(
+                        ClientSession(
+                            self._monitor(read_stream),
+                            write_stream,
+                            message_handler=self._handle_message,
+                        )
+                    )
+                elif self.transport_type == MCPTransportType.STDIO:
+                    from mcp import StdioServerParameters
+                    from mcp.client.stdio import get_default_environment, stdio_client
+
+                    # URL为命令行，子进程随会话启动和退出；环境变量传给子进程而不是作为请求头
+                    command, *args = shlex.split(self.url)
+                    params = StdioServerParameters(
+                        command=command,
+                        args=args,
+                        env={**get_default_environment(), **self.env},
+                    )
+                    read_stream, write_stream = await exit_stack.enter_async_context(
+                        stdio_client(params)
+                    )
+                    session = await exit_stack.enter_async_context(
+                        ClientSession(
+                            self._monitor(read_stream),
+                            write_stream,
+                            message_handler=self._handle_message,
+                        )
+                    )
+                else:
+                    raise ValueError(f"不支持的传输类型: {self.transport_type}")
+
+                await session.initialize()
+                self._session = session
+                ready.set_result(None)
+                await self._closing.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.error(f"MCP会话 {self.url} 异常结束: {str(e)}")
+        finally:
+            self._session = None
+            if self._forwarder is not None:
+                self._forwarder.cancel()
+                self._forwarder = None
+            if not ready.done():
+                ready.set_exception(ConnectionError(f"MCP服务器 {self.url} 在初始化完成前断开"))
+
+    def _monitor(self, read_stream: Any) -> Any:
+        """
+        转发传输层的读流，读流结束（连接断开、stdio子进程退出）时结束会话，
+        使connected和wait_closed能反映连接状态
+
+        Args:
+            read_stream: 传输层返回的读流
+
+        Returns:
+            交给ClientSession使用的读流
+        """
+        import anyio
+
+        send_stream, receive_stream = anyio.create_memory_object_stream(0)
+
+        async def forward():
+            try:
+                async with send_stream:
+                    async for message in read_stream:
+                        await send_stream.send(message)
+            except (anyio.ClosedResourceError, anyio.BrokenResourceError):
+                pass
+            except Exception as e:
+                logger.warning(f"MCP会话 {self.url} 读取消息时出错: {str(e)}")
+            finally:
+                if not self._closing.is_set():
+                    logger.warning(f"MCP会话 {self.url} 的连接已断开")
+                    self._closing.set()
+
+        self._forwarder = asyncio.create_task(forward())
+        return receive_stream
+
+    async def _handle_message(self, message: Any) -> None:
+        """处理服务器主动发送的消息，工具列表变化时通知会话的使用方"""
+        from mcp import types
+
+        if isinstance(message, types.ServerNotification) and isinstance(
+            message.root, types.ToolListChangedNotification
+        ):
+            logger.info(f"MCP服务器 {self.url} 的工具列表已变化")
+            if self.on_tools_changed is not None:
+                self.on_tools_changed()
+
+    async def list_tools(self, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        获取可用工具列表
+
+        Args:
+            refresh: 是否重新从服务器获取
+
+        Returns:
+            工具名称到可序列化工具信息（name、description、inputSchema）的字典
+        """
+        if self._session is None:
+            raise ValueError("MCP会话未初始化")
+        if not refresh and self.available_tools:
+            return self.available_tools
+
+        response = await self._session.list_tools()
+        self.available_tools = {
+            tool.name: {
+                "name": tool.name,
+                "description": getattr(tool, "description", "") or "",
+                "inputSchema": getattr(tool, "inputSchema", {}) or {},
+            }
+            for tool in response.tools
+        }
+        return self.available_tools
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        调用工具
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+
+        Returns:
+            工具结果文本
+
+        Raises:
+            ValueError: 会话未初始化或工具不可用时
+        """
+        if self._session is None:
+            raise ValueError("MCP会话未初始化")
+        if tool_name not in self.available_tools:
+            # 工具列表可能来自缓存，未知工具先重新获取一次再判断
+            await self.list_tools(refresh=True)
+            if tool_name not in self.available_tools:
+                raise ValueError(f"工具 '{tool_name}' 不可用")
+
+        # 会话在调用期间断开时（如stdio子进程崩溃）立即失败，不等待调用超时
+        call = asyncio.create_task(self._session.call_tool(tool_name, arguments))
+        owner = self._owner
+        try:
+            done, _ = await asyncio.wait({call, owner}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            call.cancel()
+            raise
+        if call not in done:
+            call.cancel()
+            raise ConnectionError(f"MCP服务器 {self.url} 在工具调用期间断开")
+        return format_tool_result(call.result().content)
+
+    async def ping(self) -> None:
+        """
+        向MCP服务器发送ping，确认连接可用
+
+        Raises:
+            ConnectionError: 会话未连接时
+            Exception: ping失败时
+        """
+        if self._session is None:
+            raise ConnectionError(f"MCP会话 {self.url} 未连接")
+        await self._session.send_ping()
+
+    async def wait_closed(self) -> None:
+        """等待会话结束（被关闭、连接断开或stdio子进程退出）"""
+        if self._owner is not None:
+            await asyncio.shield(self._owner)
+
+    async def close(self) -> None:
+        """关闭会话并释放传输资源"""
+        owner, self._owner = self._owner, None
+        self._session = None
+        self.available_tools = {}
+        if owner is None:
+            return
+        self._closing.set()
+        try:
+            await asyncio.wait_for(owner, timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning(f"关闭MCP会话 {self.url} 超时")
+        except Exception as e:
+            logger.error(f"关闭MCP会话 {self.url} 时出错: {str(e)}")
@@ -0,0 +1,137 @@
+"""
+MCP工具结果共享内存传输模块，工作进程把超过阈值的大结果（如抓取的网页、搜索结果）写入共享内存，
+响应队列中只传递共享内存的名称和大小，主进程在第一次转换为字符串时才解码并立即释放共享内存
+"""
+
+import logging
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+def _release(name: str) -> None:
+    """删除共享内存，已被删除时忽略"""
+    try:
+        shm = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedToolResult:
+    """
+    存放在共享内存中的工具结果
+
+    由工作进程通过share_tool_result创建并放入响应队列，只有名称和大小会被序列化；
+    主进程反序列化得到的对象拥有该共享内存：str()时解码一次并缓存，随后删除共享内存，
+    从未被解码（如响应被丢弃）的对象在回收时删除共享内存
+    """
+
+    def __init__(self, name: str, size: int):
+        """
+        初始化共享内存中的工具结果
+
+        Args:
+            name: 共享内存名称
+            size: 结果的UTF-8字节数
+        """
+        self.name = name
+        self.size = size
+        self._text: Optional[str] = None
+        self._finalizer: Optional[weakref.finalize] = None
+
+    def __getstate__(self):
+        return {"name": self.name, "size": self.size}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.size = state["size"]
+        self._text = None
+        # 反序列化的一方拥有共享内存
+        self._finalizer = weakref.finalize(self, _release, self.name)
+
+    @property
+    def decoded(self) -> bool:
+        """是否已经解码"""
+        return self._text is not None
+
+    def __str__(self) -> str:
+        if self._text is None:
+            try:
+                shm = SharedMemory(name=self.name)
+                try:
+                    with shm.buf[: self.size] as view:
+                        self._text = str(view, "utf-8")
+                finally:
+                    shm.close()
+            except FileNotFoundError:
+                logger.error(f"工具结果的共享内存 {self.name} 已不存在")
+                self._text = "Error: 工具结果已失效"
+            if self._finalizer is not None:
+                self._finalizer()
+        return self._text
+
+    def __repr__(self) -> str:
+        return f"<SharedToolResult {self.name} {self.size}字节>"
+
+
+def share_tool_result(text: str, threshold: int) -> Union[str, SharedToolResult]:
+    """
+    在工作进程中调用，结果不小于阈值时写入共享内存
+
+    Args:
+        text: 工具结果
+        threshold: 使用共享内存的最小字节数，0表示不使用
+
+    Returns:
+        小结果原样返回，大结果返回SharedToolResult
+    """
+    if threshold <= 0 or len(text) * 4 < threshold:
+        # UTF-8每个字符最多4字节，显然小于阈值时不必编码
+        return text
+    data = text.encode("utf-8")
+    if len(data) < threshold:
+        return text
+
+    try:
+        shm = SharedMemory(create=True, size=len(data))
+    except OSError as e:
+        # 共享内存不可用（如/dev/shm空间不足）时仍通过队列返回
+        logger.warning(f"无法为工具结果创建共享内存，改为通过队列返回: {str(e)}")
+        return text
+    try:
+        shm.buf[: len(data)] = data
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    # 共享内存由主进程删除，工作进程退出时资源跟踪器不应将其清理
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return SharedToolResult(shm.name, len(data))
+
+
+def describe_tool_result(result: Any, limit: int = 500) -> str:
+    """
+    生成用于日志的工具结果摘要，不会为记录日志而解码共享内存中的结果
+
+    Args:
+        result: 工具结果
+        limit: 最多保留的字符数
+
+    Returns:
+        结果摘要
+    """
+    if isinstance(result, SharedToolResult) and not result.decoded:
+        return f"<共享内存中的结果，{result.size}字节>"
+    text = str(result)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...（共{len(text)}字符）"
@@ -0,0 +1,224 @@
+"""
+预热MCP工作进程池模块，预先启动若干已导入MCP SDK的空闲工作进程（连同其进程间通信所需的Manager和队列），
+连接新的MCP服务器时直接分配一个空闲进程，冷启动只剩与服务器的握手；
+池的大小按最近一段时间内的分配次数自适应
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from multiprocessing import Manager, Process, Queue
+from typing import Any, Deque, Dict, Optional
+
+from app.core.config import settings
+from .worker import mcp_spare_worker_process
+
+logger = logging.getLogger(__name__)
+
+# 分配后延迟补充的时间（秒），避免启动新进程与刚分配的进程连接服务器争用CPU
+REPLENISH_DELAY = 1.0
+
+
+class SpareWorker:
+    """一个空闲的预热工作进程及其通信资源"""
+
+    def __init__(
+        self,
+        process: Process,
+        manager: Any,
+        request_queue: Queue,
+        response_queue: Queue,
+        shutdown_event: Any,
+        tools_changed: Any,
+    ):
+        self.process = process
+        self.manager = manager
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.shutdown_event = shutdown_event
+        self.tools_changed = tools_changed
+        self.created_at = time.monotonic()
+
+    @classmethod
+    def spawn(cls) -> "SpareWorker":
+        """
+        启动空闲工作进程（阻塞调用，应在线程池中执行）
+
+        Returns:
+            空闲工作进程
+        """
+        manager = Manager()
+        request_queue = Queue()
+        response_queue = Queue()
+        shutdown_event = manager.Event()
+        tools_changed = manager.Event()
+        process = Process(
+            target=mcp_spare_worker_process,
+            args=(
+                request_queue,
+                response_queue,
+                shutdown_event,
+                tools_changed,
+                settings.MCP_SHM_RESULT_THRESHOLD,
+            ),
+        )
+        process.daemon = True  # 设置为守护进程，主进程退出时自动终止
+        process.start()
+        return cls(process, manager, request_queue, response_queue, shutdown_event, tools_changed)
+
+    def close(self) -> None:
+        """关闭空闲工作进程并释放资源（阻塞调用）"""
+        try:
+            self.request_queue.put("SHUTDOWN", block=False)
+            self.shutdown_event.set()
+        except Exception:
+            pass
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=1.0)
+        try:
+            self.manager.shutdown()
+        except Exception as e:
+            logger.debug(f"关闭空闲工作进程的Manager时出错: {str(e)}")
+
+
+class SpareWorkerPool:
+    """
+    预热MCP工作进程池
+
+    目标大小为最近window秒内的分配次数，限制在[min_size, max_size]之间；
+    后台任务补足到目标大小，需求下降后逐个退役多余的空闲进程
+    """
+
+    def __init__(self, min_size: int = 1, max_size: int = 4, window: float = 300.0):
+        """
+        初始化预热工作进程池
+
+        Args:
+            min_size: 最少保持的空闲进程数
+            max_size: 最多保持的空闲进程数
+            window: 统计需求的时间窗口（秒）
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        self.window = window
+        self._spares: Deque[SpareWorker] = deque()
+        self._takes: Deque[float] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._hits = 0
+        self._misses = 0
+        self._spawned = 0
+        self._retired = 0
+
+    def start(self) -> None:
+        """启动后台补充任务"""
+        if self._task is None and self.max_size > 0:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._maintain())
+
+    def target_size(self) -> int:
+        """
+        按最近的分配次数计算目标大小
+
+        Returns:
+            目标空闲进程数
+        """
+        cutoff = time.monotonic() - self.window
+        while self._takes and self._takes[0] < cutoff:
+            self._takes.popleft()
+        return max(self.min_size, min(self.max_size, len(self._takes)))
+
+    def take(self) -> Optional[SpareWorker]:
+        """
+        取出一个空闲进程，并触发后台补充
+
+        Returns:
+            空闲工作进程，池为空时返回None（调用方自行启动进程）
+        """
+        self.start()
+        self._takes.append(time.monotonic())
+        spare = None
+        while self._spares:
+            candidate = self._spares.popleft()
+            if candidate.process.is_alive():
+                spare = candidate
+                break
+            self._retire(candidate)
+        if spare is not None:
+            self._hits += 1
+        else:
+            self._misses += 1
+        if self._wake is not None:
+            self._wake.set()
+        return spare
+
+    def _retire(self, spare: SpareWorker) -> None:
+        """在线程池中关闭空闲进程，不阻塞事件循环"""
+        self._retired += 1
+        asyncio.get_running_loop().run_in_executor(None, spare.close)
+
+    async def _maintain(self) -> None:
+        """补足或缩减空闲进程到目标大小"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                target = self.target_size()
+                while len(self._spares) < target:
+                    spare = await loop.run_in_executor(None, SpareWorker.spawn)
+                    self._spares.append(spare)
+                    self._spawned += 1
+                if len(self._spares) > target:
+                    # 每轮只退役一个，需求短暂回落时不会一次清空
+                    self._retire(self._spares.popleft())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"启动预热MCP工作进程时出错: {str(e)}")
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(self.window / 10, 1.0))
+                await asyncio.sleep(REPLENISH_DELAY)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def stop(self) -> None:
+        """停止后台任务并关闭所有空闲进程"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        loop = asyncio.get_running_loop()
+        spares, self._spares = list(self._spares), deque()
+        for spare in spares:
+            await loop.run_in_executor(None, spare.close)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取池指标
+
+        Returns:
+            包含空闲进程数、目标大小、命中、未命中、启动和退役次数的指标字典
+        """
+        return {
+            "idle": len(self._spares),
+            "target": self.target_size(),
+            "hits": self._hits,
+            "misses": self._misses,
+            "spawned": self._spawned,
+            "retired": self._retired,
+        }
+
+
+# 当前工作进程的预热MCP工作进程池
+spare_worker_pool = SpareWorkerPool(
+    min_size=settings.MCP_SPARE_WORKERS_MIN,
+    max_size=settings.MCP_SPARE_WORKERS_MAX,
+    window=settings.MCP_SPARE_WORKERS_WINDOW,
+)
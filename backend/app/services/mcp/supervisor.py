@@ -0,0 +1,341 @@
+"""
+MCP服务器监管模块，为mcp_servers.json中配置的每个服务器在当前工作进程内保持一个长期存在的客户端，
+后台定期ping，断开或无响应时按指数退避重启，并通过熔断器在服务器不可用期间将其工具从工具列表中省略
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.services.upstream.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class ServerState:
+    """MCP服务器状态常量"""
+    STARTING = "starting"  # 正在连接
+    UP = "up"  # 可用
+    DOWN = "down"  # 不可用，等待重启
+
+
+class SupervisedMCPServer:
+    """
+    受监管的MCP服务器，接口与MultiprocessMCPClientService一致，可直接放入MCPServiceManager
+
+    客户端的生命周期由监管任务负责，请求结束时的disconnect不会关闭连接；
+    一个服务器可以保持多个客户端（如process模式下的多个工作进程），工具调用分给进行中调用最少的客户端，
+    任一客户端ping失败时整组重启
+    """
+
+    def __init__(self, name: str, client_factory: Callable[[], Any], size: int = 1):
+        """
+        初始化受监管的MCP服务器
+
+        Args:
+            name: 服务器名称
+            client_factory: 创建（未连接的）MCP客户端的函数，重启时调用
+            size: 保持的客户端数
+        """
+        self.name = name
+        self.client_factory = client_factory
+        self.size = max(size, 1)
+        self.clients: List[Any] = []
+        self._in_flight: List[int] = []
+        self.state = ServerState.STARTING
+        self.breaker = CircuitBreaker(
+            f"mcp:{name}",
+            error_rate=settings.MCP_BREAKER_ERROR_RATE,
+            slow_seconds=float("inf"),
+            slow_rate=1.0,
+            min_requests=settings.MCP_BREAKER_MIN_REQUESTS,
+            window_seconds=settings.MCP_BREAKER_WINDOW_SECONDS,
+            open_seconds=settings.MCP_BREAKER_OPEN_SECONDS,
+            half_open_probes=1,
+        )
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self.last_ping_at: Optional[float] = None
+        self.next_restart_at: Optional[float] = None
+        self._started = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> Optional[Any]:
+        """第一个客户端，用于读取URL和工具列表（各客户端连接同一服务器）"""
+        return self.clients[0] if self.clients else None
+
+    @property
+    def url(self) -> Optional[str]:
+        """当前客户端的URL"""
+        return self.client.url if self.client is not None else None
+
+    @property
+    def available(self) -> bool:
+        """服务器是否可用（已连接且未熔断），不可用时其工具不会发送给模型"""
+        return self.state == ServerState.UP and not self.breaker.is_open
+
+    @property
+    def available_tools(self) -> Dict[str, Any]:
+        """可用工具列表，服务器不可用时为空"""
+        if self.client is None or self.state != ServerState.UP:
+            return {}
+        return self.client.available_tools
+
+    def start(self) -> None:
+        """启动监管任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _connect_client(self, client: Any) -> bool:
+        """连接单个客户端"""
+        try:
+            return await asyncio.wait_for(
+                client.connect(), timeout=settings.MCP_SUPERVISOR_CONNECT_TIMEOUT
+            )
+        except Exception as e:
+            self.last_error = str(e) or type(e).__name__
+            return False
+
+    async def _start_client(self) -> bool:
+        """创建并连接新的一组客户端，任一客户端连接失败时整组关闭"""
+        if self.clients:
+            await self._stop_client()
+
+        self.state = ServerState.STARTING
+        clients = [self.client_factory() for _ in range(self.size)]
+        results = await asyncio.gather(*(self._connect_client(c) for c in clients))
+        if not all(results):
+            self.last_error = self.last_error or "连接失败"
+            for client in clients:
+                await client.disconnect()
+            self.state = ServerState.DOWN
+            return False
+
+        self.clients = clients
+        self._in_flight = [0] * len(clients)
+        self.state = ServerState.UP
+        self.last_error = None
+        return True
+
+    async def _stop_client(self) -> None:
+        """关闭当前的所有客户端"""
+        clients, self.clients = self.clients, []
+        self._in_flight = []
+        for client in clients:
+            try:
+                await asyncio.wait_for(client.disconnect(), timeout=5.0)
+            except Exception as e:
+                logger.warning(f"关闭MCP服务器 {self.name} 的客户端时出错: {str(e)}")
+
+    async def _ping(self) -> bool:
+        """ping当前的所有客户端"""
+        try:
+            await asyncio.gather(
+                *(
+                    asyncio.wait_for(client.ping(), timeout=settings.MCP_SUPERVISOR_PING_TIMEOUT)
+                    for client in self.clients
+                )
+            )
+            self.last_ping_at = time.time()
+            return True
+        except Exception as e:
+            self.last_error = f"ping失败: {str(e) or type(e).__name__}"
+            return False
+
+    async def _sleep(self, seconds: float) -> None:
+        """等待指定时间，或在调用出错时被提前唤醒"""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _run(self) -> None:
+        """监管循环：启动客户端，定期ping，失败时按指数退避重启"""
+        delay = settings.MCP_SUPERVISOR_RESTART_MIN_DELAY
+        first = True
+        while True:
+            try:
+                if self.state != ServerState.UP:
+                    if not first:
+                        self.restarts += 1
+                    success = await self._start_client()
+                    first = False
+                    self._started.set()
+                    if not success:
+                        logger.warning(
+                            f"MCP服务器 {self.name} 启动失败: {self.last_error}，{delay:.0f}秒后重试"
+                        )
+                        self.next_restart_at = time.time() + delay
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, settings.MCP_SUPERVISOR_RESTART_MAX_DELAY)
+                        continue
+                    logger.info(f"MCP服务器 {self.name} 已启动")
+                    self.next_restart_at = None
+                    delay = settings.MCP_SUPERVISOR_RESTART_MIN_DELAY
+
+                await self._sleep(settings.MCP_SUPERVISOR_INTERVAL)
+                if not await self._ping():
+                    logger.warning(f"MCP服务器 {self.name} {self.last_error}，准备重启")
+                    self.state = ServerState.DOWN
+                    await self._stop_client()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 监管循环本身不能退出
+                logger.error(f"监管MCP服务器 {self.name} 时出错: {str(e)}")
+                self.state = ServerState.DOWN
+                await asyncio.sleep(delay)
+
+    async def connect(self) -> bool:
+        """
+        确保监管任务已启动，并等待首次连接完成
+
+        Returns:
+            服务器当前是否可用
+        """
+        self.start()
+        try:
+            await asyncio.wait_for(
+                self._started.wait(), timeout=settings.MCP_SUPERVISOR_CONNECT_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            pass
+        return self.available
+
+    async def update_available_tools(self) -> Dict[str, Any]:
+        """
+        获取可用工具列表
+
+        Returns:
+            可用工具的字典，服务器不可用时为空
+        """
+        if not self.available:
+            return {}
+        return await self.client.update_available_tools()
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        调用MCP工具，服务器不可用或熔断时快速失败；
+        连接、传输和超时错误计入熔断并提前触发健康检查，工具本身的错误说明服务器仍在响应，不计入熔断
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+
+        Returns:
+            工具执行结果
+
+        Raises:
+            ValueError: 当工具不可用时
+            Exception: 服务器不可用或调用出错时
+        """
+        if self.state != ServerState.UP or not self.clients:
+            raise Exception(f"MCP服务器 {self.name} 暂时不可用")
+        if not self.breaker.allow():
+            raise Exception(
+                f"MCP服务器 {self.name} 暂时不可用，请在 {self.breaker.retry_after()} 秒后重试"
+            )
+
+        # 分给进行中调用最少的客户端
+        clients, in_flight = self.clients, self._in_flight
+        index = min(range(len(clients)), key=in_flight.__getitem__)
+        in_flight[index] += 1
+        started = time.monotonic()
+        try:
+            result = await clients[index].call_tool(tool_name, arguments)
+        except asyncio.CancelledError:
+            self.breaker.record_ignored()
+            raise
+        except ValueError:
+            self.breaker.record_ignored()
+            raise
+        except (ConnectionError, TimeoutError):
+            self.breaker.record_failure()
+            self._wake.set()
+            raise
+        except Exception:
+            # 工具本身的错误（参数错误、工具执行失败等）
+            self.breaker.record_success(time.monotonic() - started)
+            raise
+        finally:
+            in_flight[index] -= 1
+        self.breaker.record_success(time.monotonic() - started)
+        return result
+
+    async def disconnect(self) -> None:
+        """请求结束时调用，连接由监管任务管理，这里不做任何事"""
+
+    async def stop(self) -> None:
+        """停止监管任务并关闭客户端"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._stop_client()
+
+    def metrics(self) -> Dict[str, Any]:
+        """服务器状态"""
+        return {
+            "state": self.state,
+            "available": self.available,
+            "url": self.url,
+            "clients": len(self.clients),
+            "in_flight": sum(self._in_flight),
+            "tools": len(self.available_tools),
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+            "last_ping_at": self.last_ping_at,
+            "next_restart_at": self.next_restart_at,
+            "breaker": self.breaker.metrics(),
+        }
+
+
+class MCPSupervisor:
+    """MCP服务器监管器，每个工作进程一个，按服务器名称管理受监管的服务器"""
+
+    def __init__(self):
+        """初始化MCP服务器监管器"""
+        self._servers: Dict[str, SupervisedMCPServer] = {}
+
+    def get(
+        self, name: str, client_factory: Callable[[], Any], size: int = 1
+    ) -> SupervisedMCPServer:
+        """
+        获取受监管的服务器，不存在时创建并启动监管任务
+
+        Args:
+            name: 服务器名称
+            client_factory: 创建MCP客户端的函数
+            size: 该服务器保持的客户端数
+
+        Returns:
+            受监管的服务器
+        """
+        server = self._servers.get(name)
+        if server is None:
+            server = SupervisedMCPServer(name, client_factory, size)
+            self._servers[name] = server
+            server.start()
+        return server
+
+    async def stop(self) -> None:
+        """停止所有监管任务"""
+        servers, self._servers = self._servers, {}
+        for server in servers.values():
+            await server.stop()
+
+    def metrics(self) -> Dict[str, Any]:
+        """获取所有受监管服务器的状态"""
+        return {name: server.metrics() for name, server in self._servers.items()}
+
+
+# 当前工作进程的全局MCP服务器监管器
+mcp_supervisor = MCPSupervisor()
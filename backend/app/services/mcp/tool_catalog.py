@@ -0,0 +1,139 @@
+"""
+工具目录模块，按服务器集合指纹缓存编译好的OpenAI工具列表，并统计每个工具占用的提示token
+"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from app.core.config import settings
+from app.utils.json_utils import dumps_bytes, dumps_canonical
+from app.utils.token_utils import estimate_tokens
+from .tool_schema import build_openai_tools
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCatalog:
+    """
+    工具目录
+
+    每个服务器的工具列表按内容计算指纹（同一个工具字典对象只计算一次），
+    服务器集合的指纹相同时直接返回缓存的工具列表，不再重复转换和精简Schema
+    """
+
+    def __init__(self, minify: bool = True, max_entries: int = 64):
+        """
+        初始化工具目录
+
+        Args:
+            minify: 是否精简工具参数Schema
+            max_entries: 最多缓存的服务器集合数
+        """
+        self.minify = minify
+        self.max_entries = max_entries
+        # 服务器名称 -> (工具字典, 内容指纹)，保留工具字典引用以便按对象身份复用指纹
+        self._server_fingerprints: Dict[str, Tuple[Dict[str, Any], str]] = {}
+        self._compiled: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._tool_costs: Dict[str, Dict[str, int]] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def _server_fingerprint(self, server_name: str, tools: Dict[str, Any]) -> str:
+        """计算单个服务器工具列表的内容指纹"""
+        cached = self._server_fingerprints.get(server_name)
+        if cached is not None and cached[0] is tools:
+            return cached[1]
+        fingerprint = hashlib.sha256(dumps_canonical(tools)).hexdigest()
+        self._server_fingerprints[server_name] = (tools, fingerprint)
+        return fingerprint
+
+    def compile(self, servers: Sequence[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        获取服务器集合的OpenAI工具列表
+
+        Args:
+            servers: (服务器名称, 可用工具字典) 的序列
+
+        Returns:
+            符合OpenAI API工具格式的列表。列表在请求之间共享，调用方不得修改
+        """
+        digest = hashlib.sha256()
+        for server_name, tools in sorted(servers, key=lambda item: item[0]):
+            digest.update(server_name.encode("utf-8"))
+            digest.update(self._server_fingerprint(server_name, tools).encode("ascii"))
+        fingerprint = digest.hexdigest()
+
+        compiled = self._compiled.get(fingerprint)
+        if compiled is not None:
+            self._compiled.move_to_end(fingerprint)
+            self._hits += 1
+            return compiled
+
+        self._misses += 1
+        collected = [item for _, tools in servers for item in tools.items()]
+        compiled = build_openai_tools(collected, minify=self.minify)
+        self._record_costs(collected, compiled)
+
+        self._compiled[fingerprint] = compiled
+        if len(self._compiled) > self.max_entries:
+            self._compiled.popitem(last=False)
+        return compiled
+
+    def _record_costs(
+        self, collected: List[Tuple[str, Dict[str, Any]]], compiled: List[Dict[str, Any]]
+    ) -> None:
+        """记录每个工具精简前后的估算token数"""
+        raw_by_name = dict(collected)
+        for tool in compiled:
+            name = tool["function"]["name"]
+            raw_info = raw_by_name.get(name, {})
+            raw_tool = {
+                "name": name,
+                "description": raw_info.get("description", ""),
+                "parameters": raw_info.get("inputSchema", {}),
+            }
+            self._tool_costs[name] = {
+                "raw_tokens": estimate_tokens(dumps_bytes(raw_tool).decode("utf-8")),
+                "tokens": estimate_tokens(dumps_bytes(tool["function"]).decode("utf-8")),
+            }
+
+    def tool_cost(self, tool_name: str) -> int:
+        """
+        获取工具的估算token数
+
+        Args:
+            tool_name: 工具名称
+
+        Returns:
+            精简后工具定义的估算token数，未知工具返回0
+        """
+        return self._tool_costs.get(tool_name, {}).get("tokens", 0)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取工具目录指标
+
+        Returns:
+            包含缓存命中情况和按token数降序排列的每工具成本的指标字典
+        """
+        costs = sorted(
+            ({"name": name, **cost} for name, cost in self._tool_costs.items()),
+            key=lambda item: item["tokens"],
+            reverse=True,
+        )
+        return {
+            "minify": self.minify,
+            "entries": len(self._compiled),
+            "hits": self._hits,
+            "misses": self._misses,
+            "tools": costs,
+        }
+
+
+# 当前工作进程的全局工具目录
+tool_catalog = ToolCatalog(
+    minify=settings.MCP_TOOL_SCHEMA_MINIFY,
+    max_entries=settings.MCP_TOOL_CATALOG_CACHE_SIZE,
+)
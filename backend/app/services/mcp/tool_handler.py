@@ -2,13 +2,124 @@
 工具处理模块，负责处理MCP工具调用
 """
 
+import asyncio
 import json
 import logging
-from typing import List, Dict, Any, Tuple
+from typing import Collection, List, Dict, Any, Optional, Tuple
+
+from .json_stream import IncrementalJSONDetector
+from .shared_result import describe_tool_result
 
 logger = logging.getLogger(__name__)
 
 
+class _ToolCallState:
+    """单个流式工具调用的累积状态，参数片段保存在列表中，需要时才拼接"""
+
+    __slots__ = ("id", "name", "fragments", "detector", "_arguments", "_dict")
+
+    def __init__(self):
+        self.id = ""
+        self.name = ""
+        self.fragments: List[str] = []
+        self.detector = IncrementalJSONDetector()
+        self._arguments: Optional[str] = ""
+        self._dict: Optional[Dict[str, Any]] = None
+
+    def add_arguments(self, fragment: str) -> bool:
+        """追加参数片段，返回参数JSON是否因本片段而闭合"""
+        self.fragments.append(fragment)
+        self._arguments = None
+        self._dict = None
+        if self.detector.complete:
+            return False
+        return self.detector.feed(fragment)
+
+    @property
+    def arguments(self) -> str:
+        """完整的参数文本，片段只在首次访问时拼接一次"""
+        if self._arguments is None:
+            self._arguments = "".join(self.fragments)
+        return self._arguments
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为OpenAI格式的工具调用字典，内容未变化时返回同一个字典"""
+        if self._dict is None:
+            self._dict = {
+                "id": self.id,
+                "type": "function",
+                "function": {"name": self.name, "arguments": self.arguments},
+            }
+        return self._dict
+
+
+class ToolCallAccumulator:
+    """
+    流式工具调用累积器
+
+    按工具调用的index索引，每个增量只做O(1)的更新，不复制列表也不拼接字符串；
+    参数JSON闭合的工具调用记录为就绪，供提前执行
+    """
+
+    __slots__ = ("_calls", "_ready")
+
+    def __init__(self):
+        self._calls: Dict[int, _ToolCallState] = {}
+        self._ready: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def add_deltas(self, delta_tool_calls) -> None:
+        """
+        合并一个响应块中的工具调用增量
+
+        Args:
+            delta_tool_calls: 响应块delta中的tool_calls
+        """
+        for delta in delta_tool_calls:
+            state = self._calls.get(delta.index)
+            if state is None:
+                state = self._calls[delta.index] = _ToolCallState()
+                logger.debug(f"模型开始新的工具调用 #{delta.index + 1}")
+
+            if getattr(delta, "id", None):
+                state.id = delta.id
+                state._dict = None
+
+            function = delta.function
+            if function is None:
+                continue
+            if function.name:
+                state.name = function.name
+                state._dict = None
+                logger.debug(f"工具调用 #{delta.index + 1} 使用工具: {function.name}")
+            if function.arguments and state.add_arguments(function.arguments):
+                self._ready.append(delta.index)
+
+    def pop_ready(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        取出自上次调用以来参数JSON已闭合的工具调用
+
+        Returns:
+            (工具调用序号, 工具调用字典) 列表
+        """
+        if not self._ready:
+            return []
+        ready = [(index, self._calls[index].to_dict()) for index in self._ready]
+        self._ready.clear()
+        return ready
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """
+        按index顺序导出所有工具调用
+
+        Returns:
+            OpenAI格式的工具调用列表
+        """
+        return [self._calls[index].to_dict() for index in sorted(self._calls)]
+
+
 class ToolHandler:
     """工具处理器，负责处理工具调用"""
 
@@ -20,66 +131,74 @@ class ToolHandler:
             mcp_service: MCP服务实例
         """
         self.mcp_service = mcp_service
+        # 当前一轮模型输出的工具调用累积器
+        self.accumulator = ToolCallAccumulator()
+        # 工具调用序号 -> (提前执行的任务, 执行时的参数)
+        self._pending: Dict[int, Tuple[asyncio.Task, str]] = {}
 
-    async def update_tool_calls(
-        self, chunk, existing_tool_calls: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
+    def reset(self) -> None:
+        """开始新一轮模型输出前重置状态，取消尚未使用的提前执行任务"""
+        self.cancel_pending()
+        self.accumulator = ToolCallAccumulator()
+
+    def cancel_pending(self) -> None:
+        """取消所有提前执行的工具调用任务"""
+        for task, _ in self._pending.values():
+            task.cancel()
+        self._pending.clear()
+
+    def update_tool_calls(self, chunk) -> None:
         """
-        更新工具调用信息
-        
+        将响应块中的工具调用增量合并到累积器
+
         Args:
             chunk: 响应块
-            existing_tool_calls: 现有的工具调用列表
-            
+        """
+        delta_tool_calls = getattr(chunk.choices[0].delta, "tool_calls", None)
+        if delta_tool_calls:
+            self.accumulator.add_deltas(delta_tool_calls)
+
+    def get_tool_calls(self) -> List[Dict[str, Any]]:
+        """
+        获取当前累积的完整工具调用列表
+
         Returns:
-            更新后的工具调用列表
+            OpenAI格式的工具调用列表
         """
-        if not hasattr(chunk.choices[0].delta, "tool_calls"):
-            return existing_tool_calls
-            
-        updated_tool_calls = existing_tool_calls.copy()
-        
-        for tool_call in chunk.choices[0].delta.tool_calls:
-            # 查找或创建工具调用
-            if tool_call.index >= len(updated_tool_calls):
-                # 新的工具调用
-                new_tool_call = {
-                    "id": tool_call.id
-                    if hasattr(tool_call, "id") and tool_call.id
-                    else "",
-                    "type": "function",
-                    "function": {"name": "", "arguments": ""},
-                }
-                updated_tool_calls.append(new_tool_call)
-                logger.info(f"模型开始新的工具调用 #{tool_call.index + 1}")
-
-            # 更新工具调用信息
-            if (
-                hasattr(tool_call.function, "name")
-                and tool_call.function.name
-            ):
-                updated_tool_calls[tool_call.index]["function"]["name"] = (
-                    tool_call.function.name
-                )
-                logger.info(
-                    f"工具调用 #{tool_call.index + 1} 使用工具: {tool_call.function.name}"
-                )
+        return self.accumulator.to_list()
 
-            if (
-                hasattr(tool_call.function, "arguments")
-                and tool_call.function.arguments
-            ):
-                updated_tool_calls[tool_call.index]["function"]["arguments"] += (
-                    tool_call.function.arguments
-                )
-                
-        return updated_tool_calls
+    def dispatch_ready(
+        self, allowed_names: Optional[Collection[str]] = None
+    ) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        参数JSON已闭合的工具调用立即开始执行，与模型继续生成后续内容重叠
+
+        Args:
+            allowed_names: 允许提前执行的工具名称，None表示不限制
+
+        Returns:
+            本次新开始执行的 (工具调用序号, 工具调用) 列表
+        """
+        dispatched = []
+        for index, tool_call in self.accumulator.pop_ready():
+            if index in self._pending:
+                continue
+            tool_name = tool_call["function"]["name"]
+            if not tool_name or (allowed_names is not None and tool_name not in allowed_names):
+                continue
+
+            arguments = tool_call["function"]["arguments"]
+            task = asyncio.create_task(self._execute_tool_call(tool_call))
+            self._pending[index] = (task, arguments)
+            dispatched.append((index, tool_call))
+            logger.info(f"工具调用 #{index + 1} ({tool_name}) 参数已完整，提前开始执行")
+        return dispatched
 
     async def process_tool_calls(
         self, tool_calls: List[Dict[str, Any]]
     ) -> List[Tuple[Dict[str, Any], str]]:
         """
-        处理工具调用并获取结果
+        处理工具调用并获取结果，已提前执行的工具调用直接等待其结果
         
         Args:
             tool_calls: 工具调用列表
@@ -89,38 +208,57 @@ class ToolHandler:
         """
         logger.info(f"处理 {len(tool_calls)} 个工具调用")
         results = []
-        
-        for tool_call in tool_calls:
-            try:
-                tool_name = tool_call["function"]["name"]
-                arguments_json = tool_call["function"]["arguments"]
-
-                # 解析参数
-                try:
-                    arguments = json.loads(arguments_json)
-                except json.JSONDecodeError:
-                    logger.error(f"无法解析工具参数: {arguments_json}")
-                    result = f"Error: 无法解析工具参数: {arguments_json}"
-                    results.append((tool_call, result))
+
+        for index, tool_call in enumerate(tool_calls):
+            pending = self._pending.pop(index, None)
+            if pending is not None:
+                task, arguments = pending
+                if arguments == tool_call["function"]["arguments"]:
+                    # 使用提前执行的结果
+                    results.append((tool_call, await task))
                     continue
+                # 提前执行后参数又发生变化，丢弃旧结果重新执行
+                task.cancel()
+            results.append((tool_call, await self._execute_tool_call(tool_call)))
+
+        return results
+
+    async def _execute_tool_call(self, tool_call: Dict[str, Any]) -> str:
+        """
+        执行单个工具调用
+
+        Args:
+            tool_call: 工具调用
+
+        Returns:
+            工具执行结果，出错时返回以Error开头的错误信息
+        """
+        try:
+            tool_name = tool_call["function"]["name"]
+            arguments_json = tool_call["function"]["arguments"]
+
+            # 解析参数
+            try:
+                arguments = json.loads(arguments_json)
+            except json.JSONDecodeError:
+                logger.error(f"无法解析工具参数: {arguments_json}")
+                return f"Error: 无法解析工具参数: {arguments_json}"
+
+            # 调用工具
+            try:
+                result = await self.mcp_service.call_tool(
+                    tool_name, arguments
+                )
+                logger.info(f"工具 {tool_name} 返回结果: {describe_tool_result(result)}")
+            except Exception as tool_error:
+                logger.error(
+                    f"调用工具 '{tool_name}' 时出错: {str(tool_error)}"
+                )
+                # 将错误信息作为工具调用结果返回
+                result = f"Error: {str(tool_error)}"
+
+            return result
 
-                # 调用工具
-                try:
-                    result = await self.mcp_service.call_tool(
-                        tool_name, arguments
-                    )
-                    logger.info(f"工具 {tool_name} 返回结果: {result}")
-                except Exception as tool_error:
-                    logger.error(
-                        f"调用工具 '{tool_name}' 时出错: {str(tool_error)}"
-                    )
-                    # 将错误信息作为工具调用结果返回
-                    result = f"Error: {str(tool_error)}"
-                
-                results.append((tool_call, result))
-                
-            except Exception as e:
-                logger.error(f"处理工具调用时出错: {str(e)}")
-                results.append((tool_call, f"Error: {str(e)}"))
-                
-        return results 
\ No newline at end of file
+        except Exception as e:
+            logger.error(f"处理工具调用时出错: {str(e)}")
+            return f"Error: {str(e)}"
@@ -0,0 +1,201 @@
+"""
+MCP工具列表缓存模块，在当前工作进程内按服务器配置共享工具列表，
+TTL过期后先返回旧列表并在后台刷新（stale-while-revalidate），
+服务器发送tools/list_changed通知时立即作废，使获取工具列表离开请求路径
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 从MCP服务器获取工具列表的函数
+ToolsFetcher = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class _Entry:
+    """单个服务器的缓存条目"""
+
+    __slots__ = ("tools", "fetched_at", "invalidated")
+
+    def __init__(self, tools: Dict[str, Any]):
+        self.tools = tools
+        self.fetched_at = time.monotonic()
+        self.invalidated = False
+
+
+class ToolListCache:
+    """
+    MCP工具列表缓存
+
+    每个请求创建的客户端都从这里读取工具列表，只有从未获取过（或过期太久）的服务器
+    才在请求中向服务器获取；过期或被作废的列表继续使用，同时由当前可用的客户端在后台刷新，
+    同一服务器同一时间只有一个刷新任务
+    """
+
+    def __init__(self, ttl: float = 300.0, max_stale: float = 3600.0, max_entries: int = 256):
+        """
+        初始化工具列表缓存
+
+        Args:
+            ttl: 工具列表的新鲜时间（秒），超过后在后台刷新
+            max_stale: 过期的工具列表最多继续使用的时间（秒），超过后在请求中重新获取
+            max_entries: 最多缓存的服务器数
+        """
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._refresh_errors = 0
+        self._invalidations = 0
+
+    def get(self, key: str, fetcher: Optional[ToolsFetcher] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取缓存的工具列表，列表过期或被作废时用fetcher在后台刷新
+
+        Args:
+            key: 缓存键（server_key计算的服务器标识）
+            fetcher: 获取最新工具列表的函数，为None时只读缓存
+
+        Returns:
+            工具字典，没有可用缓存时返回None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+
+        age = time.monotonic() - entry.fetched_at
+        if age > self.max_stale:
+            del self._entries[key]
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if entry.invalidated or age > self.ttl:
+            self._stale_hits += 1
+            if fetcher is not None:
+                self.refresh_in_background(key, fetcher)
+        else:
+            self._hits += 1
+        return entry.tools
+
+    def refresh_if_stale(self, key: str, fetcher: ToolsFetcher) -> None:
+        """
+        工具列表过期、被作废或已不在缓存中时在后台刷新，
+        用于读取缓存时还没有可用连接、连接建立后再补充刷新的场景
+
+        Args:
+            key: 缓存键
+            fetcher: 获取最新工具列表的函数
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.invalidated or time.monotonic() - entry.fetched_at > self.ttl:
+            self.refresh_in_background(key, fetcher)
+
+    def put(self, key: str, tools: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        写入工具列表，内容未变时保留原字典，使工具目录可以按对象身份复用指纹
+
+        Args:
+            key: 缓存键
+            tools: 工具字典
+
+        Returns:
+            缓存中的工具字典
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.tools == tools:
+            entry.fetched_at = time.monotonic()
+            entry.invalidated = False
+            tools = entry.tools
+        else:
+            self._entries[key] = _Entry(tools)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return tools
+
+    def invalidate(self, key: str, fetcher: Optional[ToolsFetcher] = None) -> None:
+        """
+        作废工具列表（服务器通知工具列表已变化时调用），旧列表在刷新完成前继续使用
+
+        Args:
+            key: 缓存键
+            fetcher: 获取最新工具列表的函数，提供时立即在后台刷新
+        """
+        self._invalidations += 1
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.invalidated = True
+        if fetcher is not None:
+            self.refresh_in_background(key, fetcher, force=True)
+
+    def refresh_in_background(self, key: str, fetcher: ToolsFetcher, force: bool = False) -> None:
+        """
+        在后台刷新工具列表，同一服务器已有刷新任务时不重复刷新
+
+        Args:
+            key: 缓存键
+            fetcher: 获取最新工具列表的函数
+            force: 已有刷新任务时是否在其结束后再刷新一次（通知可能晚于正在进行的刷新）
+        """
+        running = self._refreshing.get(key)
+        if running is not None and not running.done():
+            if force:
+                running.add_done_callback(
+                    lambda _: self.refresh_in_background(key, fetcher)
+                )
+            return
+        self._refreshing[key] = asyncio.create_task(self._refresh(key, fetcher))
+
+    async def _refresh(self, key: str, fetcher: ToolsFetcher) -> None:
+        """执行一次后台刷新，失败时保留旧列表"""
+        try:
+            tools = await fetcher()
+            self.put(key, tools)
+            self._refreshes += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._refresh_errors += 1
+            logger.warning(f"后台刷新MCP工具列表失败，继续使用旧列表: {str(e)}")
+        finally:
+            if self._refreshing.get(key) is asyncio.current_task():
+                del self._refreshing[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取缓存指标
+
+        Returns:
+            包含条目数、命中、过期命中、未命中和后台刷新次数的指标字典
+        """
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "stale_hits": self._stale_hits,
+            "misses": self._misses,
+            "refreshes": self._refreshes,
+            "refresh_errors": self._refresh_errors,
+            "invalidations": self._invalidations,
+            "refreshing": len(self._refreshing),
+        }
+
+
+# 当前工作进程共享的MCP工具列表缓存
+tool_list_cache = ToolListCache(
+    ttl=settings.MCP_TOOLS_CACHE_TTL,
+    max_stale=settings.MCP_TOOLS_CACHE_MAX_STALE,
+    max_entries=settings.MCP_TOOLS_CACHE_SIZE,
+)
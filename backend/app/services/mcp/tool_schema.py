@@ -0,0 +1,129 @@
+"""
+工具Schema处理模块，将MCP工具信息转换为确定性的OpenAI工具格式，
+保证相同的工具集合总是序列化为相同的字节，以便命中上游的上下文前缀缓存
+"""
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def canonicalize_schema(value: Any) -> Any:
+    """
+    递归地按键排序JSON Schema中的字典，列表保持原有顺序
+
+    Args:
+        value: JSON Schema或其中的任意节点
+
+    Returns:
+        键有序的新结构
+    """
+    if isinstance(value, dict):
+        return {key: canonicalize_schema(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        return [canonicalize_schema(item) for item in value]
+    return value
+
+
+# 只作为说明、不影响参数校验的Schema关键字，发送给模型前去除以减少提示token
+_ANNOTATION_KEYWORDS = frozenset({"title", "examples", "example", "$schema", "$comment"})
+
+# 值为“名称 -> 子Schema”映射的关键字，映射的键是属性名而不是Schema关键字
+_SCHEMA_MAP_KEYWORDS = frozenset({"properties", "patternProperties", "$defs", "definitions"})
+
+
+def minify_schema(schema: Any) -> Any:
+    """
+    精简JSON Schema：去除标题、示例等说明性关键字，并折叠冗余的anyOf
+
+    Args:
+        schema: JSON Schema或其中的任意节点
+
+    Returns:
+        精简后的新结构
+    """
+    if isinstance(schema, list):
+        return [minify_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    result: Dict[str, Any] = {}
+    for key, value in schema.items():
+        if key in _ANNOTATION_KEYWORDS:
+            continue
+        if key in _SCHEMA_MAP_KEYWORDS and isinstance(value, dict):
+            result[key] = {name: minify_schema(sub) for name, sub in value.items()}
+        else:
+            result[key] = minify_schema(value)
+
+    any_of = result.get("anyOf")
+    if isinstance(any_of, list):
+        collapsed = _collapse_any_of(any_of)
+        if collapsed is not None:
+            del result["anyOf"]
+            for key, value in collapsed.items():
+                result.setdefault(key, value)
+    return result
+
+
+def _collapse_any_of(options: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    折叠冗余的anyOf
+
+    去重后只剩一个选项时直接使用该选项；所有选项都只声明了type时合并为类型列表，
+    例如 anyOf: [{"type": "string"}, {"type": "null"}] 折叠为 type: ["string", "null"]
+
+    Args:
+        options: anyOf的选项列表
+
+    Returns:
+        可以合并到父Schema的关键字，无法折叠时返回None
+    """
+    unique: List[Any] = []
+    for option in options:
+        if option not in unique:
+            unique.append(option)
+
+    if len(unique) == 1 and isinstance(unique[0], dict):
+        return unique[0]
+
+    if all(isinstance(option, dict) and set(option) == {"type"} for option in unique):
+        types: List[Any] = []
+        for option in unique:
+            option_types = option["type"] if isinstance(option["type"], list) else [option["type"]]
+            types.extend(t for t in option_types if t not in types)
+        return {"type": types}
+
+    return None
+
+
+def build_openai_tools(
+    tools: Iterable[Tuple[str, Dict[str, Any]]], minify: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    将(工具名称, 工具信息)序列转换为按名称排序的OpenAI API工具列表
+
+    Args:
+        tools: (工具名称, MCP工具信息) 的序列，工具信息包含description和inputSchema
+        minify: 是否精简参数Schema
+
+    Returns:
+        符合OpenAI API工具格式的列表
+    """
+    result = []
+    for tool_name, tool_info in sorted(tools, key=lambda item: item[0]):
+        parameters = tool_info.get("inputSchema", {})
+        if minify:
+            parameters = minify_schema(parameters)
+        result.append(
+            {
+                "type": "function",
+                "function": {
+                    "name": tool_name,
+                    "description": tool_info.get("description", ""),
+                    "parameters": canonicalize_schema(parameters),
+                },
+            }
+        )
+    return result
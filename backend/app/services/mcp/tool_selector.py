@@ -0,0 +1,188 @@
+"""
+工具子集选择模块，基于工具名称和描述建立倒排索引，
+用BM25按最近的用户消息为工具打分，只把最相关的top-k个工具发送给模型
+"""
+
+import logging
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 英文单词、数字和连续的中日韩字符
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+
+# 驼峰命名的单词边界
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为检索词
+
+    英文按单词切分（驼峰和下划线命名会拆开），中文按单字和相邻二字切分
+
+    Args:
+        text: 要切分的文本
+
+    Returns:
+        检索词列表
+    """
+    terms: List[str] = []
+    for token in _TOKEN_RE.findall(_CAMEL_RE.sub(" ", text).lower()):
+        if token[0] < "\u4e00":
+            terms.append(token)
+            continue
+        terms.extend(token)
+        terms.extend(token[i : i + 2] for i in range(len(token) - 1))
+    return terms
+
+
+class BM25Index:
+    """工具名称和描述上的BM25倒排索引"""
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        """
+        建立索引
+
+        Args:
+            documents: 每个工具的可检索文本，顺序与工具列表一致
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self._lengths: List[int] = []
+        # 检索词 -> [(文档序号, 词频)]
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+
+        for doc_id, text in enumerate(documents):
+            counts = Counter(tokenize(text))
+            self._lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                self._postings.setdefault(term, []).append((doc_id, freq))
+
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    def score(self, query: str) -> List[float]:
+        """
+        计算查询对每个文档的BM25得分
+
+        Args:
+            query: 查询文本
+
+        Returns:
+            按文档序号排列的得分列表
+        """
+        scores = [0.0] * len(self._lengths)
+        total = len(self._lengths)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return scores
+
+
+class ToolSelector:
+    """
+    工具子集选择器
+
+    索引按工具列表对象缓存（工具目录对相同的服务器集合返回同一个列表），
+    工具数不超过top_k、或查询与所有工具都不相关时发送完整工具列表
+    """
+
+    def __init__(
+        self,
+        top_k: int = 0,
+        always_include: Optional[Iterable[str]] = None,
+        query_messages: int = 3,
+        max_indexes: int = 64,
+    ):
+        """
+        初始化工具子集选择器
+
+        Args:
+            top_k: 发送给模型的工具数，0表示不做选择
+            always_include: 总是发送的工具名称
+            query_messages: 参与打分的最近用户消息数
+            max_indexes: 最多缓存的索引数
+        """
+        self.top_k = top_k
+        self.always_include = set(always_include or [])
+        self.query_messages = query_messages
+        self.max_indexes = max_indexes
+        # id(工具列表) -> (工具列表, 索引)，保留列表引用以保证id不被复用
+        self._indexes: "OrderedDict[int, Tuple[List[Dict[str, Any]], BM25Index]]" = OrderedDict()
+
+    def _get_index(self, tools: List[Dict[str, Any]]) -> BM25Index:
+        """获取工具列表的索引，不存在时建立"""
+        key = id(tools)
+        cached = self._indexes.get(key)
+        if cached is not None and cached[0] is tools:
+            self._indexes.move_to_end(key)
+            return cached[1]
+
+        index = BM25Index(
+            [
+                f"{tool['function']['name']} {tool['function'].get('description', '')}"
+                for tool in tools
+            ]
+        )
+        self._indexes[key] = (tools, index)
+        if len(self._indexes) > self.max_indexes:
+            self._indexes.popitem(last=False)
+        return index
+
+    def select(
+        self, tools: List[Dict[str, Any]], messages: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        按最近的用户消息选择最相关的工具
+
+        Args:
+            tools: 完整的OpenAI工具列表
+            messages: 聊天消息列表
+
+        Returns:
+            工具子集，保持完整列表中的相对顺序；无需选择时返回完整列表本身
+        """
+        if self.top_k <= 0 or len(tools) <= self.top_k:
+            return tools
+
+        user_texts = [
+            msg["content"]
+            for msg in messages
+            if msg.get("role") == "user" and isinstance(msg.get("content"), str)
+        ]
+        query = " ".join(user_texts[-self.query_messages :])
+        scores = self._get_index(tools).score(query)
+        if not any(scores):
+            return tools
+
+        ranked = sorted(range(len(tools)), key=lambda i: scores[i], reverse=True)
+        chosen = {i for i in ranked[: self.top_k] if scores[i] > 0}
+        chosen.update(
+            i for i, tool in enumerate(tools) if tool["function"]["name"] in self.always_include
+        )
+        selected = [tool for i, tool in enumerate(tools) if i in chosen]
+        logger.debug(
+            f"工具子集选择: {len(selected)}/{len(tools)} 个工具，"
+            f"{[tool['function']['name'] for tool in selected]}"
+        )
+        return selected
+
+
+# 当前工作进程的全局工具子集选择器
+tool_selector = ToolSelector(
+    top_k=settings.MCP_TOOL_SELECTION_TOP_K,
+    always_include=settings.MCP_TOOL_ALWAYS_INCLUDE,
+    query_messages=settings.MCP_TOOL_SELECTION_QUERY_MESSAGES,
+)
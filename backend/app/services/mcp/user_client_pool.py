@@ -0,0 +1,392 @@
+"""
+用户MCP客户端池模块，按服务器配置（URL、环境变量、传输类型）的哈希在工作进程内复用用户自定义的MCP客户端，
+相同配置的请求（包括不同用户）共享已连接的客户端，并限制每个用户和整个池的客户端数，空闲客户端自动关闭
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _PoolEntry:
+    """池中的一个客户端"""
+
+    def __init__(self, key: str, url: str, client: Any):
+        self.key = key
+        self.url = url
+        self.client = client
+        self.users: Set[Hashable] = set()  # 持有该客户端的用户
+        self.leases = 0  # 正在使用该客户端的请求数
+        self.connected = False
+        self.lock = asyncio.Lock()
+        self.created_at = time.monotonic()
+        self.last_used = time.monotonic()
+
+
+class UserMCPClientPool:
+    """
+    用户MCP客户端池
+
+    池按server_key（URL、传输类型和环境变量的哈希，环境变量中的密钥不以明文出现）索引客户端；
+    每个用户最多持有max_per_user个不同配置，超出时释放该用户最久未用的配置；
+    池中客户端总数超过max_clients时关闭全池最久未用的空闲客户端；
+    没有可释放的空闲客户端时本次请求使用不入池的临时客户端
+    """
+
+    def __init__(self, max_clients: int = 64, max_per_user: int = 4, idle_timeout: float = 600.0):
+        """
+        初始化用户MCP客户端池
+
+        Args:
+            max_clients: 池中最多保持的客户端数（每个客户端对应一个工作进程或会话）
+            max_per_user: 每个用户最多持有的不同服务器配置数
+            idle_timeout: 客户端空闲超过该时间（秒）后关闭
+        """
+        self.max_clients = max_clients
+        self.max_per_user = max_per_user
+        self.idle_timeout = idle_timeout
+        self._entries: "OrderedDict[str, _PoolEntry]" = OrderedDict()
+        # 用户 -> 按最近使用排序的服务器配置标识
+        self._user_keys: Dict[Hashable, "OrderedDict[str, None]"] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        self._hits = 0
+        self._misses = 0
+        self._unpooled = 0
+        self._evictions = {"idle": 0, "lru": 0, "user_cap": 0, "broken": 0}
+
+    def lease(
+        self,
+        user_id: Optional[Hashable],
+        key: str,
+        url: str,
+        transport_type: str,
+        client_factory: Callable[[], Any],
+    ) -> "PooledMCPClient":
+        """
+        创建客户端租约，调用connect时从池中取得客户端，调用disconnect时归还
+
+        Args:
+            user_id: 用户ID
+            key: 服务器配置标识（server_key）
+            url: MCP服务器URL
+            transport_type: 传输类型
+            client_factory: 创建（未连接的）MCP客户端的函数
+
+        Returns:
+            接口与MultiprocessMCPClientService一致的客户端租约
+        """
+        return PooledMCPClient(self, user_id, key, url, transport_type, client_factory)
+
+    async def _close_entry(self, entry: _PoolEntry, reason: str) -> None:
+        """从池中移除并关闭客户端"""
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        for user_id in entry.users:
+            keys = self._user_keys.get(user_id)
+            if keys is not None:
+                keys.pop(entry.key, None)
+                if not keys:
+                    del self._user_keys[user_id]
+        entry.users.clear()
+        self._evictions[reason] += 1
+        logger.info(f"关闭用户MCP客户端: {entry.url}（{reason}）")
+        try:
+            await asyncio.wait_for(entry.client.disconnect(), timeout=5.0)
+        except Exception as e:
+            logger.warning(f"关闭用户MCP客户端 {entry.url} 时出错: {str(e)}")
+
+    async def _admit_user(self, user_id: Optional[Hashable], key: str) -> bool:
+        """让用户持有该配置，超出每用户上限时释放该用户最久未用的空闲配置"""
+        keys = self._user_keys.setdefault(user_id, OrderedDict())
+        if key in keys:
+            keys.move_to_end(key)
+            return True
+
+        if len(keys) >= self.max_per_user:
+            victim = next(
+                (k for k in keys if self._entries.get(k) is None or self._entries[k].leases == 0),
+                None,
+            )
+            if victim is None:
+                return False
+            del keys[victim]
+            entry = self._entries.get(victim)
+            if entry is not None:
+                entry.users.discard(user_id)
+                if not entry.users:
+                    await self._close_entry(entry, "user_cap")
+
+        keys[key] = None
+        return True
+
+    async def _make_room(self) -> bool:
+        """池满时关闭全池最久未用的空闲客户端"""
+        while len(self._entries) >= self.max_clients:
+            victim = next((e for e in self._entries.values() if e.leases == 0), None)
+            if victim is None:
+                return False
+            await self._close_entry(victim, "lru")
+        return True
+
+    async def _is_healthy(self, entry: _PoolEntry) -> bool:
+        """检查已连接的客户端是否仍可用（工作进程退出后工具列表为空）"""
+        try:
+            return bool(await entry.client.update_available_tools())
+        except Exception:
+            return False
+
+    async def acquire(
+        self,
+        user_id: Optional[Hashable],
+        key: str,
+        url: str,
+        client_factory: Callable[[], Any],
+    ) -> Optional[Any]:
+        """
+        取得已连接的客户端，相同配置并发请求时只连接一次
+
+        Args:
+            user_id: 用户ID
+            key: 服务器配置标识
+            url: MCP服务器URL
+            client_factory: 创建MCP客户端的函数
+
+        Returns:
+            已连接的客户端，池已满（所有客户端都在使用中）时返回None
+
+        Raises:
+            ConnectionError: 连接MCP服务器失败时
+        """
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.connected and entry.leases == 0:
+            if not await self._is_healthy(entry):
+                await self._close_entry(entry, "broken")
+                entry = None
+
+        if not await self._admit_user(user_id, key):
+            self._unpooled += 1
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            if not await self._make_room():
+                self._user_keys[user_id].pop(key, None)
+                self._unpooled += 1
+                return None
+            # 关闭其他客户端期间，相同配置的并发请求可能已经创建了客户端
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = _PoolEntry(key, url, client_factory())
+            self._entries[key] = entry
+            self._misses += 1
+        else:
+            self._hits += 1
+        self._entries.move_to_end(key)
+        entry.users.add(user_id)
+        entry.leases += 1
+        entry.last_used = time.monotonic()
+
+        try:
+            async with entry.lock:
+                if self._entries.get(key) is not entry:
+                    # 等待期间其他请求连接失败，客户端已被移除
+                    raise ConnectionError(f"无法连接到MCP服务器: {url}")
+                if not entry.connected:
+                    entry.connected = await entry.client.connect()
+                    if not entry.connected:
+                        await self._close_entry(entry, "broken")
+                        raise ConnectionError(f"无法连接到MCP服务器: {url}")
+        except BaseException:
+            entry.leases -= 1
+            raise
+        return entry.client
+
+    def release(self, key: str, client: Any) -> None:
+        """
+        归还客户端
+
+        Args:
+            key: 服务器配置标识
+            client: acquire返回的客户端
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.client is not client:
+            return
+        entry.leases = max(entry.leases - 1, 0)
+        entry.last_used = time.monotonic()
+
+    async def _reap_idle(self) -> None:
+        """定期关闭空闲的客户端"""
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1.0))
+            now = time.monotonic()
+            for entry in list(self._entries.values()):
+                if entry.leases == 0 and now - entry.last_used > self.idle_timeout:
+                    await self._close_entry(entry, "idle")
+
+    async def stop(self) -> None:
+        """停止空闲回收任务并关闭池中所有客户端"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for entry in list(self._entries.values()):
+            await self._close_entry(entry, "idle")
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取池指标，各客户端只以服务器配置标识的前缀区分，不包含URL和环境变量：
+        指标对所有登录用户可见，URL可能暴露其他用户的私有MCP服务器地址，环境变量可能含有密钥
+
+        Returns:
+            包含客户端数、用户数、命中、淘汰次数和各客户端状态的指标字典
+        """
+        now = time.monotonic()
+        return {
+            "clients": len(self._entries),
+            "users": len(self._user_keys),
+            "hits": self._hits,
+            "misses": self._misses,
+            "unpooled": self._unpooled,
+            "evictions": dict(self._evictions),
+            "entries": [
+                {
+                    "server": entry.key[:12],
+                    "users": len(entry.users),
+                    "leases": entry.leases,
+                    "idle_seconds": round(now - entry.last_used, 1),
+                }
+                for entry in self._entries.values()
+            ],
+        }
+
+
+class PooledMCPClient:
+    """用户MCP客户端租约，接口与MultiprocessMCPClientService一致，可直接放入MCPServiceManager"""
+
+    def __init__(
+        self,
+        pool: UserMCPClientPool,
+        user_id: Optional[Hashable],
+        key: str,
+        url: str,
+        transport_type: str,
+        client_factory: Callable[[], Any],
+    ):
+        """
+        初始化客户端租约
+
+        Args:
+            pool: 用户MCP客户端池
+            user_id: 用户ID
+            key: 服务器配置标识
+            url: MCP服务器URL
+            transport_type: 传输类型
+            client_factory: 创建MCP客户端的函数
+        """
+        self.pool = pool
+        self.user_id = user_id
+        self.key = key
+        self.url = url
+        self.transport_type = transport_type
+        self.client_factory = client_factory
+        self.client: Optional[Any] = None
+        self.pooled = False
+
+    @property
+    def available_tools(self) -> Dict[str, Any]:
+        """可用工具列表"""
+        return self.client.available_tools if self.client is not None else {}
+
+    async def connect(self) -> bool:
+        """
+        从池中取得已连接的客户端，池已满时连接一个只用于本次请求的临时客户端
+
+        Returns:
+            连接是否成功
+        """
+        if self.client is not None:
+            return True
+        try:
+            client = await self.pool.acquire(self.user_id, self.key, self.url, self.client_factory)
+        except ConnectionError as e:
+            logger.error(str(e))
+            return False
+        if client is not None:
+            self.client, self.pooled = client, True
+            return True
+
+        logger.info(f"用户MCP客户端池无可用位置，使用临时客户端: {self.url}")
+        self.client, self.pooled = self.client_factory(), False
+        if not await self.client.connect():
+            self.client = None
+            return False
+        return True
+
+    async def update_available_tools(self) -> Dict[str, Any]:
+        """
+        获取可用工具列表
+
+        Returns:
+            可用工具的字典
+        """
+        if self.client is None:
+            return {}
+        return await self.client.update_available_tools()
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        调用MCP工具
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+
+        Returns:
+            工具执行结果
+
+        Raises:
+            ValueError: 当客户端未连接或工具不可用时
+            Exception: 调用工具过程中的其他错误
+        """
+        if self.client is None:
+            raise ValueError("MCP客户端未连接")
+        return await self.client.call_tool(tool_name, arguments)
+
+    async def ping(self) -> None:
+        """
+        向MCP服务器发送ping
+
+        Raises:
+            ValueError: 客户端未连接时
+            Exception: ping失败时
+        """
+        if self.client is None:
+            raise ValueError("MCP客户端未连接")
+        await self.client.ping()
+
+    async def disconnect(self) -> None:
+        """请求结束时调用，池中的客户端归还给池，临时客户端直接关闭"""
+        client, self.client = self.client, None
+        if client is None:
+            return
+        if self.pooled:
+            self.pool.release(self.key, client)
+        else:
+            await client.disconnect()
+
+
+# 当前工作进程的用户MCP客户端池
+user_client_pool = UserMCPClientPool(
+    max_clients=settings.MCP_USER_POOL_MAX_CLIENTS,
+    max_per_user=settings.MCP_USER_POOL_MAX_PER_USER,
+    idle_timeout=settings.MCP_USER_POOL_IDLE_TIMEOUT,
+)
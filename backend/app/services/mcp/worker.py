@@ -1,6 +1,6 @@
 """
 MCP工作进程模块，处理MCP客户端连接和工具调用
-支持SSE和Streamable HTTP传输
+支持SSE和Streamable HTTP传输，工作进程可以预先启动并在需要时分配给服务器
 """
 
 import os
@@ -9,11 +9,12 @@ import logging
 import asyncio
 import queue
 import traceback
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Optional
 from multiprocessing import Queue
-from contextlib import AsyncExitStack
 
-from .models import MCPToolResponse, MCPTransportType
+from .models import MCPAssignRequest, MCPToolResponse, MCPTransportType
+from .session import MCPSession, is_transport_error
+from .shared_result import share_tool_result
 
 
 def mcp_worker_process(
@@ -23,6 +24,9 @@ def mcp_worker_process(
     response_queue: Queue,
     shutdown_event,
     transport_type: str = MCPTransportType.SSE,
+    tools: Optional[Dict[str, Any]] = None,
+    tools_changed=None,
+    result_shm_threshold: int = 0,
 ):
     """
     MCP工作进程，处理工具调用请求
@@ -34,10 +38,10 @@ def mcp_worker_process(
         response_queue: 响应队列
         shutdown_event: 关闭事件
         transport_type: 传输类型，可以是"sse"或"streamable-http"
+        tools: 主进程缓存的工具列表，提供时连接后不再向服务器获取
+        tools_changed: 服务器通知工具列表已变化时设置的事件
+        result_shm_threshold: 工具结果不小于该字节数时通过共享内存返回，0表示不使用
     """
-    from mcp import ClientSession
-    from mcp.client.sse import sse_client
-    
     # 配置日志
     logger = logging.getLogger(f"mcp_worker_{os.getpid()}")
     logger.setLevel(logging.INFO)
@@ -46,73 +50,20 @@ def mcp_worker_process(
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    # 会话和工具信息
-    session = None
-    available_tools = {}
-    exit_stack = AsyncExitStack()
-
-    # 获取请求头
-    def get_headers():
-        headers = {}
-        for key, value in env.items():
-            headers[key] = value
-        return headers
+    # MCP会话
+    session = MCPSession(
+        url,
+        env,
+        transport_type,
+        on_tools_changed=tools_changed.set if tools_changed is not None else None,
+    )
 
     # 连接到MCP服务器
     async def connect():
-        nonlocal session, available_tools, exit_stack
-
         try:
             logger.info(f"进程 {os.getpid()} 连接到 {transport_type} endpoint: {url}")
-
-            # 根据传输类型选择不同的连接方式
-            if transport_type == MCPTransportType.SSE:
-                # 使用SSE客户端连接到服务器
-                streams_context = sse_client(url=url, headers=get_headers())
-                streams = await exit_stack.enter_async_context(streams_context)
-
-                # 创建会话
-                session_context = ClientSession(*streams)
-                session = await exit_stack.enter_async_context(session_context)
-            
-            elif transport_type == MCPTransportType.STREAMABLE_HTTP:
-                # 使用Streamable HTTP客户端连接到服务器
-                try:
-                    # 从streamable_http模块导入客户端函数
-                    from mcp.client.streamable_http import streamablehttp_client
-                    logger.info(f"成功导入streamablehttp_client函数")
-                    
-                    # 创建streamable_http会话
-                    stream_context = streamablehttp_client(url=url, headers=get_headers())
-                    streams = await exit_stack.enter_async_context(stream_context)
-                    
-                    # 根据streamablehttp_client返回的三元组创建会话
-                    read_stream, write_stream, _ = streams
-                    session_context = ClientSession(read_stream, write_stream)
-                    session = await exit_stack.enter_async_context(session_context)
-                except ImportError as ie:
-                    # 打印详细的导入错误信息
-                    logger.error(f"导入streamable_http模块时出错: {str(ie)}")
-                    logger.error(f"错误详情: {traceback.format_exc()}")
-                    raise ImportError(f"Streamable HTTP传输需要MCP SDK 1.8.0及以上版本，错误: {str(ie)}")
-                except Exception as e:
-                    # 捕获其他可能的异常
-                    logger.error(f"创建streamable_http会话时出错: {str(e)}")
-                    logger.error(f"错误详情: {traceback.format_exc()}")
-                    raise Exception(f"创建Streamable HTTP会话失败: {str(e)}")
-            else:
-                raise ValueError(f"不支持的传输类型: {transport_type}")
-
-            # 初始化会话
-            await session.initialize()
-
-            # 获取可用工具
-            response = await session.list_tools()
-            available_tools = {tool.name: tool for tool in response.tools}
-
+            await session.connect(tools=tools)
             logger.info(f"进程 {os.getpid()} 已连接到MCP服务器: {url}")
-            logger.info(f"可用工具: {list(available_tools.keys())}")
-
             return True
         except Exception as e:
             logger.error(f"进程 {os.getpid()} 连接到MCP服务器时出错: {str(e)}")
@@ -121,32 +72,51 @@ def mcp_worker_process(
 
     # 调用工具
     async def call_tool(tool_name: str, arguments: Dict[str, Any]):
-        if not session:
-            return MCPToolResponse(error="MCP会话未初始化")
-
-        if tool_name not in available_tools:
-            return MCPToolResponse(error=f"工具 '{tool_name}' 不可用")
-
         try:
             logger.info(f"进程 {os.getpid()} 正在调用MCP工具: {tool_name}")
             result = await session.call_tool(tool_name, arguments)
             logger.info(f"进程 {os.getpid()} 工具 '{tool_name}' 调用完成")
-            return MCPToolResponse(result=result.content)
+            return MCPToolResponse(result=share_tool_result(result, result_shm_threshold))
         except Exception as e:
             logger.error(f"进程 {os.getpid()} 调用工具 '{tool_name}' 时出错: {str(e)}")
-            return MCPToolResponse(error=str(e))
+            return MCPToolResponse(error=str(e), transport_error=is_transport_error(e))
 
     # 清理资源
     async def cleanup():
-        nonlocal session, exit_stack
+        logger.info(f"进程 {os.getpid()} 正在清理资源")
+        await session.close()
+        logger.info(f"进程 {os.getpid()} 资源清理完成")
 
+    # 处理单个请求，响应带回请求ID，多个请求可以同时进行
+    async def handle_request(request):
         try:
-            if exit_stack:
-                logger.info(f"进程 {os.getpid()} 正在清理资源")
-                await exit_stack.aclose()
-                logger.info(f"进程 {os.getpid()} 资源清理完成")
+            # 处理获取工具列表请求
+            if getattr(request, "is_list_tools_request", False):
+                logger.info(f"进程 {os.getpid()} 收到获取工具列表请求")
+                if getattr(request, "refresh", False):
+                    await session.list_tools(refresh=True)
+                # 返回可序列化的工具列表
+                response = MCPToolResponse(tools=dict(session.available_tools))
+
+            # 处理健康检查请求
+            elif getattr(request, "is_ping_request", False):
+                try:
+                    await session.ping()
+                    response = MCPToolResponse(result="pong")
+                except Exception as e:
+                    response = MCPToolResponse(error=f"ping失败: {str(e)}", transport_error=True)
+
+            # 调用工具并返回结果
+            else:
+                response = await call_tool(request.tool_name, request.arguments)
         except Exception as e:
-            logger.error(f"进程 {os.getpid()} 清理资源时出错: {str(e)}")
+            logger.error(f"进程 {os.getpid()} 处理请求时出错: {str(e)}")
+            response = MCPToolResponse(
+                error=f"处理请求时出错: {str(e)}", transport_error=is_transport_error(e)
+            )
+
+        response.request_id = getattr(request, "request_id", None)
+        response_queue.put(response)
 
     # 主处理循环
     async def main_loop():
@@ -155,57 +125,31 @@ def mcp_worker_process(
             response_queue.put(MCPToolResponse(error="无法连接到MCP服务器"))
             return
 
+        tasks = set()
         try:
             while not shutdown_event.is_set():
                 try:
-                    # 非阻塞方式获取请求，超时后检查shutdown_event
-                    request = request_queue.get(block=True, timeout=0.5)
-
-                    # 处理请求
-                    if request == "SHUTDOWN":
-                        logger.info(f"进程 {os.getpid()} 收到关闭命令")
-                        break
-
-                    # 处理获取工具列表请求
-                    if (
-                        hasattr(request, "is_list_tools_request")
-                        and request.is_list_tools_request
-                    ):
-                        logger.info(f"进程 {os.getpid()} 收到获取工具列表请求")
-                        # 将工具列表转换为可序列化的字典
-                        tools_dict = {}
-                        for name, tool in available_tools.items():
-                            # 提取工具的关键属性
-                            tool_info = {
-                                "name": name,
-                                "description": tool.description
-                                if hasattr(tool, "description")
-                                else "",
-                                "inputSchema": tool.inputSchema
-                                if hasattr(tool, "inputSchema")
-                                else {},
-                            }
-                            tools_dict[name] = tool_info
-
-                        # 返回工具列表
-                        response = MCPToolResponse(tools=tools_dict)
-                        response_queue.put(response)
-                        continue
-
-                    # 调用工具并返回结果
-                    response = await call_tool(request.tool_name, request.arguments)
-                    response_queue.put(response)
-
+                    # 在线程中阻塞读取请求，不影响正在进行的调用，超时后检查shutdown_event
+                    request = await loop.run_in_executor(None, request_queue.get, True, 0.5)
                 except queue.Empty:
                     # 队列为空，继续循环
                     continue
-                except Exception as e:
-                    logger.error(f"进程 {os.getpid()} 处理请求时出错: {str(e)}")
-                    response_queue.put(
-                        MCPToolResponse(error=f"处理请求时出错: {str(e)}")
-                    )
+
+                # 处理请求
+                if request == "SHUTDOWN":
+                    logger.info(f"进程 {os.getpid()} 收到关闭命令")
+                    break
+
+                # 每个请求在独立任务中处理，慢的工具调用不会阻塞其他请求
+                task = asyncio.create_task(handle_request(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
         finally:
-            # 清理资源
+            # 取消未完成的请求并清理资源
+            for task in list(tasks):
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
             await cleanup()
             logger.info(f"进程 {os.getpid()} 已退出")
 
@@ -215,4 +159,64 @@ def mcp_worker_process(
     except Exception as e:
         logger.error(f"进程 {os.getpid()} 主循环出错: {str(e)}")
     finally:
-        loop.close() 
\ No newline at end of file
+        loop.close() 
+
+def preload_mcp_modules() -> None:
+    """预先导入MCP SDK及各传输模块，空闲工作进程在被分配之前完成导入"""
+    import mcp  # noqa: F401
+    from mcp.client import sse, stdio  # noqa: F401
+
+    try:
+        from mcp.client import streamable_http  # noqa: F401
+    except ImportError:
+        pass
+
+
+def mcp_spare_worker_process(
+    request_queue: Queue,
+    response_queue: Queue,
+    shutdown_event,
+    tools_changed=None,
+    result_shm_threshold: int = 0,
+):
+    """
+    预热的空闲MCP工作进程，预先导入MCP SDK后等待分配，
+    收到MCPAssignRequest后连接到指定服务器，之后与mcp_worker_process完全相同
+
+    Args:
+        request_queue: 请求队列，第一个请求为分配请求
+        response_queue: 响应队列
+        shutdown_event: 关闭事件
+        tools_changed: 服务器通知工具列表已变化时设置的事件
+        result_shm_threshold: 工具结果不小于该字节数时通过共享内存返回，0表示不使用
+    """
+    logger = logging.getLogger(f"mcp_worker_{os.getpid()}")
+    logger.setLevel(logging.INFO)
+
+    try:
+        preload_mcp_modules()
+    except ImportError as e:
+        # 导入失败时在分配后连接时报告
+        logger.warning(f"进程 {os.getpid()} 预先导入MCP SDK失败: {str(e)}")
+
+    while not shutdown_event.is_set():
+        try:
+            request = request_queue.get(block=True, timeout=0.5)
+        except queue.Empty:
+            continue
+        if request == "SHUTDOWN":
+            return
+        if isinstance(request, MCPAssignRequest):
+            mcp_worker_process(
+                request.url,
+                request.env,
+                request_queue,
+                response_queue,
+                shutdown_event,
+                request.transport_type,
+                request.tools,
+                tools_changed,
+                result_shm_threshold,
+            )
+            return
+        logger.warning(f"空闲工作进程 {os.getpid()} 在分配前收到请求，已忽略")
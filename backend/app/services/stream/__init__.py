@@ -0,0 +1,16 @@
+"""
+流处理模块，提供聊天流事件的合并、分发以及跨工作进程转发等功能
+"""
+
+from .coalescer import StreamCoalescer
+from .registry import ChatStream, StreamRegistry, stream_registry
+from .relay import StreamRelay, stream_relay
+
+__all__ = [
+    "StreamCoalescer",
+    "ChatStream",
+    "StreamRegistry",
+    "stream_registry",
+    "StreamRelay",
+    "stream_relay",
+]
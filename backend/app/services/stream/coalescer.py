@@ -0,0 +1,164 @@
+"""
+流事件合并模块，在时间窗口或大小窗口内合并连续的内容增量，减少SSE帧数量
+"""
+
+import asyncio
+import logging
+import time
+from typing import AsyncGenerator, AsyncIterator, Dict, Any, List, Optional
+
+from app.services.deepseek.message_processor import StreamEventType
+
+logger = logging.getLogger(__name__)
+
+# 上游事件读完的标记
+_END = object()
+
+
+class _ReadError:
+    """读取上游事件时抛出的异常，由合并器在消费方重新抛出"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StreamCoalescer:
+    """
+    流事件合并器
+
+    将连续的正文/推理增量在时间窗口（如20ms）或大小窗口（如512字节）内合并为一个事件，
+    工具调用、错误和结束事件会先冲刷缓冲区再立即发送
+    """
+
+    # 读取任务与合并器之间的队列长度，消费方跟不上时对上游施加背压
+    QUEUE_SIZE = 256
+
+    def __init__(self, window_ms: int = 20, max_bytes: int = 512):
+        """
+        初始化流事件合并器
+
+        Args:
+            window_ms: 合并时间窗口（毫秒），从缓冲第一个增量开始计算
+            max_bytes: 缓冲内容达到该字节数时立即冲刷
+        """
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_bytes = max_bytes
+        self._content: List[str] = []
+        self._reasoning: List[str] = []
+        self._size = 0
+        self._started_at: Optional[float] = None
+
+    def _buffer(self, event: Dict[str, Any]) -> None:
+        """将增量事件加入缓冲区"""
+        content = event.get("content")
+        reasoning_content = event.get("reasoning_content")
+        if content:
+            self._content.append(content)
+            self._size += len(content.encode("utf-8"))
+        if reasoning_content:
+            self._reasoning.append(reasoning_content)
+            self._size += len(reasoning_content.encode("utf-8"))
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+
+    def _flush(self) -> Optional[Dict[str, Any]]:
+        """取出缓冲区中合并后的增量事件，缓冲区为空时返回None"""
+        if self._started_at is None:
+            return None
+
+        event = {"type": StreamEventType.DELTA}
+        if self._content:
+            event["content"] = "".join(self._content)
+        if self._reasoning:
+            event["reasoning_content"] = "".join(self._reasoning)
+
+        self._content = []
+        self._reasoning = []
+        self._size = 0
+        self._started_at = None
+        return event
+
+    def _remaining(self) -> Optional[float]:
+        """返回当前窗口剩余时间（秒），缓冲区为空时返回None表示无限等待"""
+        if self._started_at is None:
+            return None
+        return max(self.window - (time.monotonic() - self._started_at), 0.0)
+
+    @staticmethod
+    async def _read(iterator: AsyncIterator[Dict[str, Any]], events_queue: asyncio.Queue) -> None:
+        """读取上游事件放入队列，结束或出错时放入结束标记或异常"""
+        try:
+            async for event in iterator:
+                await events_queue.put(event)
+        except Exception as e:
+            await events_queue.put(_ReadError(e))
+            return
+        await events_queue.put(_END)
+
+    async def coalesce(
+        self, events: AsyncIterator[Dict[str, Any]]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        合并流事件
+
+        Args:
+            events: 上游流事件迭代器
+
+        Yields:
+            合并后的流事件
+        """
+        iterator = events.__aiter__()
+        # 由一个长期存在的读取任务把上游事件放入队列，避免每个事件创建一个任务
+        events_queue: asyncio.Queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        reader = asyncio.create_task(self._read(iterator, events_queue))
+
+        try:
+            while True:
+                try:
+                    item = events_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    # 等待下一个事件，窗口到期时先冲刷缓冲区
+                    remaining = self._remaining()
+                    try:
+                        async with asyncio.timeout(remaining):
+                            item = await events_queue.get()
+                    except TimeoutError:
+                        flushed = self._flush()
+                        if flushed:
+                            yield flushed
+                        continue
+
+                if item is _END:
+                    break
+                if isinstance(item, _ReadError):
+                    raise item.error
+
+                event = item
+                if event.get("type", StreamEventType.DELTA) != StreamEventType.DELTA:
+                    # 非增量事件：先冲刷缓冲区，再立即发送
+                    flushed = self._flush()
+                    if flushed:
+                        yield flushed
+                    yield event
+                    continue
+
+                self._buffer(event)
+                if self._size >= self.max_bytes or self._remaining() == 0:
+                    yield self._flush()
+
+            flushed = self._flush()
+            if flushed:
+                yield flushed
+        finally:
+            # 消费方提前结束时，取消读取任务并关闭上游生成器
+            if not reader.done():
+                reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.debug(f"取消上游流读取时出错: {str(e)}")
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
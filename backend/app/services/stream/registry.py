@@ -0,0 +1,419 @@
+"""
+聊天流注册表模块，管理当前工作进程中的生成，支持中止、断开检测和基于Last-Event-ID的断点续传
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Any, Optional, Tuple
+
+from app.core.config import settings
+from app.services.deepseek.message_processor import MessageProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def worker_tag() -> str:
+    """
+    当前工作进程的标识，作为流ID的前缀，用于把重连和中止请求转发到拥有该流的工作进程
+
+    每次调用时读取进程ID，gunicorn在导入应用后fork工作进程时也能得到正确的标识
+
+    Returns:
+        十六进制的进程ID
+    """
+    return f"{os.getpid():x}"
+
+
+def stream_owner(stream_id: str) -> Optional[str]:
+    """
+    从流ID中解析创建该流的工作进程标识
+
+    Args:
+        stream_id: 流ID
+
+    Returns:
+        工作进程标识，流ID格式不正确时返回None
+    """
+    owner, sep, _ = stream_id.partition("-")
+    return owner if sep and owner else None
+
+
+class ChatStream:
+    """
+    一次聊天生成
+
+    生成过程运行在独立任务中，事件按顺序编号后写入有界环形缓冲区。
+    多个订阅方（如断线重连的客户端或另一台设备）可以从任意已缓冲的事件ID处开始订阅，
+    不会产生额外的上游调用
+    """
+
+    def __init__(
+        self,
+        stream_id: str,
+        user_id: int,
+        buffer_size: int = 2048,
+        grace_seconds: float = 15.0,
+    ):
+        """
+        初始化聊天流
+
+        Args:
+            stream_id: 流ID
+            user_id: 所属用户ID
+            buffer_size: 重放缓冲区最多保留的事件数
+            grace_seconds: 所有订阅方断开后等待重连的时间（秒），超时后取消生成
+        """
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.grace_seconds = grace_seconds
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.cancelled = False
+        # 单飞合并使用的请求指纹，相同指纹的重复请求共享本次生成
+        self.request_key: Optional[str] = None
+        self._claimed = False
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._grace_handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        """生成是否已结束"""
+        return self.finished_at is not None
+
+    @property
+    def last_event_id(self) -> int:
+        """最后一个事件的ID"""
+        return self._seq
+
+    @property
+    def replay_complete(self) -> bool:
+        """重放缓冲区是否仍保留了从第一个事件开始的全部事件"""
+        return not self._buffer or self._buffer[0][0] == 1
+
+    @property
+    def subscriber_count(self) -> int:
+        """当前订阅方数量"""
+        return self._subscribers
+
+    def claim(self) -> bool:
+        """
+        声明由调用方启动本次生成，只有第一个调用方会得到True，其余调用方只需订阅
+
+        Returns:
+            是否由调用方负责启动生成
+        """
+        if self._claimed:
+            return False
+        self._claimed = True
+        return True
+
+    def start(
+        self,
+        events: AsyncIterator[Dict[str, Any]],
+        on_finish: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        在独立任务中开始消费上游事件
+
+        Args:
+            events: 上游流事件迭代器
+            on_finish: 生成结束（包括被取消）后调用的回调，如归还并发名额
+        """
+        self._task = asyncio.create_task(self._produce(events))
+        if on_finish is not None:
+            self._task.add_done_callback(lambda _: on_finish())
+
+    def _append(self, event: Dict[str, Any]) -> None:
+        """为事件编号并写入重放缓冲区，通知所有订阅方"""
+        self._seq += 1
+        self._buffer.append((self._seq, event))
+        self._notify()
+
+    def _notify(self) -> None:
+        """唤醒等待中的订阅方"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def close_with_error(self, event: Dict[str, Any]) -> None:
+        """
+        未启动生成就结束聊天流，向所有订阅方发送错误事件和结束标记
+
+        Args:
+            event: 错误事件
+        """
+        self._append(event)
+        self._append(MessageProcessor.DONE_EVENT)
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    async def _produce(self, events: AsyncIterator[Dict[str, Any]]) -> None:
+        """消费上游事件并写入重放缓冲区"""
+        try:
+            async for event in events:
+                self._append(event)
+        except asyncio.CancelledError:
+            logger.info(f"聊天流 {self.stream_id} 已取消")
+            # 通知订阅方生成已结束
+            self._append(MessageProcessor.DONE_EVENT)
+        except Exception as e:
+            logger.error(f"聊天流 {self.stream_id} 生成时出错: {str(e)}")
+            self._append(MessageProcessor.build_error_event(f"处理请求时出错: {str(e)}"))
+        finally:
+            # 取消发生在上游生成器之外时，确保上游生成器被关闭以释放资源
+            aclose = getattr(events, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception as e:
+                    logger.debug(f"关闭聊天流 {self.stream_id} 上游生成器时出错: {str(e)}")
+            self.finished_at = time.monotonic()
+            self._cancel_grace()
+            self._notify()
+
+    async def subscribe(
+        self,
+        last_event_id: int = 0,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        poll_interval: float = 1.0,
+    ) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+        """
+        订阅聊天流，先重放last_event_id之后已缓冲的事件，再实时接收新事件
+
+        Args:
+            last_event_id: 客户端已收到的最后一个事件ID，0表示从头开始
+            is_disconnected: 检查客户端是否已断开的协程函数
+            poll_interval: 客户端断开检测轮询间隔（秒）
+
+        Yields:
+            (事件ID, 流事件字典) 的元组
+        """
+        self._subscribers += 1
+        self._cancel_grace()
+        cursor = last_event_id
+        last_check = time.monotonic()
+
+        try:
+            while True:
+                waiter = self._changed
+
+                # 发送缓冲区中cursor之后的事件
+                if self._buffer:
+                    first_seq = self._buffer[0][0]
+                    if cursor + 1 < first_seq:
+                        logger.warning(
+                            f"聊天流 {self.stream_id} 的事件 {cursor + 1}-{first_seq - 1} "
+                            f"已被移出重放缓冲区"
+                        )
+                    start = max(cursor + 1 - first_seq, 0)
+                    for seq, event in list(itertools.islice(self._buffer, start, None)):
+                        cursor = seq
+                        yield seq, event
+
+                if self.done and cursor >= self._seq:
+                    break
+
+                # 检查客户端是否已断开
+                if is_disconnected is not None and (
+                    time.monotonic() - last_check >= poll_interval
+                ):
+                    last_check = time.monotonic()
+                    if await is_disconnected():
+                        logger.info(f"客户端已断开聊天流 {self.stream_id} 的订阅")
+                        break
+
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self.done:
+                self._schedule_grace_cancel()
+
+    def _schedule_grace_cancel(self) -> None:
+        """所有订阅方断开后，在宽限期结束时取消生成"""
+        self._cancel_grace()
+        if self.grace_seconds <= 0:
+            logger.info(f"聊天流 {self.stream_id} 已无订阅方，取消生成")
+            self.cancel()
+            return
+        logger.info(
+            f"聊天流 {self.stream_id} 已无订阅方，{self.grace_seconds}秒内未重连将取消生成"
+        )
+        self._grace_handle = asyncio.get_running_loop().call_later(
+            self.grace_seconds, self._cancel_if_unattended
+        )
+
+    def _cancel_grace(self) -> None:
+        """取消等待中的宽限期"""
+        if self._grace_handle is not None:
+            self._grace_handle.cancel()
+            self._grace_handle = None
+
+    def _cancel_if_unattended(self) -> None:
+        """宽限期结束时仍无订阅方则取消生成"""
+        self._grace_handle = None
+        if self._subscribers == 0:
+            logger.info(f"聊天流 {self.stream_id} 宽限期内未重连，取消生成")
+            self.cancel()
+
+    def cancel(self) -> bool:
+        """
+        取消生成
+
+        Returns:
+            是否取消了正在进行的生成
+        """
+        if self._task is None or self._task.done():
+            return False
+        self.cancelled = True
+        self._task.cancel()
+        return True
+
+
+class StreamRegistry:
+    """
+    聊天流注册表，按流ID索引当前工作进程中的生成，已结束的流在TTL内保留以便重连
+
+    流ID以当前工作进程的标识开头，其他工作进程据此把请求转发给本进程（见relay模块）
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = 2048,
+        ttl_seconds: float = 120.0,
+        grace_seconds: float = 15.0,
+        single_flight_window: float = 5.0,
+    ):
+        """
+        初始化聊天流注册表
+
+        Args:
+            buffer_size: 每个流的重放缓冲区大小（事件数）
+            ttl_seconds: 生成结束后流的保留时间（秒）
+            grace_seconds: 所有订阅方断开后等待重连的时间（秒）
+            single_flight_window: 生成结束后仍将相同请求合并到该流的时间（秒），
+                负数表示关闭单飞合并
+        """
+        self.buffer_size = buffer_size
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self.single_flight_window = single_flight_window
+        self._streams: Dict[str, ChatStream] = {}
+        # (用户ID, 请求指纹) -> 流ID
+        self._inflight: Dict[Tuple[int, str], str] = {}
+
+    def _purge_expired(self) -> None:
+        """移除结束时间超过TTL的流"""
+        now = time.monotonic()
+        expired = [
+            stream_id
+            for stream_id, stream in self._streams.items()
+            if stream.done and now - stream.finished_at > self.ttl_seconds
+        ]
+        for stream_id in expired:
+            self.remove(stream_id)
+
+    def create(self, user_id: int) -> ChatStream:
+        """
+        创建并注册新的聊天流
+
+        Args:
+            user_id: 所属用户ID
+
+        Returns:
+            新的聊天流
+        """
+        self._purge_expired()
+        stream = ChatStream(
+            f"{worker_tag()}-{uuid.uuid4().hex}",
+            user_id,
+            buffer_size=self.buffer_size,
+            grace_seconds=self.grace_seconds,
+        )
+        self._streams[stream.stream_id] = stream
+        return stream
+
+    def get_or_create(
+        self, user_id: int, request_key: Optional[str] = None
+    ) -> Tuple[ChatStream, bool]:
+        """
+        单飞合并：同一用户的相同请求正在生成（或刚刚结束）时返回已有的流，否则创建新流
+
+        Args:
+            user_id: 所属用户ID
+            request_key: 请求的规范化指纹，为None时总是创建新流
+
+        Returns:
+            (聊天流, 是否新建) 的元组
+        """
+        if request_key is None or self.single_flight_window < 0:
+            return self.create(user_id), True
+
+        self._purge_expired()
+        key = (user_id, request_key)
+        stream_id = self._inflight.get(key)
+        stream = self._streams.get(stream_id) if stream_id else None
+        if stream is not None and not stream.cancelled and stream.replay_complete and (
+            not stream.done
+            or time.monotonic() - stream.finished_at <= self.single_flight_window
+        ):
+            return stream, False
+
+        stream = self.create(user_id)
+        stream.request_key = request_key
+        self._inflight[key] = stream.stream_id
+        return stream, True
+
+    def is_local(self, stream_id: str) -> bool:
+        """流ID是否由当前工作进程创建"""
+        return stream_owner(stream_id) == worker_tag()
+
+    def get(self, stream_id: str) -> Optional[ChatStream]:
+        """根据流ID获取聊天流"""
+        self._purge_expired()
+        return self._streams.get(stream_id)
+
+    def remove(self, stream_id: str) -> None:
+        """移除聊天流"""
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None and stream.request_key is not None:
+            key = (stream.user_id, stream.request_key)
+            if self._inflight.get(key) == stream_id:
+                del self._inflight[key]
+
+    def cancel(self, stream_id: str, user_id: int) -> bool:
+        """
+        中止指定用户的聊天流
+
+        Args:
+            stream_id: 流ID
+            user_id: 发起中止的用户ID，只能中止自己的流
+
+        Returns:
+            是否成功中止
+        """
+        stream = self._streams.get(stream_id)
+        if not stream or stream.user_id != user_id:
+            return False
+        return stream.cancel()
+
+
+# 当前工作进程的全局聊天流注册表
+stream_registry = StreamRegistry(
+    buffer_size=settings.SSE_REPLAY_BUFFER_SIZE,
+    ttl_seconds=settings.SSE_REPLAY_TTL_SECONDS,
+    grace_seconds=settings.SSE_RESUME_GRACE_SECONDS,
+    single_flight_window=(
+        settings.CHAT_SINGLE_FLIGHT_WINDOW_SECONDS if settings.CHAT_SINGLE_FLIGHT_ENABLED else -1
+    ),
+)
@@ -0,0 +1,278 @@
+"""
+聊天流跨工作进程转发模块
+
+gunicorn的每个工作进程只在自己的内存中保存聊天流，而重连、其他设备的订阅和中止请求
+可能落到任意工作进程。每个工作进程在以自身标识命名的Unix域套接字上提供订阅和中止操作，
+流不在当前工作进程时按流ID中的工作进程标识转发给拥有该流的工作进程。
+
+帧格式与MCP网关相同：4字节大端长度前缀加JSON消息体。每个连接只处理一个请求：
+订阅: {"op": "subscribe", "stream_id", "user_id", "last_event_id"}，
+      响应 {"ok": 是否找到}，随后每个事件一帧 {"id": 事件ID, "event": 流事件}，生成结束后关闭连接
+中止: {"op": "cancel", "stream_id", "user_id"}，响应 {"ok": 是否中止}
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.mcp.gateway.protocol import GatewayProtocolError, encode_frame, read_frame
+from .registry import StreamRegistry, stream_owner, stream_registry, worker_tag
+
+logger = logging.getLogger(__name__)
+
+
+class RelayOp:
+    """转发操作类型常量"""
+
+    SUBSCRIBE = "subscribe"
+    CANCEL = "cancel"
+
+
+class StreamRelay:
+    """聊天流转发服务，既在本进程的套接字上响应其他工作进程，也把请求转发给拥有流的工作进程"""
+
+    def __init__(
+        self,
+        registry: StreamRegistry,
+        socket_dir: str,
+        timeout: float = 5.0,
+        poll_interval: float = 1.0,
+    ):
+        """
+        初始化聊天流转发服务
+
+        Args:
+            registry: 当前工作进程的聊天流注册表
+            socket_dir: 各工作进程套接字所在的目录
+            timeout: 连接拥有流的工作进程并等待首个响应的超时时间（秒）
+            poll_interval: 转发订阅时客户端断开检测轮询间隔（秒）
+        """
+        self.registry = registry
+        self.socket_dir = socket_dir
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._socket_path: Optional[str] = None
+
+    def socket_path(self, owner: str) -> str:
+        """指定工作进程的套接字路径"""
+        return os.path.join(self.socket_dir, f"{owner}.sock")
+
+    async def start(self) -> None:
+        """在当前工作进程的套接字上开始监听"""
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        path = self.socket_path(worker_tag())
+        # 进程ID被复用时可能残留已退出进程的套接字文件
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._handle_connection, path=path)
+        # 只允许同一用户的进程访问
+        os.chmod(path, 0o600)
+        self._socket_path = path
+        logger.info(f"聊天流转发服务已启动，监听 {path}")
+
+    async def stop(self) -> None:
+        """停止监听并删除套接字文件"""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._socket_path is not None:
+            try:
+                os.unlink(self._socket_path)
+            except FileNotFoundError:
+                pass
+            self._socket_path = None
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """处理其他工作进程转发来的一个请求"""
+        try:
+            message = await read_frame(reader)
+            if message is None:
+                return
+            op = message.get("op")
+            if op == RelayOp.SUBSCRIBE:
+                await self._serve_subscription(message, reader, writer)
+            elif op == RelayOp.CANCEL:
+                cancelled = self.registry.cancel(message.get("stream_id"), message.get("user_id"))
+                writer.write(encode_frame({"ok": cancelled}))
+                await writer.drain()
+            else:
+                writer.write(encode_frame({"ok": False, "error": f"不支持的操作: {op}"}))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, GatewayProtocolError) as e:
+            logger.debug(f"聊天流转发连接异常关闭: {str(e)}")
+        finally:
+            writer.close()
+
+    async def _serve_subscription(
+        self,
+        message: Dict[str, Any],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """把本进程中聊天流的事件逐帧写给转发方，转发方关闭连接视为客户端断开"""
+        stream = self.registry.get(message.get("stream_id"))
+        if not stream or stream.user_id != message.get("user_id"):
+            writer.write(encode_frame({"ok": False}))
+            await writer.drain()
+            return
+
+        writer.write(encode_frame({"ok": True}))
+        await writer.drain()
+
+        # 转发方在请求之后不再发送数据，读到EOF说明对方已关闭连接
+        eof = asyncio.create_task(reader.read())
+
+        async def is_disconnected() -> bool:
+            return eof.done()
+
+        subscription = stream.subscribe(
+            message.get("last_event_id") or 0,
+            is_disconnected=is_disconnected,
+            poll_interval=self.poll_interval,
+        )
+        try:
+            async with aclosing(subscription):
+                async for event_id, event in subscription:
+                    writer.write(encode_frame({"id": event_id, "event": event}))
+                    await writer.drain()
+        finally:
+            eof.cancel()
+
+    async def _open(
+        self, stream_id: str, message: Dict[str, Any]
+    ) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter, Dict[str, Any]]]:
+        """连接拥有流的工作进程，发送请求并读取首个响应；该进程已退出时返回None"""
+        owner = stream_owner(stream_id)
+        if owner is None:
+            return None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path(owner)), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.info(f"无法连接持有聊天流 {stream_id} 的工作进程 {owner}: {str(e)}")
+            return None
+        try:
+            writer.write(encode_frame(message))
+            await writer.drain()
+            response = await asyncio.wait_for(read_frame(reader), self.timeout)
+        except (
+            OSError,
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            GatewayProtocolError,
+        ) as e:
+            logger.warning(f"转发聊天流 {stream_id} 的请求失败: {str(e)}")
+            writer.close()
+            return None
+        except BaseException:
+            writer.close()
+            raise
+        if response is None:
+            writer.close()
+            return None
+        return reader, writer, response
+
+    async def subscribe(
+        self,
+        stream_id: str,
+        user_id: int,
+        last_event_id: int = 0,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Optional[AsyncGenerator[Tuple[int, Dict[str, Any]], None]]:
+        """
+        订阅其他工作进程中的聊天流
+
+        Args:
+            stream_id: 流ID
+            user_id: 订阅方的用户ID，只能订阅自己的流
+            last_event_id: 客户端已收到的最后一个事件ID
+            is_disconnected: 检查客户端是否已断开的协程函数
+
+        Returns:
+            产出 (事件ID, 流事件字典) 的异步生成器，流不存在或拥有它的工作进程已退出时返回None
+        """
+        opened = await self._open(
+            stream_id,
+            {
+                "op": RelayOp.SUBSCRIBE,
+                "stream_id": stream_id,
+                "user_id": user_id,
+                "last_event_id": last_event_id,
+            },
+        )
+        if opened is None:
+            return None
+        reader, writer, response = opened
+        if not response.get("ok"):
+            writer.close()
+            return None
+        return self._relay_events(stream_id, reader, writer, is_disconnected)
+
+    async def _relay_events(
+        self,
+        stream_id: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+    ) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+        """读取拥有流的工作进程写来的事件，关闭生成器时关闭连接，拥有方随之结束订阅"""
+        # 同一个读取任务跨轮询复用，避免在帧中途取消读取
+        pending: Optional[asyncio.Task] = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.create_task(read_frame(reader))
+                done, _ = await asyncio.wait({pending}, timeout=self.poll_interval)
+                if not done:
+                    if is_disconnected is not None and await is_disconnected():
+                        logger.info(f"客户端已断开转发的聊天流 {stream_id} 的订阅")
+                        break
+                    continue
+                task, pending = pending, None
+                frame = task.result()
+                if frame is None:
+                    break
+                yield frame["id"], frame["event"]
+        except (asyncio.IncompleteReadError, ConnectionError, GatewayProtocolError) as e:
+            # 拥有流的工作进程中途退出，客户端可凭Last-Event-ID重新连接
+            logger.warning(f"转发聊天流 {stream_id} 时连接中断: {str(e)}")
+        finally:
+            if pending is not None:
+                pending.cancel()
+            writer.close()
+
+    async def cancel(self, stream_id: str, user_id: int) -> bool:
+        """
+        中止其他工作进程中的聊天流
+
+        Args:
+            stream_id: 流ID
+            user_id: 发起中止的用户ID，只能中止自己的流
+
+        Returns:
+            是否成功中止
+        """
+        opened = await self._open(
+            stream_id, {"op": RelayOp.CANCEL, "stream_id": stream_id, "user_id": user_id}
+        )
+        if opened is None:
+            return False
+        _, writer, response = opened
+        writer.close()
+        return bool(response.get("ok"))
+
+
+# 当前工作进程的聊天流转发服务
+stream_relay = StreamRelay(
+    stream_registry,
+    settings.SSE_STREAM_RELAY_DIR,
+    timeout=settings.SSE_STREAM_RELAY_TIMEOUT,
+    poll_interval=settings.SSE_DISCONNECT_POLL_INTERVAL,
+)
@@ -0,0 +1,33 @@
+"""
+上游调用治理模块，提供并发准入控制、优先级调度、熔断重试和多端点路由等功能
+"""
+
+from .admission import AdmissionController, AdmissionRejected, admission_controller
+from .circuit_breaker import (
+    CircuitBreaker,
+    CircuitState,
+    UpstreamUnavailableError,
+    circuit_breakers,
+)
+from .retry import backoff_delay, is_retryable_error
+from .router import UpstreamEndpoint, UpstreamRouter, upstream_router
+from .scheduler import UpstreamPriority, UpstreamScheduler, SchedulerSlot, upstream_scheduler
+
+__all__ = [
+    "AdmissionController",
+    "AdmissionRejected",
+    "admission_controller",
+    "UpstreamPriority",
+    "UpstreamScheduler",
+    "SchedulerSlot",
+    "upstream_scheduler",
+    "CircuitBreaker",
+    "CircuitState",
+    "UpstreamUnavailableError",
+    "circuit_breakers",
+    "backoff_delay",
+    "is_retryable_error",
+    "UpstreamEndpoint",
+    "UpstreamRouter",
+    "upstream_router",
+]
@@ -0,0 +1,233 @@
+"""
+上游并发准入控制模块，限制全局和单用户同时进行的上游聊天流数量
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Any
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """准入被拒绝，携带原因和建议的重试等待时间"""
+
+    def __init__(self, reason: str, message: str, retry_after: int):
+        """
+        初始化准入拒绝异常
+
+        Args:
+            reason: 拒绝原因代码，如"user_limit"、"queue_full"、"queue_timeout"
+            message: 面向用户的错误信息
+            retry_after: 建议的重试等待时间（秒）
+        """
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """等待队列中的一个请求"""
+
+    __slots__ = ("user_id", "future", "enqueued_at")
+
+    def __init__(self, user_id: int, future: asyncio.Future):
+        self.user_id = user_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    上游并发准入控制器
+
+    全局并发数达到上限时请求进入有界等待队列（先进先出），等待超时或队列已满时拒绝；
+    单个用户的并发数达到上限时直接拒绝，避免单个用户占满容量
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 64,
+        max_per_user: int = 3,
+        max_queue: int = 128,
+        queue_timeout: float = 10.0,
+    ):
+        """
+        初始化准入控制器
+
+        Args:
+            max_concurrent: 全局最大并发上游流数量
+            max_per_user: 单个用户最大并发上游流数量
+            max_queue: 等待队列最大长度
+            queue_timeout: 在等待队列中的最长等待时间（秒）
+        """
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._active_per_user: Dict[int, int] = {}
+        self._waiters: deque = deque()
+
+        # 指标
+        self._admitted_total = 0
+        self._rejected_total: Dict[str, int] = {}
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._avg_hold = 5.0  # 单个上游流平均持有时间的EWMA（秒），用于估算重试时间
+        self._acquired_at: Dict[int, deque] = {}
+
+    def _has_capacity(self) -> bool:
+        """全局并发是否还有空位"""
+        return self._active < self.max_concurrent
+
+    def _admit(self, user_id: int) -> None:
+        """占用一个并发名额"""
+        self._active += 1
+        self._active_per_user[user_id] = self._active_per_user.get(user_id, 0) + 1
+        self._acquired_at.setdefault(user_id, deque()).append(time.monotonic())
+        self._admitted_total += 1
+
+    def _reject(self, reason: str, message: str) -> AdmissionRejected:
+        """记录并构建拒绝异常"""
+        self._rejected_total[reason] = self._rejected_total.get(reason, 0) + 1
+        return AdmissionRejected(reason, message, self._estimate_retry_after())
+
+    def _estimate_retry_after(self) -> int:
+        """根据排队长度和平均持有时间估算重试等待时间（秒）"""
+        slots_ahead = len(self._waiters) + 1
+        return max(1, math.ceil(self._avg_hold * slots_ahead / max(self.max_concurrent, 1)))
+
+    def _record_wait(self, waited: float) -> None:
+        """记录排队等待时间"""
+        self._wait_count += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    async def acquire(self, user_id: int) -> None:
+        """
+        申请一个上游并发名额，必要时排队等待
+
+        Args:
+            user_id: 用户ID
+
+        Raises:
+            AdmissionRejected: 单用户并发超限、等待队列已满或等待超时
+        """
+        queued = sum(1 for waiter in self._waiters if waiter.user_id == user_id)
+        if self._active_per_user.get(user_id, 0) + queued >= self.max_per_user:
+            raise self._reject("user_limit", "您同时进行的对话过多，请等待当前回复完成后再试")
+
+        # 有空位且没有人排队时直接准入
+        if self._has_capacity() and not self._waiters:
+            self._admit(user_id)
+            self._record_wait(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full", "服务繁忙，请稍后再试")
+
+        waiter = _Waiter(user_id, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        logger.info(f"用户 {user_id} 进入上游准入等待队列，当前队列长度: {len(self._waiters)}")
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            # 超时的同时可能刚好被准入，此时按准入处理
+            if self._remove_waiter(waiter) or not waiter.future.done():
+                raise self._reject("queue_timeout", "服务繁忙，排队超时，请稍后再试")
+        except asyncio.CancelledError:
+            # 排队期间请求被取消：如果已经被准入，归还名额
+            if not self._remove_waiter(waiter) and waiter.future.done():
+                self.release(user_id)
+            raise
+
+        self._record_wait(time.monotonic() - waiter.enqueued_at)
+
+    def _remove_waiter(self, waiter: _Waiter) -> bool:
+        """从等待队列移除请求，返回是否仍在队列中"""
+        try:
+            self._waiters.remove(waiter)
+            return True
+        except ValueError:
+            return False
+
+    def release(self, user_id: int) -> None:
+        """
+        归还一个上游并发名额，并唤醒等待队列中的请求
+
+        Args:
+            user_id: 用户ID
+        """
+        if self._active_per_user.get(user_id, 0) <= 0:
+            logger.warning(f"用户 {user_id} 没有占用上游并发名额，忽略归还")
+            return
+
+        self._active -= 1
+        self._active_per_user[user_id] -= 1
+        if self._active_per_user[user_id] == 0:
+            del self._active_per_user[user_id]
+
+        acquired = self._acquired_at.get(user_id)
+        if acquired:
+            held = time.monotonic() - acquired.popleft()
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            if not acquired:
+                del self._acquired_at[user_id]
+
+        self._wake()
+
+    def _wake(self) -> None:
+        """按先进先出顺序唤醒等待队列中可以准入的请求"""
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if waiter.future.done():
+                continue
+            self._admit(waiter.user_id)
+            waiter.future.set_result(None)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取准入控制指标
+
+        Returns:
+            包含并发数、队列深度、等待时间等的指标字典
+        """
+        return {
+            "active": self._active,
+            "active_users": len(self._active_per_user),
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "oldest_wait_seconds": (
+                round(time.monotonic() - self._waiters[0].enqueued_at, 3)
+                if self._waiters
+                else 0.0
+            ),
+            "admitted_total": self._admitted_total,
+            "rejected_total": dict(self._rejected_total),
+            "wait_avg_seconds": (
+                round(self._wait_total / self._wait_count, 3) if self._wait_count else 0.0
+            ),
+            "wait_max_seconds": round(self._wait_max, 3),
+            "avg_hold_seconds": round(self._avg_hold, 3),
+        }
+
+
+# 当前工作进程的全局上游准入控制器
+admission_controller = AdmissionController(
+    max_concurrent=settings.CHAT_MAX_CONCURRENT_STREAMS,
+    max_per_user=settings.CHAT_MAX_STREAMS_PER_USER,
+    max_queue=settings.CHAT_ADMISSION_QUEUE_SIZE,
+    queue_timeout=settings.CHAT_ADMISSION_QUEUE_TIMEOUT,
+)
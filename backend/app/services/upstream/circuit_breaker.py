@@ -0,0 +1,251 @@
+"""
+上游熔断模块，按错误率和慢调用比例熔断上游，熔断期间快速失败，并通过半开探测自动恢复
+"""
+
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Any
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState:
+    """熔断器状态常量"""
+    CLOSED = "closed"  # 正常放行
+    OPEN = "open"  # 熔断中，快速失败
+    HALF_OPEN = "half_open"  # 放行少量探测请求
+
+
+class UpstreamUnavailableError(Exception):
+    """上游不可用（熔断中或重试耗尽），携带面向用户的提示和建议重试时间"""
+
+    def __init__(self, message: str, retry_after: int = 0):
+        """
+        初始化上游不可用异常
+
+        Args:
+            message: 面向用户的错误信息
+            retry_after: 建议的重试等待时间（秒）
+        """
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    上游熔断器
+
+    在滑动时间窗口内统计调用结果，请求数达到最小值后，错误率或慢调用比例超过阈值即熔断；
+    熔断持续一段时间后进入半开状态，放行少量探测请求，探测全部成功则恢复，任一失败则重新熔断
+    """
+
+    def __init__(
+        self,
+        name: str,
+        error_rate: float = 0.5,
+        slow_seconds: float = 15.0,
+        slow_rate: float = 0.8,
+        min_requests: int = 10,
+        window_seconds: float = 30.0,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 2,
+    ):
+        """
+        初始化熔断器
+
+        Args:
+            name: 熔断器名称，通常为上游端点名称
+            error_rate: 触发熔断的错误率阈值
+            slow_seconds: 首字节耗时超过该值视为慢调用（秒）
+            slow_rate: 触发熔断的慢调用比例阈值
+            min_requests: 窗口内至少有这么多请求才计算比例
+            window_seconds: 滑动统计窗口（秒）
+            open_seconds: 熔断持续时间（秒）
+            half_open_probes: 半开状态下放行的探测请求数
+        """
+        self.name = name
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._outcomes: deque = deque()  # (时间戳, 是否成功, 是否慢调用)
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._rejected_total = 0
+        self._opened_total = 0
+
+    def _trim(self, now: float) -> None:
+        """移除窗口外的统计数据"""
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def retry_after(self) -> int:
+        """熔断剩余时间（秒）"""
+        if self.state != CircuitState.OPEN:
+            return 0
+        remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+    @property
+    def is_open(self) -> bool:
+        """是否处于熔断状态（不消耗半开探测名额）"""
+        if self.state == CircuitState.OPEN:
+            return time.monotonic() - self._opened_at < self.open_seconds
+        if self.state == CircuitState.HALF_OPEN:
+            return self._probes_in_flight >= self.half_open_probes
+        return False
+
+    def allow(self) -> bool:
+        """
+        判断是否放行一次调用，半开状态下会占用一个探测名额
+
+        Returns:
+            是否放行
+        """
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self._rejected_total += 1
+                return False
+            logger.info(f"上游 {self.name} 熔断时间结束，进入半开状态")
+            self.state = CircuitState.HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_probes:
+                self._rejected_total += 1
+                return False
+            self._probes_in_flight += 1
+
+        return True
+
+    def record_success(self, latency: float) -> None:
+        """
+        记录一次成功调用
+
+        Args:
+            latency: 首字节耗时（秒）
+        """
+        slow = latency >= self.slow_seconds
+        if self.state == CircuitState.HALF_OPEN:
+            if slow:
+                self._trip("半开探测响应过慢")
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                logger.info(f"上游 {self.name} 探测成功，熔断器恢复")
+                self.state = CircuitState.CLOSED
+                self._outcomes.clear()
+            return
+
+        self._record(True, slow)
+
+    def record_failure(self) -> None:
+        """记录一次失败调用"""
+        if self.state == CircuitState.HALF_OPEN:
+            self._trip("半开探测失败")
+            return
+        self._record(False, False)
+
+    def record_ignored(self) -> None:
+        """记录一次不计入统计的调用（如请求本身无效），归还半开探测名额"""
+        if self.state == CircuitState.HALF_OPEN and self._probes_in_flight > 0:
+            self._probes_in_flight -= 1
+
+    def _record(self, ok: bool, slow: bool) -> None:
+        """记录调用结果并检查是否需要熔断"""
+        now = time.monotonic()
+        self._outcomes.append((now, ok, slow))
+        self._trim(now)
+
+        if self.state != CircuitState.CLOSED or len(self._outcomes) < self.min_requests:
+            return
+
+        total = len(self._outcomes)
+        failures = sum(1 for _, success, _ in self._outcomes if not success)
+        slow_calls = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+        if failures / total >= self.error_rate:
+            self._trip(f"错误率 {failures}/{total}")
+        elif slow_calls / total >= self.slow_rate:
+            self._trip(f"慢调用比例 {slow_calls}/{total}")
+
+    def _trip(self, reason: str) -> None:
+        """熔断"""
+        logger.warning(f"上游 {self.name} 熔断: {reason}，{self.open_seconds}秒后尝试恢复")
+        self.state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._opened_total += 1
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._outcomes.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取熔断器指标
+
+        Returns:
+            包含状态、窗口内调用统计和熔断次数的指标字典
+        """
+        self._trim(time.monotonic())
+        total = len(self._outcomes)
+        failures = sum(1 for _, success, _ in self._outcomes if not success)
+        return {
+            "state": self.state,
+            "retry_after": self.retry_after(),
+            "window_requests": total,
+            "window_error_rate": round(failures / total, 3) if total else 0.0,
+            "opened_total": self._opened_total,
+            "rejected_total": self._rejected_total,
+        }
+
+
+class CircuitBreakerRegistry:
+    """熔断器注册表，每个上游端点一个熔断器"""
+
+    def __init__(self):
+        """初始化熔断器注册表"""
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        """
+        获取指定上游端点的熔断器，不存在时按配置创建
+
+        Args:
+            name: 上游端点名称
+
+        Returns:
+            熔断器
+        """
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                error_rate=settings.UPSTREAM_BREAKER_ERROR_RATE,
+                slow_seconds=settings.UPSTREAM_BREAKER_SLOW_SECONDS,
+                slow_rate=settings.UPSTREAM_BREAKER_SLOW_RATE,
+                min_requests=settings.UPSTREAM_BREAKER_MIN_REQUESTS,
+                window_seconds=settings.UPSTREAM_BREAKER_WINDOW_SECONDS,
+                open_seconds=settings.UPSTREAM_BREAKER_OPEN_SECONDS,
+                half_open_probes=settings.UPSTREAM_BREAKER_HALF_OPEN_PROBES,
+            )
+            self._breakers[name] = breaker
+        return breaker
+
+    def metrics(self) -> Dict[str, Any]:
+        """获取所有熔断器的指标"""
+        return {name: breaker.metrics() for name, breaker in self._breakers.items()}
+
+
+# 当前工作进程的全局熔断器注册表
+circuit_breakers = CircuitBreakerRegistry()
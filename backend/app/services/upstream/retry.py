@@ -0,0 +1,43 @@
+"""
+上游重试模块，判断错误是否可重试并计算带抖动的退避时间
+"""
+
+import random
+
+import openai
+
+# 可重试的上游错误：连接失败、超时、限流和服务端错误
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    判断上游错误是否可重试（同时也是计入熔断统计的错误）
+
+    Args:
+        error: 上游调用抛出的异常
+
+    Returns:
+        是否可重试
+    """
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    计算带完全抖动（full jitter）的指数退避时间
+
+    Args:
+        attempt: 已重试次数，从0开始
+        base_delay: 基础退避时间（秒）
+        max_delay: 最长退避时间（秒）
+
+    Returns:
+        本次重试前的等待时间（秒）
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
@@ -0,0 +1,252 @@
+"""
+上游路由模块，为每个模型维护一组OpenAI兼容端点，按EWMA延迟和健康状态选择端点，并提供对冲阈值
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional, Sequence
+
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+from .circuit_breaker import circuit_breakers
+
+logger = logging.getLogger(__name__)
+
+# 不同角色端点的选择权重，EWMA延迟乘以该系数后参与排序
+ROLE_PENALTY = {
+    "primary": 1.0,
+    "secondary": 1.3,
+    "mirror": 1.6,
+}
+
+# 通配模型名，适用于所有未单独配置的模型
+ANY_MODEL = "*"
+
+
+class UpstreamEndpoint:
+    """一个OpenAI兼容的上游端点"""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        api_key: str,
+        role: str = "primary",
+        models: Optional[Dict[str, str]] = None,
+    ):
+        """
+        初始化上游端点
+
+        Args:
+            name: 端点名称，全局唯一
+            base_url: API基础URL
+            api_key: API密钥
+            role: 端点角色，可以是"primary"、"secondary"或"mirror"
+            models: 模型名映射，用于自建镜像使用不同模型名的情况
+        """
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.role = role if role in ROLE_PENALTY else "primary"
+        self.models = models or {}
+        self.healthy = True
+        self.ewma_ttfb: Optional[float] = None
+        self.in_flight = 0
+        self._client: Optional[AsyncOpenAI] = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """该端点共享的API客户端（每个工作进程一个），复用连接池"""
+        if self._client is None:
+            # 关闭SDK自带的重试，重试和熔断统计统一由调用方（UPSTREAM_MAX_RETRIES）负责
+            self._client = AsyncOpenAI(
+                api_key=self.api_key, base_url=self.base_url, max_retries=0
+            )
+        return self._client
+
+    def model_name(self, model: str) -> str:
+        """返回该端点上对应的模型名"""
+        return self.models.get(model, model)
+
+    def score(self) -> float:
+        """端点的选择得分，越小越优先"""
+        # 尚无延迟数据的端点给一个中性值，让它有机会被选中并积累数据
+        latency = self.ewma_ttfb if self.ewma_ttfb is not None else 1.0
+        return latency * ROLE_PENALTY[self.role] * (1 + 0.1 * self.in_flight)
+
+
+class UpstreamRouter:
+    """
+    上游路由器
+
+    未配置UPSTREAM_ENDPOINTS时使用DEEPSEEK_API_BASE作为唯一端点
+    """
+
+    def __init__(self, endpoint_configs: Dict[str, List[Dict[str, Any]]]):
+        """
+        初始化上游路由器
+
+        Args:
+            endpoint_configs: 模型名到端点配置列表的映射，模型名"*"表示适用于所有模型
+        """
+        self._endpoints: Dict[str, UpstreamEndpoint] = {}
+        self._model_endpoints: Dict[str, List[UpstreamEndpoint]] = {}
+        self._ttfb_samples: Dict[str, deque] = {}
+        self._health_task: Optional[asyncio.Task] = None
+
+        if not endpoint_configs:
+            endpoint_configs = {
+                ANY_MODEL: [
+                    {
+                        "name": "default",
+                        "base_url": settings.DEEPSEEK_API_BASE,
+                        "api_key": settings.DEEPSEEK_API_KEY,
+                    }
+                ]
+            }
+
+        for model, configs in endpoint_configs.items():
+            endpoints = []
+            for config in configs:
+                name = config.get("name") or config.get("base_url")
+                endpoint = self._endpoints.get(name)
+                if endpoint is None:
+                    endpoint = UpstreamEndpoint(
+                        name=name,
+                        base_url=config.get("base_url", settings.DEEPSEEK_API_BASE),
+                        api_key=config.get("api_key", settings.DEEPSEEK_API_KEY),
+                        role=config.get("role", "primary"),
+                        models=config.get("models"),
+                    )
+                    self._endpoints[name] = endpoint
+                endpoints.append(endpoint)
+            self._model_endpoints[model] = endpoints
+
+    def endpoints_for(self, model: str) -> List[UpstreamEndpoint]:
+        """返回模型配置的所有端点"""
+        return self._model_endpoints.get(model) or self._model_endpoints.get(ANY_MODEL, [])
+
+    def select(
+        self, model: str, exclude: Sequence[UpstreamEndpoint] = ()
+    ) -> List[UpstreamEndpoint]:
+        """
+        按优先顺序返回可用的候选端点
+
+        健康且未熔断的端点按得分排序在前；全部不可用时仍返回未熔断的端点作为兜底
+
+        Args:
+            model: 模型名称
+            exclude: 需要排除的端点（如本次请求已失败的端点）
+
+        Returns:
+            候选端点列表
+        """
+        candidates = [
+            endpoint
+            for endpoint in self.endpoints_for(model)
+            if endpoint not in exclude and not circuit_breakers.get(endpoint.name).is_open
+        ]
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+        return sorted(healthy or candidates, key=lambda endpoint: endpoint.score())
+
+    def record_ttfb(self, endpoint: UpstreamEndpoint, model: str, seconds: float) -> None:
+        """
+        记录端点的首字节耗时
+
+        Args:
+            endpoint: 上游端点
+            model: 模型名称
+            seconds: 首字节耗时（秒）
+        """
+        alpha = settings.UPSTREAM_EWMA_ALPHA
+        if endpoint.ewma_ttfb is None:
+            endpoint.ewma_ttfb = seconds
+        else:
+            endpoint.ewma_ttfb = alpha * seconds + (1 - alpha) * endpoint.ewma_ttfb
+        endpoint.healthy = True
+        self._ttfb_samples.setdefault(model, deque(maxlen=512)).append(seconds)
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """
+        计算对冲请求的触发阈值：近期首字节耗时的p95，限制在配置的上下限内
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            对冲阈值（秒），未启用对冲时返回None
+        """
+        if not settings.UPSTREAM_HEDGE_ENABLED:
+            return None
+
+        samples = self._ttfb_samples.get(model)
+        if not samples or len(samples) < settings.UPSTREAM_HEDGE_MIN_SAMPLES:
+            return settings.UPSTREAM_HEDGE_MAX_DELAY
+
+        ordered = sorted(samples)
+        p95 = ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)]
+        return min(
+            max(p95, settings.UPSTREAM_HEDGE_MIN_DELAY), settings.UPSTREAM_HEDGE_MAX_DELAY
+        )
+
+    async def _check_endpoint(self, endpoint: UpstreamEndpoint) -> None:
+        """主动检查端点健康状态"""
+        try:
+            await asyncio.wait_for(endpoint.client.models.list(), timeout=10.0)
+            if not endpoint.healthy:
+                logger.info(f"上游端点 {endpoint.name} 已恢复")
+            endpoint.healthy = True
+        except Exception as e:
+            if endpoint.healthy:
+                logger.warning(f"上游端点 {endpoint.name} 健康检查失败: {str(e)}")
+            endpoint.healthy = False
+
+    async def _health_loop(self, interval: float) -> None:
+        """周期性检查所有端点的健康状态"""
+        while True:
+            await asyncio.gather(
+                *(self._check_endpoint(endpoint) for endpoint in self._endpoints.values())
+            )
+            await asyncio.sleep(interval)
+
+    def start_health_checks(self) -> None:
+        """启动后台健康检查（只有一个端点时没有必要检查）"""
+        interval = settings.UPSTREAM_HEALTH_CHECK_INTERVAL
+        if interval <= 0 or len(self._endpoints) < 2 or self._health_task is not None:
+            return
+        self._health_task = asyncio.create_task(self._health_loop(interval))
+
+    async def stop_health_checks(self) -> None:
+        """停止后台健康检查"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取路由指标
+
+        Returns:
+            每个端点的健康状态、EWMA首字节耗时和进行中的请求数
+        """
+        return {
+            name: {
+                "role": endpoint.role,
+                "healthy": endpoint.healthy,
+                "ewma_ttfb_seconds": (
+                    round(endpoint.ewma_ttfb, 3) if endpoint.ewma_ttfb is not None else None
+                ),
+                "in_flight": endpoint.in_flight,
+            }
+            for name, endpoint in self._endpoints.items()
+        }
+
+
+# 当前工作进程的全局上游路由器
+upstream_router = UpstreamRouter(settings.UPSTREAM_ENDPOINTS)
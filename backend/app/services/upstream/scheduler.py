@@ -0,0 +1,278 @@
+"""
+上游调用调度模块，按优先级类别加权公平地分配上游并发，优先完成进行中的智能体回合
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamPriority:
+    """上游调用优先级类别常量"""
+    AGENT = "agent"  # 进行中的智能体回合（工具调用后的后续请求），优先完成
+    INTERACTIVE = "interactive"  # 交互式聊天
+    BATCH = "batch"  # 批量或后台生成
+
+
+class _LatencyStats:
+    """固定窗口的延迟统计，用于计算平均值和分位数"""
+
+    __slots__ = ("samples", "count", "total")
+
+    def __init__(self, window: int = 1024):
+        self.samples: deque = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float) -> None:
+        """记录一个延迟样本"""
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, q: float) -> float:
+        """计算窗口内样本的分位数"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(int(q * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+    def summary(self) -> Dict[str, Any]:
+        """获取统计摘要"""
+        return {
+            "count": self.count,
+            "avg_seconds": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_seconds": round(self.percentile(0.5), 3),
+            "p99_seconds": round(self.percentile(0.99), 3),
+        }
+
+
+class _Waiter:
+    """等待调度的上游调用"""
+
+    __slots__ = ("priority", "user_id", "future", "enqueued_at")
+
+    def __init__(self, priority: str, user_id: Optional[int], future: asyncio.Future):
+        self.priority = priority
+        self.user_id = user_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class SchedulerSlot:
+    """已分配的上游调用名额，release可重复调用"""
+
+    __slots__ = ("_scheduler", "priority", "released")
+
+    def __init__(self, scheduler: "UpstreamScheduler", priority: str):
+        self._scheduler = scheduler
+        self.priority = priority
+        self.released = False
+
+    def release(self) -> None:
+        """归还名额"""
+        if not self.released:
+            self.released = True
+            self._scheduler._release()
+
+
+class UpstreamScheduler:
+    """
+    上游调用调度器
+
+    并发名额用尽时，等待中的调用按类别权重进行步幅调度（stride scheduling），
+    同一类别内按用户轮转，保证用户间公平；等待时间超过饥饿阈值的调用会被优先调度
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 48,
+        weights: Optional[Dict[str, int]] = None,
+        starvation_seconds: float = 5.0,
+    ):
+        """
+        初始化上游调用调度器
+
+        Args:
+            max_concurrent: 最大并发上游调用数量
+            weights: 各优先级类别的权重，权重越大分到的名额越多
+            starvation_seconds: 饥饿保护阈值（秒），等待超过该时间的调用优先调度
+        """
+        self.max_concurrent = max_concurrent
+        self.weights = {
+            UpstreamPriority.AGENT: 8,
+            UpstreamPriority.INTERACTIVE: 4,
+            UpstreamPriority.BATCH: 1,
+            **(weights or {}),
+        }
+        self.starvation_seconds = starvation_seconds
+
+        self._active = 0
+        # 每个类别：用户ID -> 该用户的等待队列，OrderedDict用于用户间轮转
+        self._queues: Dict[str, OrderedDict] = {p: OrderedDict() for p in self.weights}
+        self._passes: Dict[str, float] = {p: 1.0 / w for p, w in self.weights.items()}
+        self._waiting = 0
+
+        self._wait_stats: Dict[str, _LatencyStats] = {p: _LatencyStats() for p in self.weights}
+        self._ttft_stats: Dict[str, _LatencyStats] = {p: _LatencyStats() for p in self.weights}
+        self._starvation_promotions = 0
+
+    def _normalize(self, priority: str) -> str:
+        """未知类别按交互式处理"""
+        return priority if priority in self.weights else UpstreamPriority.INTERACTIVE
+
+    async def acquire(
+        self, priority: str = UpstreamPriority.INTERACTIVE, user_id: Optional[int] = None
+    ) -> SchedulerSlot:
+        """
+        申请一个上游调用名额
+
+        Args:
+            priority: 优先级类别
+            user_id: 用户ID，用于同类别内的用户间公平
+
+        Returns:
+            已分配的名额，调用结束后必须release
+        """
+        priority = self._normalize(priority)
+
+        if self._active < self.max_concurrent and self._waiting == 0:
+            self._active += 1
+            self._wait_stats[priority].record(0.0)
+            return SchedulerSlot(self, priority)
+
+        waiter = _Waiter(priority, user_id, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        self._waiting += 1
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已被调度但调用方取消，归还名额
+                self._release()
+            else:
+                self._remove(waiter)
+            raise
+
+        self._wait_stats[priority].record(time.monotonic() - waiter.enqueued_at)
+        return SchedulerSlot(self, priority)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        """从等待队列中移除调用"""
+        user_queues = self._queues[waiter.priority]
+        user_queue = user_queues.get(waiter.user_id)
+        if user_queue is None:
+            return
+        try:
+            user_queue.remove(waiter)
+            self._waiting -= 1
+        except ValueError:
+            return
+        if not user_queue:
+            del user_queues[waiter.user_id]
+
+    def _release(self) -> None:
+        """归还名额并调度等待中的调用"""
+        self._active -= 1
+        self._dispatch()
+
+    def _pick_starving(self) -> Optional[str]:
+        """返回队首等待时间超过饥饿阈值且等待最久的类别"""
+        now = time.monotonic()
+        starving, oldest = None, None
+        for priority, user_queues in self._queues.items():
+            for user_queue in user_queues.values():
+                enqueued_at = user_queue[0].enqueued_at
+                if now - enqueued_at >= self.starvation_seconds and (
+                    oldest is None or enqueued_at < oldest
+                ):
+                    starving, oldest = priority, enqueued_at
+        return starving
+
+    def _pick_class(self) -> Optional[str]:
+        """按步幅调度选择下一个类别"""
+        candidates = [p for p, user_queues in self._queues.items() if user_queues]
+        if not candidates:
+            return None
+
+        starving = self._pick_starving()
+        if starving is not None:
+            self._starvation_promotions += 1
+            return starving
+
+        priority = min(candidates, key=lambda p: (self._passes[p], -self.weights[p]))
+        # 空闲类别重新参与调度时不能积累过多额度
+        floor = min(self._passes[p] for p in candidates)
+        self._passes[priority] = max(self._passes[priority], floor) + 1.0 / self.weights[priority]
+        return priority
+
+    def _dispatch(self) -> None:
+        """在有空闲名额时调度等待中的调用"""
+        while self._active < self.max_concurrent:
+            priority = self._pick_class()
+            if priority is None:
+                return
+
+            # 同类别内按用户轮转：取第一个用户的队首调用，然后把该用户移到末尾
+            user_queues = self._queues[priority]
+            user_id, user_queue = next(iter(user_queues.items()))
+            waiter = user_queue.popleft()
+            self._waiting -= 1
+            if user_queue:
+                user_queues.move_to_end(user_id)
+            else:
+                del user_queues[user_id]
+
+            if waiter.future.done():
+                continue
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def record_ttft(self, priority: str, seconds: float) -> None:
+        """
+        记录首个token的延迟
+
+        Args:
+            priority: 优先级类别
+            seconds: 从申请名额到收到首个token的时间（秒）
+        """
+        self._ttft_stats[self._normalize(priority)].record(seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取调度指标
+
+        Returns:
+            包含并发数、各类别队列深度、等待时间和首token延迟的指标字典
+        """
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "waiting": self._waiting,
+            "starvation_promotions": self._starvation_promotions,
+            "classes": {
+                priority: {
+                    "weight": self.weights[priority],
+                    "queue_depth": sum(len(q) for q in self._queues[priority].values()),
+                    "wait": self._wait_stats[priority].summary(),
+                    "ttft": self._ttft_stats[priority].summary(),
+                }
+                for priority in self.weights
+            },
+        }
+
+
+# 当前工作进程的全局上游调用调度器
+upstream_scheduler = UpstreamScheduler(
+    max_concurrent=settings.UPSTREAM_MAX_CONCURRENT_CALLS,
+    weights=settings.UPSTREAM_PRIORITY_WEIGHTS,
+    starvation_seconds=settings.UPSTREAM_STARVATION_SECONDS,
+)
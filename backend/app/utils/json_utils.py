@@ -0,0 +1,76 @@
+"""
+JSON序列化工具，优先使用更快的JSON后端（orjson），不可用时回退到标准库
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+# 当前使用的JSON后端名称，便于日志和排查
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    将对象序列化为紧凑的UTF-8 JSON字节串，非ASCII字符不转义
+
+    Args:
+        obj: 要序列化的对象
+
+    Returns:
+        UTF-8编码的JSON字节串
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_canonical(obj: Any) -> bytes:
+    """
+    将对象序列化为键有序的紧凑JSON字节串，相同内容总得到相同结果，可用于计算哈希
+
+    Args:
+        obj: 要序列化的对象
+
+    Returns:
+        UTF-8编码的JSON字节串
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True
+    ).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """
+    将对象序列化为紧凑的JSON字符串，非ASCII字符不转义
+
+    Args:
+        obj: 要序列化的对象
+
+    Returns:
+        JSON字符串
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Any) -> Any:
+    """
+    反序列化JSON字符串或字节串
+
+    Args:
+        data: JSON字符串或字节串
+
+    Returns:
+        反序列化后的对象
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,21 @@
+"""
+Token估算工具，在无法获得上游usage时按字符换算比例估算token数量
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数量
+
+    按DeepSeek官方换算比例估算：1个中文字符约0.6个token，1个英文字符约0.3个token
+
+    Args:
+        text: 要估算的文本
+
+    Returns:
+        估算的token数量
+    """
+    if not text:
+        return 0
+    cjk_chars = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return int(cjk_chars * 0.6 + (len(text) - cjk_chars) * 0.3) + 1
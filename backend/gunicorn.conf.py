@@ -22,3 +22,32 @@ proc_name = "carrot-backend"
 # 最大请求数
 max_requests = 1000
 max_requests_jitter = 50
+
+
+# MCP网关：启用时由主进程启动一个网关进程，所有工作进程共享
+_mcp_gateway_process = None
+
+
+def on_starting(server):
+    """主进程启动时按配置启动MCP网关"""
+    global _mcp_gateway_process
+    from app.core.config import settings
+
+    if settings.MCP_GATEWAY_ENABLED and settings.MCP_GATEWAY_AUTOSTART:
+        import subprocess
+        import sys
+
+        _mcp_gateway_process = subprocess.Popen(
+            [sys.executable, "-m", "app.services.mcp.gateway"]
+        )
+        server.log.info(f"已启动MCP网关进程 PID: {_mcp_gateway_process.pid}")
+
+
+def on_exit(server):
+    """主进程退出时关闭MCP网关"""
+    if _mcp_gateway_process is not None and _mcp_gateway_process.poll() is None:
+        _mcp_gateway_process.terminate()
+        try:
+            _mcp_gateway_process.wait(timeout=5)
+        except Exception:
+            _mcp_gateway_process.kill()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+MCP客户端运行模式基准
+分别以独立进程（process）和进程内（inprocess）模式连接同一个MCP服务器，
+对比连接耗时、单次工具调用延迟（p50/p95）和内存占用（当前进程及其子进程的RSS之和，仅Linux）
+
+用法: python scripts/bench_mcp_modes.py --url http://localhost:8001/sse --tool echo
+      [--arguments '{"text": "hi"}'] [--transport sse] [--calls 200] [--concurrency 1]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# 将项目根目录添加到路径
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BASE_DIR))
+
+from app.services.mcp.client import MultiprocessMCPClientService  # noqa: E402
+from app.services.mcp.inprocess_client import InProcessMCPClientService  # noqa: E402
+from app.services.mcp.models import MCPClientMode  # noqa: E402
+
+CLIENT_CLASSES = {
+    MCPClientMode.PROCESS: MultiprocessMCPClientService,
+    MCPClientMode.INPROCESS: InProcessMCPClientService,
+}
+
+
+def _rss_kb(pid: int) -> int:
+    """读取进程的RSS（KB），进程不存在时返回0"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid: int) -> list:
+    """递归获取子进程ID"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+    result = list(children)
+    for child in children:
+        result.extend(_children(child))
+    return result
+
+
+def total_rss_mb() -> float:
+    """当前进程及全部子进程的RSS之和（MB）"""
+    pid = os.getpid()
+    return sum(_rss_kb(p) for p in [pid] + _children(pid)) / 1024
+
+
+async def bench_mode(mode: str, args: argparse.Namespace) -> dict:
+    """对一种运行模式执行基准"""
+    rss_before = total_rss_mb()
+    client = CLIENT_CLASSES[mode](url=args.url, transport_type=args.transport, env={})
+
+    start = time.perf_counter()
+    if not await client.connect():
+        raise RuntimeError(f"{mode} 模式连接失败")
+    connect_ms = (time.perf_counter() - start) * 1000
+
+    arguments = json.loads(args.arguments)
+    latencies = []
+    # 独立进程模式的客户端共用一个响应队列，不支持并发调用
+    concurrency = 1 if mode == MCPClientMode.PROCESS else args.concurrency
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_call():
+        async with semaphore:
+            call_start = time.perf_counter()
+            await client.call_tool(args.tool, arguments)
+            latencies.append((time.perf_counter() - call_start) * 1000)
+
+    try:
+        # 预热
+        await one_call()
+        latencies.clear()
+        await asyncio.gather(*[one_call() for _ in range(args.calls)])
+        rss_after = total_rss_mb()
+    finally:
+        await client.disconnect()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "connect_ms": connect_ms,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "rss_mb": rss_after - rss_before,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="MCP客户端运行模式基准")
+    parser.add_argument("--url", required=True, help="MCP服务器URL")
+    parser.add_argument("--tool", required=True, help="调用的工具名称")
+    parser.add_argument("--arguments", default="{}", help="工具参数（JSON）")
+    parser.add_argument("--transport", default="sse", help="传输类型")
+    parser.add_argument("--calls", type=int, default=200, help="工具调用次数")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发调用数（仅inprocess模式）")
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'connect(ms)':>12} {'p50(ms)':>9} {'p95(ms)':>9} {'+rss(MB)':>9}")
+    for mode in (MCPClientMode.PROCESS, MCPClientMode.INPROCESS):
+        result = await bench_mode(mode, args)
+        print(
+            f"{result['mode']:>10} {result['connect_ms']:>12.1f} {result['p50_ms']:>9.2f} "
+            f"{result['p95_ms']:>9.2f} {result['rss_mb']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
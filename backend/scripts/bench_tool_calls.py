@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+流式工具调用累积微基准
+模拟逐token到达的工具调用参数增量，对比旧的“复制列表+字符串拼接”累积方式与
+ToolCallAccumulator的耗时，token数翻倍时新实现的耗时应大致翻倍（线性）
+
+用法: python scripts/bench_tool_calls.py [--tokens 50000] [--calls 4]
+"""
+
+import argparse
+import gc
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 将项目根目录添加到路径
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BASE_DIR))
+
+from app.services.mcp.tool_handler import ToolCallAccumulator  # noqa: E402
+
+
+def build_deltas(tokens: int, calls: int):
+    """构造模拟的工具调用增量序列，每个工具调用的参数是一个长字符串字段"""
+    per_call = max(tokens // calls, 2)
+    deltas = []
+    for index in range(calls):
+        function = SimpleNamespace(name=f"tool_{index}", arguments='{"text": "')
+        deltas.append([SimpleNamespace(index=index, id=f"call_{index}", function=function)])
+        for _ in range(per_call - 2):
+            function = SimpleNamespace(name=None, arguments="abcd")
+            deltas.append([SimpleNamespace(index=index, id=None, function=function)])
+        function = SimpleNamespace(name=None, arguments='"}')
+        deltas.append([SimpleNamespace(index=index, id=None, function=function)])
+    return deltas
+
+
+def legacy_accumulate(deltas):
+    """旧实现：每个增量复制列表，参数用字符串拼接"""
+    tool_calls = []
+    for delta_tool_calls in deltas:
+        updated = tool_calls.copy()
+        for tool_call in delta_tool_calls:
+            if tool_call.index >= len(updated):
+                updated.append(
+                    {
+                        "id": tool_call.id or "",
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    }
+                )
+            if tool_call.function.name:
+                updated[tool_call.index]["function"]["name"] = tool_call.function.name
+            if tool_call.function.arguments:
+                updated[tool_call.index]["function"]["arguments"] += tool_call.function.arguments
+        tool_calls = updated
+    return tool_calls
+
+
+def accumulator_accumulate(deltas):
+    """新实现：按index索引的累积器，参数片段完成时拼接一次"""
+    accumulator = ToolCallAccumulator()
+    for delta_tool_calls in deltas:
+        accumulator.add_deltas(delta_tool_calls)
+        accumulator.pop_ready()
+    return accumulator.to_list()
+
+
+def measure(func, deltas, repeat: int = 3) -> float:
+    """返回多次运行中的最短耗时（秒），计时期间关闭垃圾回收以减少抖动"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func(deltas)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="流式工具调用累积微基准")
+    parser.add_argument("--tokens", type=int, default=50000, help="最大模拟token数")
+    parser.add_argument("--calls", type=int, default=4, help="工具调用数")
+    args = parser.parse_args()
+
+    print(f"{'tokens':>8} {'legacy(ms)':>12} {'accumulator(ms)':>16}")
+    tokens = max(args.tokens // 8, args.calls * 2)
+    while tokens <= args.tokens:
+        deltas = build_deltas(tokens, args.calls)
+        assert legacy_accumulate(deltas) == accumulator_accumulate(deltas)
+        legacy = measure(legacy_accumulate, deltas)
+        accumulated = measure(accumulator_accumulate, deltas)
+        print(f"{tokens:>8} {legacy * 1000:>12.2f} {accumulated * 1000:>16.2f}")
+        tokens *= 2
+
+
+if __name__ == "__main__":
+    main()